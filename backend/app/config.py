@@ -24,6 +24,11 @@ class Settings(BaseSettings):
     jwt_algorithm: str = Field(default="HS256", alias="JWT_ALGORITHM")
     jwt_expiration_days: int = Field(default=30, alias="JWT_EXPIRATION_DAYS")
     
+    # Chat History Write-Behind
+    history_write_behind: bool = Field(default=True, alias="HISTORY_WRITE_BEHIND")
+    history_flush_interval_ms: int = Field(default=1000, alias="HISTORY_FLUSH_INTERVAL_MS")
+    history_flush_batch_size: int = Field(default=100, alias="HISTORY_FLUSH_BATCH_SIZE")
+    
     # Google OAuth
     google_client_id: Optional[str] = Field(default=None, alias="GOOGLE_CLIENT_ID")
     google_client_secret: Optional[str] = Field(default=None, alias="GOOGLE_CLIENT_SECRET")
@@ -36,14 +41,66 @@ class Settings(BaseSettings):
     model_path: str = Field(default="./models/phi3-finetuned", alias="MODEL_PATH")
     use_gpu: bool = Field(default=True, alias="USE_GPU")
     max_tokens: int = Field(default=1000, alias="MAX_TOKENS")
+    context_window: int = Field(default=4096, alias="CONTEXT_WINDOW")
     temperature: float = Field(default=0.7, alias="TEMPERATURE")
     use_quantization: bool = Field(default=True, alias="USE_QUANTIZATION")
+    cpu_quantization: str = Field(default="none", alias="CPU_QUANTIZATION")
+    quantized_cache_dir: str = Field(default="./models/quantized", alias="QUANTIZED_CACHE_DIR")
+    mmap_weights: bool = Field(default=True, alias="MMAP_WEIGHTS")
+    inference_backend: str = Field(default="torch", alias="INFERENCE_BACKEND")
+    onnx_model_dir: str = Field(default="./models/onnx", alias="ONNX_MODEL_DIR")
+    draft_model_name: Optional[str] = Field(default=None, alias="DRAFT_MODEL_NAME")
+    speculative_lookahead: int = Field(default=5, alias="SPECULATIVE_LOOKAHEAD")
+    compile_enabled: bool = Field(default=False, alias="COMPILE_ENABLED")
+    compile_prompt_buckets: str = Field(default="256,512,1024,2048", alias="COMPILE_PROMPT_BUCKETS")
+    prefix_cache_enabled: bool = Field(default=True, alias="PREFIX_CACHE_ENABLED")
+    warmup_enabled: bool = Field(default=False, alias="WARMUP_ENABLED")
+    
+    # Inference Executor
+    inference_workers: int = Field(default=1, alias="INFERENCE_WORKERS")
+    inference_queue_size: int = Field(default=16, alias="INFERENCE_QUEUE_SIZE")
+    
+    # Inference Server (set the URL to use one shared model process)
+    inference_server_url: Optional[str] = Field(default=None, alias="INFERENCE_SERVER_URL")
+    inference_server_timeout_seconds: float = Field(default=120.0, alias="INFERENCE_SERVER_TIMEOUT_SECONDS")
+    inference_server_max_connections: int = Field(default=32, alias="INFERENCE_SERVER_MAX_CONNECTIONS")
+    
+    # Replica Pool (REPLICA_COUNT > 1 runs one Phi-3 process per core set)
+    replica_count: int = Field(default=1, alias="REPLICA_COUNT")
+    replica_threads: int = Field(default=0, alias="REPLICA_THREADS")
+    replica_dispatch: str = Field(default="least_loaded", alias="REPLICA_DISPATCH")
+    replica_max_pending: int = Field(default=4, alias="REPLICA_MAX_PENDING")
+    
+    # Admission Control (chat endpoints)
+    admission_enabled: bool = Field(default=True, alias="ADMISSION_ENABLED")
+    admission_max_in_flight: int = Field(default=4, alias="ADMISSION_MAX_IN_FLIGHT")
+    admission_max_queue: int = Field(default=32, alias="ADMISSION_MAX_QUEUE")
+    admission_max_queue_time_seconds: float = Field(default=30.0, alias="ADMISSION_MAX_QUEUE_TIME_SECONDS")
+    
+    # Dynamic Batching
+    batching_enabled: bool = Field(default=False, alias="BATCHING_ENABLED")
+    batch_max_size: int = Field(default=8, alias="BATCH_MAX_SIZE")
+    batch_wait_ms: int = Field(default=10, alias="BATCH_WAIT_MS")
+    
+    # Backend Circuit Breakers
+    circuit_failure_threshold: int = Field(default=3, alias="CIRCUIT_FAILURE_THRESHOLD")
+    circuit_reset_timeout_seconds: float = Field(default=30.0, alias="CIRCUIT_RESET_TIMEOUT_SECONDS")
+    circuit_half_open_max_calls: int = Field(default=1, alias="CIRCUIT_HALF_OPEN_MAX_CALLS")
     
     # Embedding Model
     embedding_model: str = Field(
         default="sentence-transformers/all-MiniLM-L6-v2",
         alias="EMBEDDING_MODEL"
     )
+    query_embedding_cache_size: int = Field(default=1024, alias="QUERY_EMBEDDING_CACHE_SIZE")
+    embedding_store_enabled: bool = Field(default=True, alias="EMBEDDING_STORE_ENABLED")
+    embedding_store_dir: str = Field(default="./embedding_store", alias="EMBEDDING_STORE_DIR")
+    
+    # Semantic Answer Cache
+    semantic_cache_enabled: bool = Field(default=True, alias="SEMANTIC_CACHE_ENABLED")
+    semantic_cache_max_entries: int = Field(default=1000, alias="SEMANTIC_CACHE_MAX_ENTRIES")
+    semantic_cache_ttl_seconds: int = Field(default=3600, alias="SEMANTIC_CACHE_TTL_SECONDS")
+    semantic_cache_max_distance: float = Field(default=0.08, alias="SEMANTIC_CACHE_MAX_DISTANCE")
     
     # Vector Store
     chroma_persist_dir: str = Field(default="./chroma_db", alias="CHROMA_PERSIST_DIR")
@@ -51,6 +108,15 @@ class Settings(BaseSettings):
     # Gemini Fallback
     gemini_api_key_1: Optional[str] = Field(default=None, alias="GEMINI_API_KEY_1")
     gemini_api_key_2: Optional[str] = Field(default=None, alias="GEMINI_API_KEY_2")
+    gemini_api_base_url: str = Field(default="https://generativelanguage.googleapis.com", alias="GEMINI_API_BASE_URL")
+    gemini_timeout_seconds: float = Field(default=30.0, alias="GEMINI_TIMEOUT_SECONDS")
+    gemini_max_connections: int = Field(default=20, alias="GEMINI_MAX_CONNECTIONS")
+    gemini_key_rpm: int = Field(default=15, alias="GEMINI_KEY_RPM")
+    gemini_key_tpm: int = Field(default=1000000, alias="GEMINI_KEY_TPM")
+    gemini_max_attempts: int = Field(default=3, alias="GEMINI_MAX_ATTEMPTS")
+    gemini_backoff_base_seconds: float = Field(default=1.0, alias="GEMINI_BACKOFF_BASE_SECONDS")
+    gemini_backoff_max_seconds: float = Field(default=30.0, alias="GEMINI_BACKOFF_MAX_SECONDS")
+    gemini_request_deadline_seconds: float = Field(default=45.0, alias="GEMINI_REQUEST_DEADLINE_SECONDS")
     
     # Server
     host: str = Field(default="0.0.0.0", alias="HOST")
@@ -91,3 +157,7 @@ def get_settings() -> Settings:
 
 # Export settings instance for easy import
 settings = get_settings()
+
+# Default system prompt, shared by the chat router and Phi3Client. Kept here
+# (torch-free) because the prefix KV cache only hits on an exact match.
+DEFAULT_SYSTEM_PROMPT = "You are an intelligent AI Study Buddy, an educational assistant designed to help students learn effectively. You provide clear, accurate, and helpful explanations on various academic topics. Be encouraging, patient, and thorough in your responses. Use examples when helpful and break down complex concepts into understandable parts."
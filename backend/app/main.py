@@ -4,11 +4,15 @@ AI Study Buddy Backend - FastAPI Application Entry Point
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
 import logging
+import sys
 
 from app.config import settings
-from app.database import connect_to_mongo, close_mongo_connection
+from app.database import connect_to_mongo, close_mongo_connection, database
+from app.services.history_writer import start_history_writer, stop_history_writer
+from app.services.warmup import get_warmup_manager
 from app.routers import auth, chat, user, admin, db
 
 # Configure logging
@@ -19,6 +23,35 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+async def shutdown_ml_workers():
+    """Stop background inference workers that were actually started"""
+    # Only touch modules already loaded: importing them would pull in the
+    # whole ML package (torch, transformers, chromadb) just to shut down
+    inference_client = sys.modules.get("app.ml.inference_client")
+    if inference_client is not None:
+        await inference_client.shutdown_inference_client()
+
+    batch_scheduler = sys.modules.get("app.ml.batch_scheduler")
+    if batch_scheduler is not None:
+        await batch_scheduler.shutdown_batch_scheduler()
+
+    inference_executor = sys.modules.get("app.ml.inference_executor")
+    if inference_executor is not None:
+        inference_executor.shutdown_inference_executor()
+
+    replica_pool = sys.modules.get("app.ml.replica_pool")
+    if replica_pool is not None:
+        replica_pool.shutdown_replica_pool()
+
+
+async def shutdown_gemini():
+    """Close the Gemini client's pooled connections if it was ever used"""
+    # Avoid importing the ML package (and torch) just to shut down
+    gemini_fallback = sys.modules.get("app.ml.gemini_fallback")
+    if gemini_fallback is not None:
+        await gemini_fallback.shutdown_gemini_client()
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
@@ -29,14 +62,24 @@ async def lifespan(app: FastAPI):
     logger.info("Starting AI Study Buddy Backend...")
     await connect_to_mongo()
     logger.info("Connected to MongoDB")
+    await start_history_writer()
     
-    # Lazy load ML model (only when first request comes in)
+    # ML models load lazily on first request unless warm-up is enabled
     logger.info(f"ML Model configured: {settings.model_name}")
+    get_warmup_manager().start(
+        ml_available=chat.check_ml_available(),
+        phi3_available=chat.check_phi3_available()
+    )
     
     yield
     
     # Shutdown
     logger.info("Shutting down AI Study Buddy Backend...")
+    await get_warmup_manager().stop()
+    # Flush buffered chat history first, while the grace period lasts
+    await stop_history_writer()
+    await shutdown_ml_workers()
+    await shutdown_gemini()
     await close_mongo_connection()
     logger.info("Disconnected from MongoDB")
 
@@ -105,6 +148,23 @@ async def health_check():
     }
 
 
+@app.get("/ready", tags=["Root"])
+async def readiness_check():
+    """
+    Readiness check for load balancers.
+    
+    Returns 503 until MongoDB is connected and ML warm-up has finished.
+    """
+    state = get_warmup_manager().get_state()
+    state["database"] = "connected" if database.db is not None else "disconnected"
+    
+    if not state["ready"] or database.db is None:
+        state["ready"] = False
+        return JSONResponse(status_code=503, content=state)
+    
+    return state
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
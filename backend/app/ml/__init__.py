@@ -1,16 +1,25 @@
 """
 ML Package - Machine Learning components
+
+Exports load on first access, so torch-free modules such as
+app.ml.inference_client can be imported without the ML stack.
 """
 
-from app.ml.phi3_client import Phi3Client, get_phi3_client
-from app.ml.embeddings import EmbeddingService, get_embedding_service
-from app.ml.rag_service import RAGService, get_rag_service
+import importlib
+
+_EXPORTS = {
+    "Phi3Client": "app.ml.phi3_client",
+    "get_phi3_client": "app.ml.phi3_client",
+    "EmbeddingService": "app.ml.embeddings",
+    "get_embedding_service": "app.ml.embeddings",
+    "RAGService": "app.ml.rag_service",
+    "get_rag_service": "app.ml.rag_service"
+}
+
+__all__ = list(_EXPORTS)
+
 
-__all__ = [
-    "Phi3Client",
-    "get_phi3_client",
-    "EmbeddingService", 
-    "get_embedding_service",
-    "RAGService",
-    "get_rag_service"
-]
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(_EXPORTS[name]), name)
@@ -0,0 +1,235 @@
+"""
+Batch Scheduler
+Collects concurrent chat requests into batched Phi-3 generate calls
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.ml.inference_executor import get_inference_executor
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _BatchRequest:
+    """A single pending generation request"""
+    prompt: str
+    system_prompt: Optional[str]
+    context: Optional[List[str]]
+    max_tokens: int
+    temperature: float
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+class BatchScheduler:
+    """
+    Dynamic batching for local generation.
+
+    Requests wait up to `max_wait_ms` for others to arrive, then up to
+    `max_batch_size` of them are padded into one `generate_batch()` call
+    on the inference executor. A new batch is only formed when a worker
+    is free, so requests that arrive while the model is busy are batched
+    together on the next round.
+    """
+
+    def __init__(self, phi3_client, max_batch_size: int = 8, max_wait_ms: int = 10):
+        self.phi3 = phi3_client
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0, max_wait_ms) / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_slots: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+        self._running_batches = set()
+
+        # Metrics
+        self._batches = 0
+        self._requests = 0
+        self._failed = 0
+        self._total_queue_wait = 0.0
+        self._total_batch_time = 0.0
+        self._output_tokens = 0
+
+    def start(self):
+        """Start the collector task on the running event loop"""
+        if self._task is not None and not self._task.done():
+            return
+
+        self._queue = asyncio.Queue()
+        self._worker_slots = asyncio.Semaphore(get_inference_executor().max_workers)
+        self._task = asyncio.get_running_loop().create_task(self._collect_loop())
+        logger.info(
+            f"Batch scheduler started (max batch {self.max_batch_size}, "
+            f"wait {self.max_wait * 1000:.0f}ms)"
+        )
+
+    async def stop(self):
+        """Stop collecting and fail any requests still waiting"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if self._queue is not None:
+            while not self._queue.empty():
+                request = self._queue.get_nowait()
+                if not request.future.done():
+                    request.future.set_exception(RuntimeError("Batch scheduler stopped"))
+
+    def submit(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        context: Optional[List[str]] = None
+    ) -> asyncio.Future:
+        """
+        Queue a prompt for batched generation.
+
+        Returns:
+            Future resolving to (response_text, token_usage)
+        """
+        self.start()
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(_BatchRequest(
+            prompt=prompt,
+            system_prompt=system_prompt,
+            context=context,
+            max_tokens=max_tokens or settings.max_tokens,
+            temperature=temperature or settings.temperature,
+            future=future
+        ))
+        return future
+
+    async def _collect_loop(self):
+        """Form batches whenever a worker is free and requests are waiting"""
+        while True:
+            await self._worker_slots.acquire()
+            try:
+                batch = [await self._queue.get()]
+                deadline = time.perf_counter() + self.max_wait
+
+                while len(batch) < self.max_batch_size:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+
+                # Drain anything else that is already waiting
+                while len(batch) < self.max_batch_size and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+            except BaseException:
+                self._worker_slots.release()
+                raise
+
+            task = asyncio.create_task(self._run_batch(batch))
+            self._running_batches.add(task)
+            task.add_done_callback(self._running_batches.discard)
+
+    async def _run_batch(self, batch: List[_BatchRequest]):
+        """Run one collected batch, split by sampling parameters"""
+        try:
+            groups: Dict[Tuple[int, float], List[_BatchRequest]] = {}
+            for request in batch:
+                if request.future.cancelled():
+                    continue
+                groups.setdefault((request.max_tokens, request.temperature), []).append(request)
+
+            for (max_tokens, temperature), requests in groups.items():
+                await self._run_group(requests, max_tokens, temperature)
+        finally:
+            self._worker_slots.release()
+
+    async def _run_group(self, requests: List[_BatchRequest], max_tokens: int, temperature: float):
+        """Generate for requests sharing the same sampling parameters"""
+        started_at = time.perf_counter()
+        for request in requests:
+            self._total_queue_wait += started_at - request.enqueued_at
+
+        try:
+            results = await get_inference_executor().run(
+                self.phi3.generate_batch,
+                [r.prompt for r in requests],
+                max_tokens,
+                temperature,
+                [r.system_prompt for r in requests],
+                [r.context for r in requests]
+            )
+        except Exception as e:
+            self._failed += len(requests)
+            for request in requests:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+        finally:
+            self._batches += 1
+            self._requests += len(requests)
+            self._total_batch_time += time.perf_counter() - started_at
+
+        for request, result in zip(requests, results):
+            self._output_tokens += result[1].get("output", 0)
+            if not request.future.done():
+                request.future.set_result(result)
+
+    def get_stats(self) -> Dict:
+        """Get batching throughput and queue-wait metrics"""
+        return {
+            "enabled": True,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "batches": self._batches,
+            "requests": self._requests,
+            "failed": self._failed,
+            "avg_batch_size": round(self._requests / self._batches, 2) if self._batches else 0.0,
+            "avg_queue_wait_ms": round(
+                self._total_queue_wait / self._requests * 1000, 2
+            ) if self._requests else 0.0,
+            "tokens_per_second": round(
+                self._output_tokens / self._total_batch_time, 2
+            ) if self._total_batch_time else 0.0
+        }
+
+
+# Singleton instance
+_batch_scheduler: Optional[BatchScheduler] = None
+
+
+def get_batch_scheduler() -> BatchScheduler:
+    """
+    Get the batch scheduler singleton.
+    The collector task starts on the first submitted request.
+    """
+    global _batch_scheduler
+
+    if _batch_scheduler is None:
+        from app.ml.phi3_client import get_phi3_client
+        _batch_scheduler = BatchScheduler(
+            get_phi3_client(),
+            max_batch_size=settings.batch_max_size,
+            max_wait_ms=settings.batch_wait_ms
+        )
+
+    return _batch_scheduler
+
+
+async def shutdown_batch_scheduler():
+    """Stop the batch scheduler if it was started"""
+    global _batch_scheduler
+
+    if _batch_scheduler is not None:
+        await _batch_scheduler.stop()
+        _batch_scheduler = None
@@ -0,0 +1,191 @@
+"""
+Compiled Decoding
+torch.compile with a static KV cache and bucketed prompt lengths
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+import torch
+
+try:
+    from transformers import StaticCache
+except ImportError:
+    StaticCache = None
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CompiledDecoder:
+    """
+    Runs Phi-3's forward pass through torch.compile with fixed shapes.
+
+    - The KV cache is a StaticCache sized to the full context window, so
+      every decode step sees the same tensor shapes.
+    - Prompts are left-padded up to the next length bucket that still
+      leaves room for the answer, so prefill only ever sees a handful of
+      shapes. Longer prompts are padded to `context_window - max_new_tokens`,
+      one extra shape for the usual MAX_TOKENS.
+
+    Each shape compiles once (during warm-up) and is reused afterwards.
+    Only calls that carry a StaticCache (the bucketed single-sequence path
+    set up by generate_kwargs()) go through the compiled forward; anything
+    else, such as batched generation with a DynamicCache, stays eager so it
+    never triggers recompiles.
+    """
+
+    def __init__(self, model, tokenizer, device: str, buckets: List[int], context_window: int):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.context_window = context_window
+        self.buckets = sorted({b for b in buckets if 0 < b < context_window})
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+        # Metrics
+        self._requests = 0
+        self._padding_tokens = 0
+        self._bucket_hits: Dict[int, int] = {}
+        self._compile_seconds: Optional[float] = None
+
+    @staticmethod
+    def is_supported(model) -> bool:
+        """Static caches need transformers >= 4.38 and a model that accepts them"""
+        return StaticCache is not None and getattr(model, "_supports_static_cache", False)
+
+    def compile(self):
+        """Route the model's static-cache forward calls through torch.compile"""
+        # One graph per bucket for prefill, the overflow shape and the decode step
+        torch._dynamo.config.cache_size_limit = max(
+            torch._dynamo.config.cache_size_limit,
+            len(self.buckets) + 8
+        )
+        eager_forward = self.model.forward
+        compiled_forward = torch.compile(eager_forward, dynamic=False, fullgraph=False)
+
+        def forward(*args, **kwargs):
+            if isinstance(kwargs.get("past_key_values"), StaticCache):
+                return compiled_forward(*args, **kwargs)
+            return eager_forward(*args, **kwargs)
+
+        self.model.forward = forward
+
+    def bucket_for(self, length: int, max_new_tokens: int) -> int:
+        """Smallest bucket that holds the prompt and leaves room for the answer"""
+        limit = self.context_window - max_new_tokens
+        for bucket in self.buckets:
+            if length <= bucket <= limit:
+                return bucket
+        return max(length, limit)
+
+    def pad_inputs(self, inputs, max_new_tokens: int):
+        """Left-pad a single tokenized prompt up to its bucket length"""
+        length = inputs["input_ids"].shape[1]
+        bucket = self.bucket_for(length, max_new_tokens)
+
+        with self._lock:
+            self._requests += 1
+            self._padding_tokens += bucket - length
+            self._bucket_hits[bucket] = self._bucket_hits.get(bucket, 0) + 1
+
+        return self._pad_to(inputs, bucket)
+
+    def _pad_to(self, inputs, length: int):
+        """Left-pad input ids (pad token) and attention mask (zeros) to `length`"""
+        input_ids = inputs["input_ids"]
+        attention_mask = inputs["attention_mask"]
+        pad = length - input_ids.shape[1]
+        if pad <= 0:
+            return inputs
+
+        inputs["input_ids"] = torch.cat([
+            torch.full((1, pad), self.tokenizer.pad_token_id, dtype=input_ids.dtype, device=input_ids.device),
+            input_ids
+        ], dim=1)
+        inputs["attention_mask"] = torch.cat([
+            torch.zeros((1, pad), dtype=attention_mask.dtype, device=attention_mask.device),
+            attention_mask
+        ], dim=1)
+        return inputs
+
+    def generate_kwargs(self) -> dict:
+        """generate() kwargs using this thread's reset static cache"""
+        cache = getattr(self._local, "cache", None)
+        if cache is None:
+            cache = StaticCache(
+                config=self.model.config,
+                max_batch_size=1,
+                max_cache_len=self.context_window,
+                device=self.device,
+                dtype=self.model.dtype
+            )
+            self._local.cache = cache
+        else:
+            cache.reset()
+        return {"past_key_values": cache}
+
+    def warmup(self, max_new_tokens: int):
+        """
+        Compile every prefill shape and the decode step up front.
+
+        Args:
+            max_new_tokens: The usual answer length (sets the overflow shape)
+        """
+        started_at = time.perf_counter()
+        limit = self.context_window - max_new_tokens
+        shapes = [b for b in self.buckets if b <= limit] + [limit]
+
+        for shape in shapes:
+            inputs = self.tokenizer("warm up", return_tensors="pt").to(self.device)
+            inputs = self._pad_to(inputs, shape)
+
+            with torch.no_grad():
+                self.model.generate(
+                    **inputs,
+                    **self.generate_kwargs(),
+                    max_new_tokens=2,
+                    do_sample=False,
+                    pad_token_id=self.tokenizer.pad_token_id
+                )
+            logger.info(f"Compiled prefill shape {shape}")
+
+        self._compile_seconds = time.perf_counter() - started_at
+        logger.info(f"torch.compile warm-up took {self._compile_seconds:.1f}s for {len(shapes)} prefill shape(s)")
+
+    def get_stats(self) -> Dict:
+        """Get bucket usage and padding overhead"""
+        with self._lock:
+            return {
+                "enabled": True,
+                "buckets": self.buckets,
+                "compiled": self._compile_seconds is not None,
+                "compile_seconds": round(self._compile_seconds, 1) if self._compile_seconds is not None else None,
+                "requests": self._requests,
+                "bucket_hits": dict(self._bucket_hits),
+                "avg_padding_tokens": round(
+                    self._padding_tokens / self._requests, 1
+                ) if self._requests else 0.0
+            }
+
+
+def create_compiled_decoder(model, tokenizer, device: str) -> Optional[CompiledDecoder]:
+    """Set up compiled decoding when COMPILE_ENABLED, or return None if unsupported"""
+    if not settings.compile_enabled:
+        return None
+
+    if not CompiledDecoder.is_supported(model):
+        logger.warning("COMPILE_ENABLED ignored - this transformers/model combination has no static KV cache")
+        return None
+
+    buckets = [int(b) for b in settings.compile_prompt_buckets.split(",") if b.strip()]
+    decoder = CompiledDecoder(model, tokenizer, device, buckets, settings.context_window)
+    decoder.compile()
+    logger.info(f"Compiled decoding enabled (prompt buckets {decoder.buckets})")
+    if not settings.warmup_enabled:
+        logger.warning("WARMUP_ENABLED is off - graphs will compile on the first requests")
+    return decoder
@@ -0,0 +1,161 @@
+"""
+CPU Quantization
+Dynamic int8 and bf16 loading paths for CPU-only inference
+"""
+
+import hashlib
+import logging
+import os
+import time
+from typing import Optional
+
+import torch
+from torch import nn
+from torch.ao.nn.quantized import dynamic as nnqd
+from transformers import AutoConfig, AutoModelForCausalLM
+
+try:
+    from transformers.modeling_utils import no_init_weights
+except ImportError:
+    no_init_weights = None
+
+from app.config import settings
+from app.ml.model_loading import load_causal_lm, local_model_dir
+
+logger = logging.getLogger(__name__)
+
+CPU_QUANTIZATION_MODES = ("none", "bf16", "int8")
+
+
+def _model_stamp(model_path: str) -> str:
+    """
+    Version of a model's weights: the snapshot commit hash for hub models,
+    else the newest mtime of its config and weight files.
+    """
+    model_dir = local_model_dir(model_path)
+    if model_dir is None:
+        # Not downloaded yet - ask the hub which revision will be fetched
+        try:
+            from huggingface_hub import HfApi
+            return HfApi().model_info(model_path).sha
+        except Exception as e:
+            logger.warning(f"Could not resolve the revision of {model_path}: {e}")
+            return "hub"
+
+    model_dir = os.path.normpath(model_dir)
+    if os.path.basename(os.path.dirname(model_dir)) == "snapshots":
+        return os.path.basename(model_dir)
+
+    weight_files = [
+        os.path.join(model_dir, name)
+        for name in os.listdir(model_dir)
+        if name == "config.json" or name.endswith((".safetensors", ".bin"))
+    ]
+    return str(max((os.path.getmtime(path) for path in weight_files), default=os.path.getmtime(model_dir)))
+
+
+def _cache_path(model_path: str, mode: str) -> str:
+    """
+    Location of the cached quantized weights for a model.
+
+    The key covers the model location, its weights' version (so a new
+    fine-tune or hub revision invalidates the cache) and the torch
+    version, since packed int8 weights are not portable across releases.
+    """
+    key = f"{model_path}|{_model_stamp(model_path)}|{torch.__version__}|{mode}"
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    name = os.path.basename(os.path.normpath(model_path)).replace("/", "_") or "model"
+    return os.path.join(settings.quantized_cache_dir, f"{name}-{mode}-{digest}.pt")
+
+
+def _swap_linear_layers(module: nn.Module):
+    """Replace every nn.Linear with an empty dynamic int8 Linear of the same shape"""
+    for name, child in module.named_children():
+        if type(child) is nn.Linear:
+            setattr(module, name, nnqd.Linear(
+                child.in_features,
+                child.out_features,
+                bias_=child.bias is not None,
+                dtype=torch.qint8
+            ))
+        else:
+            _swap_linear_layers(child)
+
+
+def _load_int8_from_cache(model_path: str, cache_file: str) -> nn.Module:
+    """
+    Rebuild the int8 model from cached weights without re-quantizing.
+
+    The skeleton is created in bf16 without weight init, linear layers are
+    swapped for empty int8 ones, and the cached state dict is loaded on top.
+    Peak memory is roughly the bf16 model instead of the full fp32 one.
+    """
+    config = AutoConfig.from_pretrained(model_path, trust_remote_code=True)
+
+    if no_init_weights is not None:
+        with no_init_weights():
+            model = AutoModelForCausalLM.from_config(config, trust_remote_code=True, torch_dtype=torch.bfloat16)
+    else:
+        model = AutoModelForCausalLM.from_config(config, trust_remote_code=True, torch_dtype=torch.bfloat16)
+
+    _swap_linear_layers(model)
+    model = model.float()
+    model.load_state_dict(torch.load(cache_file, map_location="cpu"))
+    return model
+
+
+def _quantize_and_cache(model_path: str, cache_file: str) -> nn.Module:
+    """Load fp32 weights, quantize linear layers to int8 and cache the result"""
+    model = load_causal_lm(model_path, torch.float32)
+
+    started_at = time.perf_counter()
+    model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    logger.info(f"Dynamic int8 quantization took {time.perf_counter() - started_at:.1f}s")
+
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = cache_file + ".tmp"
+        torch.save(model.state_dict(), tmp_file)
+        os.replace(tmp_file, cache_file)
+        logger.info(f"Cached quantized weights at {cache_file}")
+    except Exception as e:
+        logger.warning(f"Could not cache quantized weights: {e}")
+
+    return model
+
+
+def load_cpu_model(model_path: str, mode: Optional[str] = None) -> nn.Module:
+    """
+    Load a causal LM for CPU inference with the configured quantization.
+
+    Args:
+        model_path: Local path or hub name of the model
+        mode: "none" (fp32), "bf16" or "int8"; defaults to CPU_QUANTIZATION
+
+    Returns:
+        Model in eval mode on CPU
+    """
+    mode = (mode or settings.cpu_quantization).lower()
+    if mode not in CPU_QUANTIZATION_MODES:
+        raise ValueError(f"Unknown CPU_QUANTIZATION '{mode}', expected one of {CPU_QUANTIZATION_MODES}")
+
+    if mode == "int8":
+        cache_file = _cache_path(model_path, mode)
+        if os.path.exists(cache_file):
+            logger.info(f"Loading cached int8 weights from {cache_file}")
+            try:
+                model = _load_int8_from_cache(model_path, cache_file)
+            except Exception as e:
+                logger.warning(f"Cached int8 weights unusable ({e}) - re-quantizing")
+                model = _quantize_and_cache(model_path, cache_file)
+        else:
+            model = _quantize_and_cache(model_path, cache_file)
+    else:
+        model = load_causal_lm(
+            model_path,
+            torch.bfloat16 if mode == "bf16" else torch.float32,
+            mmap_weights=settings.mmap_weights
+        )
+
+    model.eval()
+    return model
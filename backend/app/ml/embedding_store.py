@@ -0,0 +1,148 @@
+"""
+Embedding Store
+Persistent, content-addressed cache of document embeddings for indexing
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+VECTORS_FILE = "vectors.f32"
+INDEX_FILE = "index.json"
+
+
+def content_key(text: str, model_name: str) -> str:
+    """Content address of a chunk's embedding: sha256(model name + text)"""
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    On-disk embedding cache keyed by content hash.
+
+    Vectors live in one append-only float32 file per model, read through
+    a memory map, and `index.json` lists the key of each row. Chunks whose
+    text and model are unchanged are served from disk, so re-indexing only
+    embeds the delta. The store only grows; delete its directory to
+    reclaim space.
+
+    Writes are meant for one indexing process at a time.
+
+    Args:
+        directory: Root directory of the store
+        model_name: Embedding model the vectors belong to
+        dimension: Embedding size of that model
+    """
+
+    def __init__(self, directory: str, model_name: str, dimension: int):
+        self.model_name = model_name
+        self.dimension = dimension
+        self.directory = os.path.join(directory, re.sub(r"[^A-Za-z0-9_.-]+", "--", model_name))
+        self._rows: Dict[str, int] = {}
+        self._vectors: Optional[np.memmap] = None
+        self._lock = threading.Lock()
+
+        # Metrics
+        self._reused = 0
+        self._added = 0
+
+        self._load()
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.directory, VECTORS_FILE)
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.join(self.directory, INDEX_FILE)
+
+    def _load(self):
+        """Read the index and drop vector rows a crashed write left unindexed"""
+        if not os.path.exists(self._index_path):
+            if os.path.exists(self._vectors_path):
+                os.remove(self._vectors_path)
+            return
+
+        with open(self._index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+
+        keys = index.get("keys", [])
+        row_bytes = self.dimension * 4
+        size = os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+
+        if index.get("dimension") != self.dimension or size < len(keys) * row_bytes:
+            logger.warning(f"Embedding store at {self.directory} does not match its index - starting empty")
+            keys = []
+        if size > len(keys) * row_bytes:
+            with open(self._vectors_path, "r+b") as f:
+                f.truncate(len(keys) * row_bytes)
+
+        self._rows = {key: row for row, key in enumerate(keys)}
+        logger.info(f"Embedding store loaded: {len(self._rows)} vectors ({self.directory})")
+
+    def _map(self) -> np.memmap:
+        """Memory-map the vectors file (lock held)"""
+        if self._vectors is None:
+            self._vectors = np.memmap(
+                self._vectors_path,
+                dtype=np.float32,
+                mode="r",
+                shape=(len(self._rows), self.dimension)
+            )
+        return self._vectors
+
+    def get_many(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        """Stored vector for each key, or None where it is missing"""
+        with self._lock:
+            if not self._rows:
+                return [None] * len(keys)
+
+            vectors = self._map()
+            found = [np.array(vectors[self._rows[k]]) if k in self._rows else None for k in keys]
+            self._reused += sum(v is not None for v in found)
+            return found
+
+    def put_many(self, keys: List[str], vectors: np.ndarray):
+        """Append new vectors and persist the index"""
+        with self._lock:
+            new = {k: v for k, v in zip(keys, vectors) if k not in self._rows}
+            if not new:
+                return
+
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._vectors_path, "ab") as f:
+                f.write(np.stack(list(new.values())).astype(np.float32).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+            for key in new:
+                self._rows[key] = len(self._rows)
+
+            ordered = sorted(self._rows, key=self._rows.get)
+            tmp_path = self._index_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"model": self.model_name, "dimension": self.dimension, "keys": ordered}, f)
+            os.replace(tmp_path, self._index_path)
+
+            # Remap on next read to cover the new rows
+            self._vectors = None
+            self._added += len(new)
+
+    def get_stats(self) -> Dict:
+        """Get store size and reuse counters"""
+        with self._lock:
+            return {
+                "directory": self.directory,
+                "vectors": len(self._rows),
+                "dimension": self.dimension,
+                "reused": self._reused,
+                "added": self._added
+            }
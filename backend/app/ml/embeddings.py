@@ -4,24 +4,99 @@ Handles text embeddings for RAG (Retrieval-Augmented Generation)
 """
 
 from sentence_transformers import SentenceTransformer
-from typing import List, Optional, Union
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Union
 import numpy as np
 import logging
+import threading
+import unicodedata
 
 from app.config import settings
+from app.ml.embedding_store import EmbeddingStore, content_key
 
 logger = logging.getLogger(__name__)
 
 
+def normalize_query(query: str) -> str:
+    """Canonical form of a query for cache lookups (Unicode + whitespace)"""
+    return " ".join(unicodedata.normalize("NFKC", query).split())
+
+
+class QueryEmbeddingCache:
+    """
+    Thread-safe, capacity-bounded LRU cache of query embeddings.
+
+    Keys are (model name, normalized query), so switching EMBEDDING_MODEL
+    never serves vectors from another model. Cached arrays are read-only;
+    copy before modifying in place.
+    """
+    
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        
+        # Metrics
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+    
+    def get(self, key: Tuple[str, str]) -> Optional[np.ndarray]:
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is None:
+                self._misses += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return embedding
+    
+    def put(self, key: Tuple[str, str], embedding: np.ndarray):
+        embedding.setflags(write=False)
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def get_stats(self) -> Dict:
+        """Get cache size and hit/miss counters"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "enabled": True,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "evictions": self._evictions
+            }
+
+
 class EmbeddingService:
     """
     Service for generating text embeddings using sentence-transformers.
     Used for semantic search in RAG pipeline.
+    
+    Query embeddings are kept in an LRU cache (QUERY_EMBEDDING_CACHE_SIZE)
+    so repeated questions skip the model's forward pass.
     """
     
     def __init__(self):
         self.model = None
         self._initialized = False
+        self.query_cache: Optional[QueryEmbeddingCache] = None
+        self.store: Optional[EmbeddingStore] = None
+        if settings.query_embedding_cache_size > 0:
+            self.query_cache = QueryEmbeddingCache(settings.query_embedding_cache_size)
     
     def initialize(self):
         """Initialize the embedding model"""
@@ -72,25 +147,73 @@ class EmbeddingService:
         """
         Generate embedding optimized for queries (semantic search).
         
+        Served from the query cache when the same normalized query was
+        embedded recently.
+        
         Args:
             query: Search query text
             
         Returns:
-            numpy array embedding
+            numpy array embedding (read-only when caching is enabled)
         """
-        return self.embed_text(query)
+        if self.query_cache is None:
+            return self.embed_text(query)
+        
+        normalized = normalize_query(query)
+        key = (settings.embedding_model, normalized)
+        embedding = self.query_cache.get(key)
+        if embedding is None:
+            embedding = self.embed_text(normalized)
+            self.query_cache.put(key, embedding)
+        
+        return embedding
     
     def embed_documents(self, documents: List[str]) -> np.ndarray:
         """
         Generate embeddings optimized for documents.
         
+        With the embedding store enabled, chunks embedded before by the
+        same model are read from disk and only the rest go to the model.
+        
         Args:
             documents: List of document texts
             
         Returns:
             numpy array of embeddings
         """
-        return self.embed_texts(documents)
+        store = self.get_store()
+        if store is None or not documents:
+            return self.embed_texts(documents)
+        
+        keys = [content_key(doc, settings.embedding_model) for doc in documents]
+        vectors = store.get_many(keys)
+        
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            embedded = self.embed_texts([documents[i] for i in missing])
+            store.put_many([keys[i] for i in missing], embedded)
+            for i, vector in zip(missing, embedded):
+                vectors[i] = vector
+        
+        logger.info(
+            f"Document embeddings: {len(documents) - len(missing)} reused from store, "
+            f"{len(missing)} computed"
+        )
+        return np.stack(vectors).astype(np.float32)
+    
+    def get_store(self) -> Optional[EmbeddingStore]:
+        """Open the persistent embedding store (None when disabled)"""
+        if not settings.embedding_store_enabled:
+            return None
+        
+        if self.store is None:
+            self.store = EmbeddingStore(
+                settings.embedding_store_dir,
+                settings.embedding_model,
+                self.get_embedding_dimension()
+            )
+        
+        return self.store
     
     def similarity(self, embedding1: np.ndarray, embedding2: np.ndarray) -> float:
         """
@@ -114,6 +237,12 @@ class EmbeddingService:
         
         return self.model.get_sentence_embedding_dimension()
     
+    def get_cache_stats(self) -> Dict:
+        """Get query embedding cache statistics"""
+        if self.query_cache is None:
+            return {"enabled": False}
+        return self.query_cache.get_stats()
+    
     def is_initialized(self) -> bool:
         """Check if model is initialized"""
         return self._initialized
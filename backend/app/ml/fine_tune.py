@@ -11,7 +11,6 @@ from dataclasses import dataclass, field
 
 import torch
 from transformers import (
-    AutoModelForCausalLM,
     AutoTokenizer,
     TrainingArguments,
     Trainer,
@@ -27,6 +26,7 @@ from peft import (
 from datasets import Dataset, load_dataset
 
 from app.config import settings
+from app.ml.model_loading import load_causal_lm
 
 logger = logging.getLogger(__name__)
 
@@ -160,12 +160,11 @@ class Phi3FineTuner:
             bnb_config = None
         
         # Load model
-        self.model = AutoModelForCausalLM.from_pretrained(
+        self.model = load_causal_lm(
             self.config.model_name,
+            torch.float16,
             quantization_config=bnb_config,
-            device_map="auto",
-            trust_remote_code=True,
-            torch_dtype=torch.float16
+            device_map="auto"
         )
         
         # Load tokenizer
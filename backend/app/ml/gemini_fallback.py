@@ -3,10 +3,16 @@ Gemini Fallback Client
 Fallback to Google Gemini API when Phi-3 is unavailable or for comparison
 """
 
-from typing import Optional, Tuple
+from typing import AsyncGenerator, Optional, Tuple
+import asyncio
+import json
 import logging
+import time
+
+import httpx
 
 from app.config import settings
+from app.ml.gemini_keys import GeminiKeysExhausted, KeyScheduler, RETRYABLE_STATUSES
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +27,16 @@ except ImportError:
     USE_NEW_SDK = False
     logger.info("Using legacy google-generativeai SDK")
 
+DEFAULT_SYSTEM_TEXT = "You are an intelligent AI Study Buddy, an educational assistant designed to help students learn effectively. You provide clear, accurate, and helpful explanations on various academic topics. Be encouraging, patient, and thorough in your responses."
+
+
+class GeminiHTTPError(RuntimeError):
+    """Non-success response from the Gemini REST API"""
+    
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"Gemini API error {status_code}: {message}")
+        self.status_code = status_code
+
 
 class GeminiClient:
     """
@@ -31,9 +47,10 @@ class GeminiClient:
     def __init__(self):
         self.client = None
         self.model_name = None
-        self.current_key_index = 0
         self.api_keys = []
         self._initialized = False
+        self._http: Optional[httpx.AsyncClient] = None
+        self.key_scheduler: Optional[KeyScheduler] = None
     
     def initialize(self):
         """Initialize Gemini API with available keys"""
@@ -50,6 +67,14 @@ class GeminiClient:
             logger.warning("No Gemini API keys configured")
             return
         
+        self.key_scheduler = KeyScheduler(
+            self.api_keys,
+            rpm=settings.gemini_key_rpm,
+            tpm=settings.gemini_key_tpm,
+            backoff_base=settings.gemini_backoff_base_seconds,
+            backoff_max=settings.gemini_backoff_max_seconds
+        )
+        
         try:
             if USE_NEW_SDK:
                 self._init_new_sdk()
@@ -84,29 +109,101 @@ class GeminiClient:
                 logger.warning(f"Model {model_name} not available: {e}")
                 continue
     
-    def _switch_api_key(self):
-        """Switch to the next available API key"""
-        if len(self.api_keys) <= 1:
-            return False
+    async def agenerate(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        timeout: Optional[float] = None
+    ) -> Tuple[str, dict]:
+        """
+        Generate a response without blocking the event loop.
+        
+        Calls the generateContent REST endpoint over a pooled keep-alive
+        connection. The key scheduler picks the key for every attempt;
+        429/5xx/timeouts back that key off and retry on another, up to
+        GEMINI_MAX_ATTEMPTS and never past GEMINI_REQUEST_DEADLINE_SECONDS.
+        Each attempt is bounded by `timeout` (default GEMINI_TIMEOUT_SECONDS);
+        cancelling the caller cancels the request.
+        
+        Raises:
+            GeminiHTTPError: If the API answers with an error status
+            GeminiKeysExhausted: If no key frees up before the deadline
+            asyncio.TimeoutError: If the last attempt times out
+        """
+        if not self._initialized:
+            self.initialize()
         
-        self.current_key_index = (self.current_key_index + 1) % len(self.api_keys)
+        if not self._initialized:
+            raise RuntimeError("Gemini client not available")
+        
+        max_tokens = max_tokens or settings.max_tokens
+        temperature = temperature or settings.temperature
+        timeout = timeout or settings.gemini_timeout_seconds
+        full_prompt = self._full_prompt(prompt, system_prompt)
         
-        if USE_NEW_SDK:
-            self.client = genai.Client(api_key=self.api_keys[self.current_key_index])
-        else:
-            genai.configure(api_key=self.api_keys[self.current_key_index])
+        # Reserve the prompt plus the full output budget; unused tokens are returned
+        estimated_tokens = self._estimate_usage(full_prompt, "")["input"] + max_tokens
+        deadline = time.monotonic() + settings.gemini_request_deadline_seconds
+        attempts = max(1, settings.gemini_max_attempts)
         
-        logger.info(f"Switched to Gemini API key {self.current_key_index + 1}")
-        return True
+        for attempt in range(attempts):
+            reservation = await self.key_scheduler.acquire(estimated_tokens, deadline)
+            remaining = deadline - time.monotonic()
+            
+            try:
+                result = await asyncio.wait_for(
+                    self._post_generate(reservation.api_key, full_prompt, max_tokens, temperature),
+                    min(timeout, remaining)
+                )
+            except GeminiHTTPError as e:
+                reservation.failure(e, e.status_code)
+                if e.status_code not in RETRYABLE_STATUSES or attempt == attempts - 1:
+                    raise
+                logger.warning(f"Gemini key {reservation.key.index + 1} failed (attempt {attempt + 1}): {e}")
+            except (httpx.HTTPError, asyncio.TimeoutError) as e:
+                reservation.failure(e)
+                if attempt == attempts - 1:
+                    raise
+                logger.warning(f"Gemini key {reservation.key.index + 1} failed (attempt {attempt + 1}): {e!r}")
+            except BaseException:
+                reservation.release()
+                raise
+            else:
+                reservation.success(result[1]["input"] + result[1]["output"])
+                return result
+        
+        raise GeminiKeysExhausted("All Gemini attempts failed")
     
-    def generate(
+    async def astream(
         self,
         prompt: str,
         system_prompt: Optional[str] = None,
         max_tokens: Optional[int] = None,
-        temperature: Optional[float] = None
-    ) -> Tuple[str, dict]:
-        """Generate a response using Gemini API."""
+        temperature: Optional[float] = None,
+        token_usage: Optional[dict] = None
+    ) -> AsyncGenerator[str, None]:
+        """
+        Stream a response as Gemini produces it.
+        
+        Uses the streamGenerateContent endpoint (server-sent events) on
+        the same pooled connections and key scheduler as agenerate().
+        Failed attempts move to another key only until the first chunk
+        has been yielded; after that errors are raised to the caller.
+        GEMINI_TIMEOUT_SECONDS bounds the wait for each chunk. Closing
+        the generator closes the connection.
+        
+        Args:
+            prompt: User's message
+            system_prompt: Optional system prompt
+            max_tokens: Maximum tokens to generate
+            temperature: Sampling temperature
+            token_usage: Optional dict filled with token counts once done
+            
+        Yields:
+            Response text chunks
+        """
         if not self._initialized:
             self.initialize()
         
@@ -115,46 +212,167 @@ class GeminiClient:
         
         max_tokens = max_tokens or settings.max_tokens
         temperature = temperature or settings.temperature
+        full_prompt = self._full_prompt(prompt, system_prompt)
         
-        system_text = system_prompt or "You are an intelligent AI Study Buddy, an educational assistant designed to help students learn effectively. You provide clear, accurate, and helpful explanations on various academic topics. Be encouraging, patient, and thorough in your responses."
-        full_prompt = f"{system_text}\n\nUser: {prompt}\n\nAssistant:"
+        estimated_tokens = self._estimate_usage(full_prompt, "")["input"] + max_tokens
+        deadline = time.monotonic() + settings.gemini_request_deadline_seconds
+        attempts = max(1, settings.gemini_max_attempts)
         
-        for attempt in range(len(self.api_keys)):
+        for attempt in range(attempts):
+            reservation = await self.key_scheduler.acquire(estimated_tokens, deadline)
+            chunks = []
+            usage = {}
+            
             try:
-                if USE_NEW_SDK:
-                    response = self.client.models.generate_content(
-                        model=self.model_name,
-                        contents=full_prompt,
-                        config=types.GenerateContentConfig(
-                            max_output_tokens=max_tokens,
-                            temperature=temperature
-                        )
-                    )
-                    response_text = response.text
-                else:
-                    generation_config = genai.types.GenerationConfig(
-                        max_output_tokens=max_tokens,
-                        temperature=temperature
-                    )
-                    response = self.client.generate_content(
-                        full_prompt,
-                        generation_config=generation_config
-                    )
-                    response_text = response.text
-                
-                token_usage = {
-                    "input": int(len(full_prompt.split()) * 1.3),
-                    "output": int(len(response_text.split()) * 1.3)
-                }
-                
-                return response_text, token_usage
+                async with self._get_http().stream(
+                    "POST",
+                    f"/v1beta/models/{self.model_name}:streamGenerateContent",
+                    params={"alt": "sse"},
+                    headers={"x-goog-api-key": reservation.api_key},
+                    json=self._request_body(full_prompt, max_tokens, temperature)
+                ) as response:
+                    if response.status_code != 200:
+                        await response.aread()
+                        raise GeminiHTTPError(response.status_code, self._error_message(response))
+                    
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        
+                        event = json.loads(line[len("data:"):])
+                        usage = event.get("usageMetadata") or usage
+                        text = self._candidate_text(event)
+                        if text:
+                            chunks.append(text)
+                            yield text
                 
-            except Exception as e:
-                logger.warning(f"Gemini generation failed (attempt {attempt + 1}): {e}")
-                if not self._switch_api_key():
+                if not chunks:
+                    raise RuntimeError("Gemini returned no text")
+            
+            except GeminiHTTPError as e:
+                reservation.failure(e, e.status_code)
+                if chunks or e.status_code not in RETRYABLE_STATUSES or attempt == attempts - 1:
+                    raise
+                logger.warning(f"Gemini key {reservation.key.index + 1} failed (attempt {attempt + 1}): {e}")
+                continue
+            except httpx.HTTPError as e:
+                reservation.failure(e)
+                if chunks or attempt == attempts - 1:
                     raise
+                logger.warning(f"Gemini key {reservation.key.index + 1} failed (attempt {attempt + 1}): {e!r}")
+                continue
+            except BaseException:
+                # Includes the consumer closing the stream early
+                reservation.release()
+                raise
+            
+            response_text = "".join(chunks)
+            estimate = self._estimate_usage(full_prompt, response_text)
+            final_usage = {
+                "input": usage.get("promptTokenCount", estimate["input"]),
+                "output": usage.get("candidatesTokenCount", estimate["output"])
+            }
+            reservation.success(final_usage["input"] + final_usage["output"])
+            if token_usage is not None:
+                token_usage.update(final_usage)
+            return
         
-        raise RuntimeError("All Gemini API keys exhausted")
+        raise GeminiKeysExhausted("All Gemini attempts failed")
+    
+    def get_stats(self) -> dict:
+        """Per-key scheduler stats"""
+        return {
+            "available": self._initialized,
+            "model": self.model_name,
+            "keys": self.key_scheduler.get_stats() if self.key_scheduler is not None else []
+        }
+    
+    async def _post_generate(self, api_key: str, full_prompt: str, max_tokens: int, temperature: float) -> Tuple[str, dict]:
+        """One generateContent call with the given key"""
+        response = await self._get_http().post(
+            f"/v1beta/models/{self.model_name}:generateContent",
+            headers={"x-goog-api-key": api_key},
+            json=self._request_body(full_prompt, max_tokens, temperature)
+        )
+        
+        if response.status_code != 200:
+            raise GeminiHTTPError(response.status_code, self._error_message(response))
+        
+        body = response.json()
+        candidates = body.get("candidates") or []
+        response_text = self._candidate_text(body)
+        if not response_text:
+            reason = candidates[0].get("finishReason") if candidates else body.get("promptFeedback")
+            raise RuntimeError(f"Gemini returned no text ({reason})")
+        
+        usage = body.get("usageMetadata") or {}
+        token_usage = self._estimate_usage(full_prompt, response_text)
+        if "promptTokenCount" in usage:
+            token_usage = {
+                "input": usage["promptTokenCount"],
+                "output": usage.get("candidatesTokenCount", token_usage["output"])
+            }
+        
+        return response_text, token_usage
+    
+    def _get_http(self) -> httpx.AsyncClient:
+        """Pooled HTTP client for the REST API, created on first use"""
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                base_url=settings.gemini_api_base_url,
+                timeout=httpx.Timeout(settings.gemini_timeout_seconds, connect=5.0),
+                limits=httpx.Limits(
+                    max_connections=settings.gemini_max_connections,
+                    max_keepalive_connections=settings.gemini_max_connections,
+                    keepalive_expiry=60.0
+                )
+            )
+        return self._http
+    
+    async def aclose(self):
+        """Close pooled connections"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+    
+    @staticmethod
+    def _request_body(full_prompt: str, max_tokens: int, temperature: float) -> dict:
+        """generateContent request payload"""
+        return {
+            "contents": [{"role": "user", "parts": [{"text": full_prompt}]}],
+            "generationConfig": {
+                "maxOutputTokens": max_tokens,
+                "temperature": temperature
+            }
+        }
+    
+    @staticmethod
+    def _candidate_text(body: dict) -> str:
+        """Text of the first candidate in a (possibly partial) response"""
+        candidates = body.get("candidates") or []
+        parts = candidates[0].get("content", {}).get("parts", []) if candidates else []
+        return "".join(part.get("text", "") for part in parts)
+    
+    @staticmethod
+    def _error_message(response: httpx.Response) -> str:
+        """Error message from an API error body"""
+        try:
+            return response.json()["error"]["message"]
+        except Exception:
+            return response.text[:200]
+    
+    @staticmethod
+    def _full_prompt(prompt: str, system_prompt: Optional[str]) -> str:
+        """Single-turn prompt with the system text inlined"""
+        return f"{system_prompt or DEFAULT_SYSTEM_TEXT}\n\nUser: {prompt}\n\nAssistant:"
+    
+    @staticmethod
+    def _estimate_usage(full_prompt: str, response_text: str) -> dict:
+        """Rough token counts when the API does not report usage"""
+        return {
+            "input": int(len(full_prompt.split()) * 1.3),
+            "output": int(len(response_text.split()) * 1.3)
+        }
     
     def is_available(self) -> bool:
         """Check if Gemini is available"""
@@ -174,3 +392,9 @@ def get_gemini_client() -> GeminiClient:
         _gemini_client = GeminiClient()
     
     return _gemini_client
+
+
+async def shutdown_gemini_client():
+    """Close the Gemini client's pooled connections"""
+    if _gemini_client is not None:
+        await _gemini_client.aclose()
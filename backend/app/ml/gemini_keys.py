@@ -0,0 +1,238 @@
+"""
+Gemini Key Scheduler
+Per-key token-bucket rate limiting, health scoring and jittered back-off
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth retrying on another key after a back-off
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class GeminiKeysExhausted(RuntimeError):
+    """Raised when no key can take a request before the deadline"""
+
+
+class TokenBucket:
+    """Refills continuously at `rate` per second up to `capacity`"""
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self._updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` is available (0 if it is now)"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def give_back(self, amount: float):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def drain(self):
+        self._refill()
+        self.tokens = 0.0
+
+
+class KeyState:
+    """Limits, back-off and metrics for one API key"""
+
+    def __init__(self, index: int, api_key: str, rpm: int, tpm: int):
+        self.index = index
+        self.api_key = api_key
+        self.requests = TokenBucket(rpm, rpm / 60)
+        self.tokens = TokenBucket(tpm, tpm / 60)
+        self.backoff_until = 0.0
+        self.consecutive_failures = 0
+        self.in_flight = 0
+        self.health = 1.0
+        self.avg_latency = 0.0
+
+        # Metrics
+        self.calls = 0
+        self.successes = 0
+        self.errors: Dict[str, int] = {}
+        self.throttled = 0
+
+    def wait_time(self, estimated_tokens: int) -> float:
+        """Seconds until this key may be used for a request of this size"""
+        return max(
+            self.backoff_until - time.monotonic(),
+            self.requests.wait_time(1),
+            self.tokens.wait_time(estimated_tokens),
+            0.0
+        )
+
+    def score(self) -> float:
+        """Higher is better: healthy keys with little in flight"""
+        return self.health / (1 + self.in_flight)
+
+
+class KeyReservation:
+    """A request slot on one key; only the first reported outcome counts"""
+
+    def __init__(self, scheduler: "KeyScheduler", key: KeyState, estimated_tokens: int):
+        self.scheduler = scheduler
+        self.key = key
+        self.api_key = key.api_key
+        self.estimated_tokens = estimated_tokens
+        self.started_at = time.monotonic()
+        self._done = False
+
+    def success(self, used_tokens: Optional[int] = None):
+        if not self._done:
+            self._done = True
+            self.scheduler._record_success(self, used_tokens)
+
+    def failure(self, error: Exception, status_code: Optional[int] = None):
+        if not self._done:
+            self._done = True
+            self.scheduler._record_failure(self, error, status_code)
+
+    def release(self):
+        """Give the slot back without judging the key (e.g. the caller cancelled)"""
+        if not self._done:
+            self._done = True
+            self.scheduler._release(self)
+
+
+class KeyScheduler:
+    """
+    Spreads Gemini requests across API keys before any of them hits quota.
+
+    Each key has a request bucket (RPM) and a token bucket (TPM). A
+    request reserves one request and its estimated tokens on the
+    healthiest key that has room, preferring keys with fewer requests in
+    flight. When every key is limited or backing off, the caller waits
+    for the earliest one, but never past its deadline.
+
+    429 and 5xx responses put the key into exponential back-off with
+    jitter (and a 429 empties its request bucket) so retries go to the
+    other keys instead of hammering the throttled one.
+    """
+
+    def __init__(
+        self,
+        api_keys: List[str],
+        rpm: int = 15,
+        tpm: int = 1_000_000,
+        backoff_base: float = 1.0,
+        backoff_max: float = 30.0
+    ):
+        self.keys = [KeyState(i, key, max(1, rpm), max(1, tpm)) for i, key in enumerate(api_keys)]
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+
+    async def acquire(self, estimated_tokens: int, deadline: float) -> KeyReservation:
+        """
+        Reserve capacity on the best available key.
+
+        Args:
+            estimated_tokens: Expected prompt + output tokens
+            deadline: time.monotonic() value by which a key must be found
+
+        Raises:
+            GeminiKeysExhausted: If no key frees up before the deadline
+        """
+        if not self.keys:
+            raise GeminiKeysExhausted("No Gemini API keys configured")
+
+        while True:
+            with self._lock:
+                ready = [k for k in self.keys if k.wait_time(estimated_tokens) == 0.0]
+                if ready:
+                    key = max(ready, key=lambda k: (k.score(), -k.avg_latency))
+                    key.requests.take(1)
+                    key.tokens.take(estimated_tokens)
+                    key.in_flight += 1
+                    key.calls += 1
+                    return KeyReservation(self, key, estimated_tokens)
+
+                wait = min(k.wait_time(estimated_tokens) for k in self.keys)
+
+            remaining = deadline - time.monotonic()
+            if wait > remaining:
+                raise GeminiKeysExhausted(
+                    f"All Gemini keys rate-limited or backing off (next free in {wait:.1f}s)"
+                )
+            await asyncio.sleep(wait)
+
+    def _record_success(self, reservation: KeyReservation, used_tokens: Optional[int]):
+        key = reservation.key
+        latency = time.monotonic() - reservation.started_at
+
+        with self._lock:
+            key.in_flight -= 1
+            key.successes += 1
+            key.consecutive_failures = 0
+            key.health = 0.8 * key.health + 0.2
+            key.avg_latency = latency if key.successes == 1 else 0.8 * key.avg_latency + 0.2 * latency
+            if used_tokens is not None and used_tokens < reservation.estimated_tokens:
+                key.tokens.give_back(reservation.estimated_tokens - used_tokens)
+
+    def _release(self, reservation: KeyReservation):
+        with self._lock:
+            reservation.key.in_flight -= 1
+
+    def _record_failure(self, reservation: KeyReservation, error: Exception, status_code: Optional[int]):
+        key = reservation.key
+        label = str(status_code) if status_code is not None else type(error).__name__
+
+        with self._lock:
+            key.in_flight -= 1
+            key.errors[label] = key.errors.get(label, 0) + 1
+            key.health = 0.8 * key.health
+
+            # Timeouts and transport errors count like 5xx
+            if status_code is None or status_code in RETRYABLE_STATUSES:
+                key.consecutive_failures += 1
+                cap = min(self.backoff_max, self.backoff_base * 2 ** (key.consecutive_failures - 1))
+                delay = cap / 2 + random.uniform(0, cap / 2)
+                key.backoff_until = time.monotonic() + delay
+                if status_code == 429:
+                    key.throttled += 1
+                    key.requests.drain()
+                logger.warning(f"Gemini key {key.index + 1} backing off {delay:.1f}s after {label}")
+
+    def get_stats(self) -> List[Dict]:
+        """Per-key limits, health, latency and error counts"""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "key": k.index + 1,
+                    "health": round(k.health, 3),
+                    "in_flight": k.in_flight,
+                    "calls": k.calls,
+                    "successes": k.successes,
+                    "errors": dict(k.errors),
+                    "throttled": k.throttled,
+                    "avg_latency_ms": round(k.avg_latency * 1000, 1),
+                    "backoff_remaining_seconds": round(max(0.0, k.backoff_until - now), 1),
+                    "requests_available": int(k.requests.tokens),
+                    "tokens_available": int(k.tokens.tokens)
+                }
+                for k in self.keys
+            ]
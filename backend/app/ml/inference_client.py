@@ -0,0 +1,226 @@
+"""
+Inference Server Client
+Pooled async client for the local Phi-3 inference server
+"""
+
+import json
+import logging
+import time
+from typing import AsyncGenerator, List, Optional, Tuple
+
+import httpx
+
+from app.config import settings
+from app.ml.inference_executor import InferenceQueueFull
+
+logger = logging.getLogger(__name__)
+
+UNIX_SCHEME = "unix://"
+
+
+class RemoteInferenceClient:
+    """
+    Talks to `app.ml.inference_server` with the same agenerate() and
+    agenerate_stream() contract as Phi3Client.
+
+    One keep-alive connection pool is shared by all requests of this API
+    worker. A full server queue surfaces as InferenceQueueFull so callers
+    fall back to Gemini exactly as they do in-process.
+
+    Args:
+        url: "http://host:port" or "unix:///path/to/socket"
+        timeout: Seconds to wait for a response (or between stream chunks)
+        max_connections: Connection pool size
+    """
+
+    def __init__(self, url: str, timeout: float = 120.0, max_connections: int = 32):
+        self.url = url
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._client: Optional[httpx.AsyncClient] = None
+
+        # Metrics
+        self._requests = 0
+        self._failed = 0
+        self._overloaded = 0
+        self._total_time = 0.0
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Create the pooled HTTP client on first use"""
+        if self._client is None:
+            limits = httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+                keepalive_expiry=30.0
+            )
+
+            if self.url.startswith(UNIX_SCHEME):
+                transport = httpx.AsyncHTTPTransport(uds=self.url[len(UNIX_SCHEME):], limits=limits)
+                base_url = "http://inference-server"
+            else:
+                transport = httpx.AsyncHTTPTransport(limits=limits)
+                base_url = self.url
+
+            self._client = httpx.AsyncClient(
+                base_url=base_url,
+                transport=transport,
+                timeout=httpx.Timeout(self.timeout, connect=5.0)
+            )
+
+        return self._client
+
+    def _raise_for_status(self, response: httpx.Response, detail: str):
+        """Map server errors onto the exceptions Phi3Client would raise"""
+        if response.status_code == 503:
+            self._overloaded += 1
+            raise InferenceQueueFull(detail)
+        if response.status_code >= 400:
+            raise RuntimeError(f"Inference server error {response.status_code}: {detail}")
+
+    async def agenerate(
+        self,
+        prompt: str,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        system_prompt: Optional[str] = None,
+        context: Optional[List[str]] = None
+    ) -> Tuple[str, dict]:
+        """Generate a full response on the inference server"""
+        started_at = time.perf_counter()
+        self._requests += 1
+
+        try:
+            response = await self._get_client().post("/generate", json={
+                "prompt": prompt,
+                "max_tokens": max_tokens,
+                "temperature": temperature,
+                "system_prompt": system_prompt,
+                "context": context
+            })
+            if response.status_code >= 400:
+                self._raise_for_status(response, response.text)
+
+            body = response.json()
+            return body["response"], body["token_usage"]
+        except Exception:
+            self._failed += 1
+            raise
+        finally:
+            self._total_time += time.perf_counter() - started_at
+
+    async def agenerate_stream(
+        self,
+        prompt: str,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        system_prompt: Optional[str] = None,
+        context: Optional[List[str]] = None,
+        token_usage: Optional[dict] = None
+    ) -> AsyncGenerator[str, None]:
+        """
+        Stream a response from the inference server.
+
+        Closing the generator closes the connection, which stops
+        generation on the server.
+        """
+        started_at = time.perf_counter()
+        self._requests += 1
+
+        try:
+            async with self._get_client().stream("POST", "/generate/stream", json={
+                "prompt": prompt,
+                "max_tokens": max_tokens,
+                "temperature": temperature,
+                "system_prompt": system_prompt,
+                "context": context
+            }) as response:
+                if response.status_code >= 400:
+                    await response.aread()
+                    self._raise_for_status(response, response.text)
+
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+
+                    message = json.loads(line)
+                    if "text" in message:
+                        yield message["text"]
+                    elif message.get("done"):
+                        if token_usage is not None:
+                            token_usage.update(message.get("token_usage", {}))
+                        return
+                    elif message.get("overloaded"):
+                        self._overloaded += 1
+                        raise InferenceQueueFull(message["error"])
+                    else:
+                        raise RuntimeError(f"Inference server error: {message.get('error')}")
+
+                raise RuntimeError("Inference server closed the stream early")
+        except Exception:
+            self._failed += 1
+            raise
+        finally:
+            self._total_time += time.perf_counter() - started_at
+
+    async def check_health(self) -> dict:
+        """Health reported by the inference server"""
+        response = await self._get_client().get("/health")
+        response.raise_for_status()
+        return response.json()
+
+    async def get_server_info(self) -> dict:
+        """Model info reported by the inference server"""
+        response = await self._get_client().get("/model-info")
+        response.raise_for_status()
+        return response.json()
+
+    def get_model_info(self) -> dict:
+        """Client-side view of the inference server connection"""
+        return {
+            "model_name": settings.model_name,
+            "backend": "inference_server",
+            "server": self.url,
+            "max_tokens": settings.max_tokens,
+            "client": {
+                "max_connections": self.max_connections,
+                "requests": self._requests,
+                "failed": self._failed,
+                "overloaded": self._overloaded,
+                "avg_latency_ms": round(
+                    self._total_time / self._requests * 1000, 1
+                ) if self._requests else 0.0
+            }
+        }
+
+    async def aclose(self):
+        """Close pooled connections"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+# Singleton instance
+_inference_client: Optional[RemoteInferenceClient] = None
+
+
+def get_inference_client() -> RemoteInferenceClient:
+    """Get the inference server client for this API worker"""
+    global _inference_client
+
+    if _inference_client is None:
+        _inference_client = RemoteInferenceClient(
+            settings.inference_server_url,
+            timeout=settings.inference_server_timeout_seconds,
+            max_connections=settings.inference_server_max_connections
+        )
+
+    return _inference_client
+
+
+async def shutdown_inference_client():
+    """Close the inference server client if it was used"""
+    global _inference_client
+
+    if _inference_client is not None:
+        await _inference_client.aclose()
+        _inference_client = None
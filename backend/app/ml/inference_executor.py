@@ -0,0 +1,176 @@
+"""
+Inference Executor
+Runs blocking model calls off the asyncio event loop with bounded concurrency
+"""
+
+import asyncio
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceQueueFull(RuntimeError):
+    """Raised when the inference executor cannot accept more work"""
+
+
+class InferenceExecutor:
+    """
+    Bounded thread pool for CPU/GPU-bound model calls.
+
+    At most `max_workers` calls run at once and at most `max_queue_size`
+    more wait for a worker. Anything beyond that is rejected immediately
+    so callers can fall back instead of piling up behind the model.
+    """
+
+    def __init__(self, max_workers: int = 1, max_queue_size: int = 16):
+        self.max_workers = max(1, max_workers)
+        self.max_queue_size = max(0, max_queue_size)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix="inference"
+        )
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_queue_size)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._active = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._total_run = 0.0
+        self._shutdown = False
+
+    def _invoke(self, fn: Callable, args: tuple, kwargs: dict, submitted_at: float) -> Any:
+        """Run a call on a worker thread and record timing"""
+        started_at = time.perf_counter()
+        with self._lock:
+            self._active += 1
+            self._total_wait += started_at - submitted_at
+
+        try:
+            result = fn(*args, **kwargs)
+            with self._lock:
+                self._completed += 1
+            return result
+        except Exception:
+            with self._lock:
+                self._failed += 1
+            raise
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._total_run += time.perf_counter() - started_at
+
+    def _release(self, _future) -> None:
+        """Free a slot once a call finishes or is cancelled before starting"""
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Run a blocking callable on the inference pool.
+
+        Args:
+            fn: Blocking function to call
+            *args: Positional arguments for fn
+            **kwargs: Keyword arguments for fn
+
+        Returns:
+            Whatever fn returns
+
+        Raises:
+            InferenceQueueFull: If all workers are busy and the queue is full
+        """
+        if self._shutdown:
+            raise RuntimeError("Inference executor is shut down")
+
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise InferenceQueueFull(
+                f"Inference queue full ({self.max_workers} running, {self.max_queue_size} waiting)"
+            )
+
+        with self._lock:
+            self._pending += 1
+
+        try:
+            future = self._executor.submit(
+                functools.partial(self._invoke, fn, args, kwargs, time.perf_counter())
+            )
+        except Exception:
+            self._release(None)
+            raise
+
+        # Release the slot from the worker side so a cancelled request
+        # keeps its slot until the running generation actually finishes
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def get_stats(self) -> Dict:
+        """Get executor load and timing statistics"""
+        with self._lock:
+            started = self._completed + self._failed + self._active
+            return {
+                "max_workers": self.max_workers,
+                "max_queue_size": self.max_queue_size,
+                "active": self._active,
+                "queued": self._pending - self._active,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "avg_wait_ms": round(self._total_wait / started * 1000, 2) if started else 0.0,
+                "avg_run_ms": round(
+                    self._total_run / (self._completed + self._failed) * 1000, 2
+                ) if (self._completed + self._failed) else 0.0
+            }
+
+    def shutdown(self, wait: bool = False):
+        """Stop accepting work and cancel calls that have not started"""
+        self._shutdown = True
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+        logger.info("Inference executor shut down")
+
+
+# Singleton instance
+_inference_executor: Optional[InferenceExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_inference_executor() -> InferenceExecutor:
+    """
+    Get the inference executor singleton.
+    Sized from INFERENCE_WORKERS and INFERENCE_QUEUE_SIZE settings.
+    """
+    global _inference_executor
+
+    if _inference_executor is None:
+        with _executor_lock:
+            if _inference_executor is None:
+                _inference_executor = InferenceExecutor(
+                    max_workers=settings.inference_workers,
+                    max_queue_size=settings.inference_queue_size
+                )
+                logger.info(
+                    f"Inference executor started with {settings.inference_workers} worker(s), "
+                    f"queue size {settings.inference_queue_size}"
+                )
+
+    return _inference_executor
+
+
+def shutdown_inference_executor():
+    """Shut down the inference executor if it was started"""
+    global _inference_executor
+
+    if _inference_executor is not None:
+        _inference_executor.shutdown()
+        _inference_executor = None
@@ -0,0 +1,149 @@
+"""
+Local Inference Server
+One process owns Phi-3 and serves generate/stream requests to API workers
+over HTTP or a Unix socket
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+from contextlib import aclosing, asynccontextmanager
+from typing import List, Optional
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from app.config import settings
+from app.ml.inference_executor import InferenceQueueFull, get_inference_executor, shutdown_inference_executor
+
+logger = logging.getLogger(__name__)
+
+
+class GenerateRequest(BaseModel):
+    """Body of /generate and /generate/stream"""
+    prompt: str
+    max_tokens: Optional[int] = None
+    temperature: Optional[float] = None
+    system_prompt: Optional[str] = None
+    context: Optional[List[str]] = None
+
+
+def get_backend():
+    """The model owner: the replica pool when REPLICA_COUNT > 1, else the Phi-3 client"""
+    if settings.replica_count > 1:
+        from app.ml.replica_pool import get_replica_pool
+        return get_replica_pool()
+    from app.ml.phi3_client import get_phi3_client
+    return get_phi3_client()
+
+
+async def load_backend():
+    """Load the model before accepting traffic"""
+    backend = get_backend()
+    if settings.replica_count > 1:
+        await asyncio.to_thread(backend.initialize)
+        return
+
+    await get_inference_executor().run(backend.initialize)
+    if backend.compiled is not None:
+        await get_inference_executor().run(backend.compiled.warmup, settings.max_tokens)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info("Starting Phi-3 inference server...")
+    await load_backend()
+    logger.info("Phi-3 inference server ready")
+    yield
+
+    from app.ml.batch_scheduler import shutdown_batch_scheduler
+    from app.ml.replica_pool import shutdown_replica_pool
+    await shutdown_batch_scheduler()
+    shutdown_inference_executor()
+    shutdown_replica_pool()
+
+
+app = FastAPI(title="AI Study Buddy Inference Server", lifespan=lifespan)
+
+
+def overloaded(error: InferenceQueueFull) -> HTTPException:
+    return HTTPException(status_code=503, detail=str(error), headers={"Retry-After": "1"})
+
+
+@app.get("/health")
+async def health():
+    return {"status": "healthy", "initialized": get_backend().is_initialized()}
+
+
+@app.get("/model-info")
+async def model_info():
+    return get_backend().get_model_info()
+
+
+@app.post("/generate")
+async def generate(request: GenerateRequest):
+    """Generate a full response; 503 when the inference queue is full"""
+    try:
+        if settings.batching_enabled and settings.replica_count <= 1:
+            from app.ml.batch_scheduler import get_batch_scheduler
+            response, token_usage = await get_batch_scheduler().submit(**request.model_dump())
+        else:
+            response, token_usage = await get_backend().agenerate(**request.model_dump())
+    except InferenceQueueFull as e:
+        raise overloaded(e)
+    except Exception as e:
+        logger.error(f"Generation failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return {"response": response, "token_usage": token_usage}
+
+
+@app.post("/generate/stream")
+async def generate_stream(request: GenerateRequest):
+    """
+    Stream a response as newline-delimited JSON:
+    {"text": ...} per chunk, then {"done": true, "token_usage": {...}}
+    or {"error": ..., "overloaded": bool}. Disconnecting stops generation.
+    """
+    async def lines():
+        token_usage = {}
+        try:
+            async with aclosing(get_backend().agenerate_stream(
+                **request.model_dump(),
+                token_usage=token_usage
+            )) as stream:
+                async for text in stream:
+                    yield json.dumps({"text": text}) + "\n"
+            yield json.dumps({"done": True, "token_usage": token_usage}) + "\n"
+        except Exception as e:
+            logger.error(f"Streaming generation failed: {e}")
+            yield json.dumps({"error": str(e), "overloaded": isinstance(e, InferenceQueueFull)}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run the local Phi-3 inference server")
+    parser.add_argument("--uds", type=str, default=None, help="Unix socket path (e.g. /tmp/phi3.sock)")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host when not using --uds")
+    parser.add_argument("--port", type=int, default=8100, help="Port when not using --uds")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+
+    # A single worker: this process is the one that holds the model
+    if args.uds:
+        uvicorn.run(app, uds=args.uds, workers=1)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port, workers=1)
+
+
+if __name__ == "__main__":
+    main()
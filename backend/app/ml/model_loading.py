@@ -0,0 +1,197 @@
+"""
+Model Loading
+Low-memory causal LM loading with memory-mapped safetensors and load metrics
+"""
+
+import glob
+import json
+import logging
+import mmap
+import os
+import resource
+import struct
+import time
+from typing import Dict, Optional
+
+import torch
+from transformers import AutoConfig, AutoModelForCausalLM
+
+logger = logging.getLogger(__name__)
+
+_SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool
+}
+
+
+def rss_mb() -> float:
+    """Current resident set size in MB"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB"""
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def local_model_dir(model_path: str) -> Optional[str]:
+    """Resolve a local directory for a model path or an already-downloaded hub model"""
+    if os.path.isdir(model_path):
+        return model_path
+
+    try:
+        from huggingface_hub import snapshot_download
+        return snapshot_download(model_path, local_files_only=True)
+    except Exception:
+        return None
+
+
+def _mmap_safetensors(path: str) -> Dict[str, torch.Tensor]:
+    """
+    Map a safetensors shard into tensors without reading it into memory.
+
+    The file is mapped copy-on-write, so pages come from the OS page cache
+    and are shared by every process that maps the same file until written.
+    """
+    with open(path, "rb") as f:
+        header_length = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_length))
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    data_start = 8 + header_length
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+
+        dtype = _SAFETENSORS_DTYPES[info["dtype"]]
+        start, end = info["data_offsets"]
+        if end == start:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+
+        count = (end - start) // torch.tensor([], dtype=dtype).element_size()
+        tensors[name] = torch.frombuffer(
+            buffer,
+            dtype=dtype,
+            count=count,
+            offset=data_start + start
+        ).reshape(info["shape"])
+
+    return tensors
+
+
+def _load_mmap(model_path: str, torch_dtype: torch.dtype):
+    """
+    Build the model on the meta device and assign memory-mapped weights.
+
+    Returns None when the checkpoint cannot be used as-is (no safetensors
+    shards, or stored dtype differs from torch_dtype so a copy is needed).
+    """
+    model_dir = local_model_dir(model_path)
+    shards = sorted(glob.glob(os.path.join(model_dir, "*.safetensors"))) if model_dir else []
+    if not shards:
+        return None
+
+    state_dict: Dict[str, torch.Tensor] = {}
+    for shard in shards:
+        state_dict.update(_mmap_safetensors(shard))
+
+    stored = {t.dtype for t in state_dict.values() if t.is_floating_point()}
+    if stored - {torch_dtype}:
+        names = ", ".join(str(d).replace("torch.", "") for d in sorted(stored, key=str))
+        logger.warning(
+            f"Checkpoint is stored as {names} but {str(torch_dtype).replace('torch.', '')} was requested - "
+            f"mmap loading skipped, weights are copied and not shared between workers "
+            f"(for bf16 checkpoints such as stock Phi-3, set CPU_QUANTIZATION=bf16)"
+        )
+        return None
+
+    from accelerate import init_empty_weights
+
+    config = AutoConfig.from_pretrained(model_dir, trust_remote_code=True)
+    with init_empty_weights():
+        model = AutoModelForCausalLM.from_config(config, trust_remote_code=True, torch_dtype=torch_dtype)
+
+    model.load_state_dict(state_dict, strict=False, assign=True)
+    model.tie_weights()
+
+    missing = [name for name, p in model.named_parameters() if p.device.type == "meta"]
+    if missing:
+        logger.warning(f"{len(missing)} weight(s) missing from mmap load (e.g. {missing[0]}) - falling back")
+        return None
+
+    return model
+
+
+def load_causal_lm(
+    model_path: str,
+    torch_dtype: torch.dtype = torch.float32,
+    mmap_weights: bool = False,
+    **kwargs
+):
+    """
+    Load a causal LM without materializing the weights twice.
+
+    With `mmap_weights`, safetensors shards whose dtype already matches
+    `torch_dtype` are mapped straight into the model's parameters, so
+    CPU load is close to free and workers on the same host share pages.
+    This only applies when the dtypes match: stock Phi-3 is stored as
+    bf16, so the default fp32 CPU load copies (use CPU_QUANTIZATION=bf16).
+    Otherwise `from_pretrained` streams weights into an empty model
+    (`low_cpu_mem_usage`) instead of initializing and then overwriting.
+    Load time and RSS are logged either way.
+
+    Args:
+        model_path: Local path or hub name of the model
+        torch_dtype: Parameter dtype
+        mmap_weights: Try the zero-copy mmap path first (CPU only)
+        **kwargs: Passed through to from_pretrained
+
+    Returns:
+        Model in eval mode
+    """
+    started_at = time.perf_counter()
+    rss_before = rss_mb()
+    model = None
+    method = "mmap"
+
+    if mmap_weights:
+        try:
+            model = _load_mmap(model_path, torch_dtype)
+        except Exception as e:
+            logger.warning(f"mmap loading failed ({e}) - using from_pretrained")
+            model = None
+
+    if model is None:
+        method = "from_pretrained"
+        kwargs.setdefault("trust_remote_code", True)
+        kwargs.setdefault("low_cpu_mem_usage", True)
+        model = AutoModelForCausalLM.from_pretrained(
+            model_path,
+            torch_dtype=torch_dtype,
+            **kwargs
+        )
+
+    model.eval()
+    logger.info(
+        f"Loaded {model_path} via {method} in {time.perf_counter() - started_at:.1f}s "
+        f"(RSS +{rss_mb() - rss_before:.0f}MB, peak {peak_rss_mb():.0f}MB)"
+    )
+    return model
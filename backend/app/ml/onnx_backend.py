@@ -0,0 +1,107 @@
+"""
+ONNX Runtime Backend
+Exports Phi-3 to ONNX (with KV-cache inputs) and runs it on the CPU execution provider
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import time
+
+import torch
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_BACKENDS = ("torch", "onnx")
+ONNX_PROVIDER = "CPUExecutionProvider"
+
+
+def _export_dir(model_path: str) -> str:
+    """
+    Directory holding the exported ONNX model.
+
+    Keyed by the model location and its modification time, so a new
+    fine-tune is re-exported instead of serving a stale graph.
+    """
+    stamp = str(os.path.getmtime(model_path)) if os.path.exists(model_path) else "hub"
+    digest = hashlib.sha256(f"{model_path}|{stamp}".encode("utf-8")).hexdigest()[:16]
+    name = os.path.basename(os.path.normpath(model_path)).replace("/", "_") or "model"
+    return os.path.join(settings.onnx_model_dir, f"{name}-{digest}")
+
+
+def _session_options():
+    """ONNX Runtime session tuned for CPU decoding"""
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.intra_op_num_threads = torch.get_num_threads()
+    options.enable_mem_pattern = True
+    options.enable_cpu_mem_arena = True
+    return options
+
+
+def load_onnx_model(model_path: str):
+    """
+    Load Phi-3 as an ONNX Runtime causal LM.
+
+    The first call exports the PyTorch checkpoint with past-key-value
+    inputs/outputs and saves it under ONNX_MODEL_DIR; later calls load
+    the saved graph directly. The returned model supports the same
+    `generate()` arguments (streamer, stopping criteria, sampling) as
+    the PyTorch model.
+
+    Args:
+        model_path: Local path or hub name of the model
+
+    Returns:
+        ORTModelForCausalLM running on the CPU execution provider
+    """
+    try:
+        from optimum.onnxruntime import ORTModelForCausalLM
+    except ImportError as e:
+        raise RuntimeError(
+            "INFERENCE_BACKEND=onnx requires optimum[onnxruntime] (pip install -r requirements-onnx.txt)"
+        ) from e
+
+    export_dir = _export_dir(model_path)
+    started_at = time.perf_counter()
+
+    if os.path.exists(os.path.join(export_dir, "config.json")):
+        logger.info(f"Loading ONNX model from {export_dir}")
+        model = ORTModelForCausalLM.from_pretrained(
+            export_dir,
+            use_cache=True,
+            use_io_binding=False,
+            provider=ONNX_PROVIDER,
+            session_options=_session_options()
+        )
+    else:
+        logger.info(f"Exporting {model_path} to ONNX (first run only)...")
+        model = ORTModelForCausalLM.from_pretrained(
+            model_path,
+            export=True,
+            use_cache=True,
+            use_io_binding=False,
+            trust_remote_code=True,
+            provider=ONNX_PROVIDER,
+            session_options=_session_options()
+        )
+
+        try:
+            tmp_dir = export_dir + ".tmp"
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            model.save_pretrained(tmp_dir)
+            # A partial earlier export (no config.json) would make os.replace fail
+            shutil.rmtree(export_dir, ignore_errors=True)
+            os.replace(tmp_dir, export_dir)
+            logger.info(f"Saved ONNX export to {export_dir}")
+        except Exception as e:
+            logger.warning(f"Could not save ONNX export: {e}")
+
+    logger.info(f"ONNX Runtime model ready in {time.perf_counter() - started_at:.1f}s")
+    return model
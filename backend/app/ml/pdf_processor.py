@@ -5,8 +5,11 @@ Extracts text from PDF files and generates training data for fine-tuning
 
 import os
 import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from typing import List, Dict, Optional, Tuple
 from pathlib import Path
+import hashlib
 import logging
 import json
 
@@ -29,11 +32,16 @@ class PDFProcessor:
     """
     Processes PDF files for training data extraction and RAG indexing.
     Supports multiple PDF libraries with fallback.
+    
+    Args:
+        pdf_dir: Directory containing PDF files
+        workers: Processes used to extract PDFs in parallel (1 = in-process)
     """
     
-    def __init__(self, pdf_dir: Optional[str] = None):
+    def __init__(self, pdf_dir: Optional[str] = None, workers: int = 1):
         self.pdf_dir = pdf_dir or settings.study_pdfs_dir
         self.output_dir = settings.training_data_dir
+        self.workers = max(1, workers)
         
         # Ensure directories exist
         os.makedirs(self.pdf_dir, exist_ok=True)
@@ -49,17 +57,23 @@ class PDFProcessor:
         Returns:
             Extracted text content
         """
-        text = ""
+        return self._join_pages(self.extract_pages(pdf_path))
+    
+    def extract_pages(self, pdf_path: str) -> List[str]:
+        """
+        Extract the text of each page of a PDF file.
         
+        Args:
+            pdf_path: Path to PDF file
+            
+        Returns:
+            Text per page (empty string for pages without text)
+        """
         # Try pdfplumber first (better formatting)
         if pdfplumber:
             try:
                 with pdfplumber.open(pdf_path) as pdf:
-                    for page in pdf.pages:
-                        page_text = page.extract_text()
-                        if page_text:
-                            text += page_text + "\n\n"
-                return text.strip()
+                    return [page.extract_text() or "" for page in pdf.pages]
             except Exception as e:
                 logger.warning(f"pdfplumber failed for {pdf_path}: {e}")
         
@@ -67,16 +81,16 @@ class PDFProcessor:
         if PdfReader:
             try:
                 reader = PdfReader(pdf_path)
-                for page in reader.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += page_text + "\n\n"
-                return text.strip()
+                return [page.extract_text() or "" for page in reader.pages]
             except Exception as e:
                 logger.warning(f"PyPDF2 failed for {pdf_path}: {e}")
         
         raise RuntimeError(f"No PDF library available or extraction failed for {pdf_path}")
     
+    @staticmethod
+    def _join_pages(pages: List[str]) -> str:
+        return "\n\n".join(page for page in pages if page).strip()
+    
     def extract_sections(self, text: str) -> List[Dict]:
         """
         Extract sections/chapters from text based on common patterns.
@@ -249,8 +263,9 @@ class PDFProcessor:
         filename = os.path.basename(pdf_path)
         
         # Extract text
-        text = self.extract_text_from_pdf(pdf_path)
-        logger.info(f"Extracted {len(text)} characters from {filename}")
+        pages = self.extract_pages(pdf_path)
+        text = self._join_pages(pages)
+        logger.info(f"Extracted {len(text)} characters from {len(pages)} pages of {filename}")
         
         # Extract sections
         sections = self.extract_sections(text)
@@ -278,21 +293,32 @@ class PDFProcessor:
         return {
             "filename": filename,
             "text_length": len(text),
+            "pages": len(pages),
             "sections": len(sections),
             "chunks": chunks,
             "qa_pairs": qa_pairs
         }
     
-    def process_all_pdfs(self) -> Dict:
+    def process_all_pdfs(self, full: bool = False) -> Dict:
         """
-        Process all PDF files in the study_pdfs directory.
+        Process new and modified PDF files in the study_pdfs directory.
+        
+        Files whose size and mtime (or, failing that, content hash) match
+        the manifest are reused from the previous run, and files that were
+        removed are dropped. training_data.json and rag_chunks.json are
+        rebuilt from the per-file outputs.
         
+        Args:
+            full: Reprocess every PDF, ignoring the manifest
+            
         Returns:
             Summary of processing results
         """
-        pdf_files = list(Path(self.pdf_dir).glob("*.pdf"))
+        pdf_files = sorted(Path(self.pdf_dir).glob("*.pdf"))
+        manifest = self.load_manifest()
+        files = manifest["files"]
         
-        if not pdf_files:
+        if not pdf_files and not files:
             logger.warning(f"No PDF files found in {self.pdf_dir}")
             return {
                 "status": "no_files",
@@ -300,54 +326,273 @@ class PDFProcessor:
                 "files_processed": 0
             }
         
-        all_chunks = []
-        all_qa_pairs = []
+        # Forget PDFs that are gone
+        present = {p.name for p in pdf_files}
+        removed = [name for name in files if name not in present]
+        for name in removed:
+            logger.info(f"Removed PDF: {name}")
+            del files[name]
+            if os.path.exists(self._output_path(name)):
+                os.remove(self._output_path(name))
+        
+        # Only new or modified PDFs need extraction
+        pending = []
+        for pdf_path in pdf_files:
+            entry = files.get(pdf_path.name)
+            if full or entry is None or not self._is_unchanged(pdf_path, entry):
+                pending.append(pdf_path)
+        unchanged = len(pdf_files) - len(pending)
+        logger.info(f"{len(pending)} new or modified PDFs, {unchanged} unchanged, {len(removed)} removed")
+        
         results = []
+        pages = 0
+        started_at = time.perf_counter()
         
-        for pdf_path in pdf_files:
-            try:
-                result = self.process_pdf(str(pdf_path))
-                all_chunks.extend(result["chunks"])
-                all_qa_pairs.extend(result["qa_pairs"])
-                results.append({
-                    "file": result["filename"],
-                    "status": "success",
-                    "chunks": len(result["chunks"]),
-                    "qa_pairs": len(result["qa_pairs"])
-                })
-            except Exception as e:
-                logger.error(f"Failed to process {pdf_path}: {e}")
+        for pdf_path, result, error in self._process_pending(pending):
+            if error is not None:
+                logger.error(f"Failed to process {pdf_path}: {error}")
                 results.append({
                     "file": str(pdf_path.name),
                     "status": "failed",
-                    "error": str(e)
+                    "error": str(error)
                 })
+                continue
+            
+            self._record_result(manifest, pdf_path, result)
+            pages += result["pages"]
+            results.append({
+                "file": result["filename"],
+                "status": "success",
+                "pages": result["pages"],
+                "chunks": len(result["chunks"]),
+                "qa_pairs": len(result["qa_pairs"])
+            })
+        
+        elapsed = time.perf_counter() - started_at
+        pages_per_second = pages / elapsed if pending and elapsed > 0 else 0.0
+        if pending:
+            logger.info(
+                f"Processed {pages} pages in {elapsed:.1f}s with {self.workers} worker(s) "
+                f"({pages_per_second:.1f} pages/sec)"
+            )
         
-        # Save training data
         training_data_path = os.path.join(self.output_dir, "training_data.json")
+        chunks_path = os.path.join(self.output_dir, "rag_chunks.json")
+        
+        if pending or removed or not os.path.exists(training_data_path) or not os.path.exists(chunks_path):
+            self._write_combined_outputs(manifest, training_data_path, chunks_path)
+        self.save_manifest(manifest)
+        
+        return {
+            "status": "completed",
+            "files_processed": len(pending),
+            "files_unchanged": unchanged,
+            "files_removed": len(removed),
+            "pages_processed": pages,
+            "processing_seconds": round(elapsed, 2),
+            "pages_per_second": round(pages_per_second, 2),
+            "total_chunks": sum(e["chunks"] for e in files.values()),
+            "total_qa_pairs": sum(e["qa_pairs"] for e in files.values()),
+            "results": results,
+            "output_dir": self.output_dir
+        }
+    
+    def _process_pending(self, pdf_paths: List[Path]):
+        """
+        Process PDFs, in parallel when workers > 1.
+        
+        Yields (path, result, error) in completion order.
+        """
+        if self.workers == 1 or len(pdf_paths) <= 1:
+            for pdf_path in pdf_paths:
+                try:
+                    yield pdf_path, self.process_pdf(str(pdf_path)), None
+                except Exception as e:
+                    yield pdf_path, None, e
+            return
+        
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(pdf_paths))) as executor:
+            futures = {executor.submit(self.process_pdf, str(p)): p for p in pdf_paths}
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result(), None
+                except Exception as e:
+                    yield futures[future], None, e
+    
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.output_dir, "manifest.json")
+    
+    def _output_path(self, filename: str) -> str:
+        """Per-PDF extraction output, reused while the PDF is unchanged"""
+        return os.path.join(self.output_dir, "processed", f"{filename}.json")
+    
+    def load_manifest(self) -> Dict:
+        """
+        Load the ingestion manifest.
+        
+        "files" maps each processed PDF to its path, size, mtime, content
+        hash and chunk IDs; "indexed" maps each PDF to the chunk IDs
+        currently loaded into the RAG vector store.
+        """
+        if not os.path.exists(self.manifest_path):
+            return {"files": {}, "indexed": {}}
+        
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        manifest.setdefault("files", {})
+        manifest.setdefault("indexed", {})
+        return manifest
+    
+    def save_manifest(self, manifest: Dict):
+        """Write the manifest atomically"""
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+    
+    @staticmethod
+    def file_hash(path: Path) -> str:
+        """SHA-256 of a file's contents"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+    
+    def _is_unchanged(self, pdf_path: Path, entry: Dict) -> bool:
+        """Compare a PDF with its manifest entry, hashing only when size/mtime disagree"""
+        if not os.path.exists(self._output_path(pdf_path.name)):
+            return False
+        
+        stat = pdf_path.stat()
+        if stat.st_size != entry["size"]:
+            return False
+        if stat.st_mtime_ns == entry["mtime_ns"]:
+            return True
+        
+        # Touched but possibly identical (e.g. copied again)
+        if self.file_hash(pdf_path) == entry["sha256"]:
+            entry["mtime_ns"] = stat.st_mtime_ns
+            return True
+        return False
+    
+    def _record_result(self, manifest: Dict, pdf_path: Path, result: Dict):
+        """Save a PDF's extraction output and its manifest entry"""
+        from app.ml.rag_service import document_id
+        
+        output_path = self._output_path(result["filename"])
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False)
+        
+        stat = pdf_path.stat()
+        manifest["files"][result["filename"]] = {
+            "path": str(pdf_path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": self.file_hash(pdf_path),
+            "chunks": len(result["chunks"]),
+            "qa_pairs": len(result["qa_pairs"]),
+            "chunk_ids": [
+                document_id(c["text"], {"source": c["source"], "section": c["section"]})
+                for c in result["chunks"]
+            ]
+        }
+    
+    def _load_result(self, filename: str) -> Dict:
+        with open(self._output_path(filename), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    def _write_combined_outputs(self, manifest: Dict, training_data_path: str, chunks_path: str):
+        """Rebuild training_data.json and rag_chunks.json from per-PDF outputs"""
+        all_chunks = []
+        all_qa_pairs = []
+        
+        for filename in sorted(manifest["files"]):
+            result = self._load_result(filename)
+            all_chunks.extend(result["chunks"])
+            all_qa_pairs.extend(result["qa_pairs"])
+        
+        # Save training data
         with open(training_data_path, 'w', encoding='utf-8') as f:
             json.dump(all_qa_pairs, f, indent=2, ensure_ascii=False)
         logger.info(f"Saved {len(all_qa_pairs)} Q&A pairs to {training_data_path}")
         
         # Save chunks for RAG
-        chunks_path = os.path.join(self.output_dir, "rag_chunks.json")
         with open(chunks_path, 'w', encoding='utf-8') as f:
             json.dump(all_chunks, f, indent=2, ensure_ascii=False)
         logger.info(f"Saved {len(all_chunks)} chunks to {chunks_path}")
-        
-        return {
-            "status": "completed",
-            "files_processed": len(pdf_files),
-            "total_chunks": len(all_chunks),
-            "total_qa_pairs": len(all_qa_pairs),
-            "results": results,
-            "output_dir": self.output_dir
-        }
     
-    def load_chunks_to_rag(self) -> int:
+    def load_chunks_to_rag(self, full: bool = False) -> int:
         """
         Load processed chunks into RAG vector store.
         
+        With a manifest, only PDFs whose chunks changed since the last load
+        are touched: their stale chunks are deleted and new ones added, and
+        chunks of removed PDFs are purged. PDFs recorded as loaded are
+        checked against the collection, so a deleted or rebuilt vector
+        store is refilled.
+        
+        Args:
+            full: Re-add every chunk (e.g. after clearing the collection)
+            
+        Returns:
+            Number of documents added
+        """
+        from app.ml.rag_service import get_rag_service
+        
+        if not os.path.exists(self.manifest_path):
+            return self._load_all_chunks_to_rag()
+        
+        manifest = self.load_manifest()
+        files = manifest["files"]
+        indexed = {} if full else manifest["indexed"]
+        
+        rag = get_rag_service()
+        rag.initialize()
+        
+        added = 0
+        deleted = 0
+        
+        # Trust the manifest only for chunks the collection really holds
+        recorded = [i for name, ids in indexed.items() if name in files for i in ids]
+        present = rag.existing_ids(recorded) if recorded else set()
+        missing = [name for name, ids in indexed.items() if name in files and not set(ids) <= present]
+        if missing:
+            logger.warning(f"{len(missing)} PDF(s) recorded as indexed are missing chunks - re-adding")
+        
+        try:
+            # Purge chunks of removed PDFs
+            for filename in [name for name in indexed if name not in files]:
+                deleted += rag.delete_where(source=filename)
+                del indexed[filename]
+            
+            for filename, entry in files.items():
+                if indexed.get(filename) == entry["chunk_ids"] and filename not in missing:
+                    continue
+                
+                stale = set(indexed.get(filename, [])) - set(entry["chunk_ids"])
+                if stale:
+                    deleted += rag.delete_documents(list(stale))
+                
+                chunks = self._load_result(filename)["chunks"]
+                added += rag.add_documents(
+                    [c["text"] for c in chunks],
+                    [{"source": c["source"], "section": c["section"]} for c in chunks]
+                )
+                indexed[filename] = entry["chunk_ids"]
+        finally:
+            manifest["indexed"] = indexed
+            self.save_manifest(manifest)
+        
+        logger.info(f"RAG sync: added {added} chunks, deleted {deleted} stale chunks")
+        return added
+    
+    def _load_all_chunks_to_rag(self) -> int:
+        """
+        Load every chunk in rag_chunks.json (no manifest yet).
+        
         Returns:
             Number of documents added
         """
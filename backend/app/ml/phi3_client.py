@@ -4,16 +4,68 @@ Handles inference with microsoft/Phi-3-mini-4k-instruct model
 """
 
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
-from typing import Optional, Tuple, Generator
+from transformers import (
+    AutoTokenizer,
+    BitsAndBytesConfig,
+    StoppingCriteria,
+    StoppingCriteriaList,
+    TextIteratorStreamer,
+    TextStreamer
+)
+from typing import Optional, Tuple, Generator, List, AsyncGenerator
+import asyncio
 import logging
 import os
+import threading
+import time
 
-from app.config import settings
+try:
+    from transformers import DynamicCache
+except ImportError:
+    DynamicCache = None
+
+from app.config import settings, DEFAULT_SYSTEM_PROMPT
+from app.ml.inference_executor import get_inference_executor
+from app.ml.model_loading import load_causal_lm, peak_rss_mb
+from app.ml.prompt_builder import PromptBuilder
 
 logger = logging.getLogger(__name__)
 
 
+class _StopOnEvent(StoppingCriteria):
+    """Stops generation once the consumer has gone away"""
+    
+    def __init__(self, event: threading.Event):
+        self.event = event
+    
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        return self.event.is_set()
+
+
+class _AsyncTextStreamer(TextStreamer):
+    """Streamer that pushes decoded text onto an asyncio queue from the worker thread"""
+    
+    def __init__(self, tokenizer, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue):
+        super().__init__(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        self.loop = loop
+        self.queue = queue
+        self.stopped = False
+    
+    def stop(self):
+        """Stop handing text to the event loop (the consumer has gone)"""
+        self.stopped = True
+    
+    def on_finalized_text(self, text: str, stream_end: bool = False):
+        if text and not self.stopped:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, text)
+
+
+def _consume_result(job: asyncio.Future):
+    """Retrieve an abandoned job's outcome so its error is not reported as unhandled"""
+    if not job.cancelled():
+        job.exception()
+
+
 class Phi3Client:
     """
     Client for Phi-3 model inference.
@@ -24,20 +76,37 @@ class Phi3Client:
         self.model = None
         self.tokenizer = None
         self.device = None
+        self.prompt_builder = None
         self._initialized = False
+        self._init_lock = threading.Lock()
+        self._prefix_ids = None
+        self._prefix_cache = None
+        self.speculative = None
+        self.compiled = None
     
     def initialize(self, use_finetuned: bool = True):
         """
         Initialize the Phi-3 model.
         
+        Safe to call from several threads: only the first caller loads the
+        model, the others wait for it instead of loading their own copy.
+        
         Args:
             use_finetuned: If True, load fine-tuned model if available
         """
         if self._initialized:
-            logger.info("Phi-3 model already initialized")
             return
         
+        with self._init_lock:
+            if self._initialized:
+                logger.info("Phi-3 model already initialized")
+                return
+            self._load(use_finetuned)
+    
+    def _load(self, use_finetuned: bool):
+        """Load the model and tokenizer (init lock held)"""
         logger.info("Initializing Phi-3 model...")
+        started_at = time.perf_counter()
         
         # Determine device
         if settings.use_gpu and torch.cuda.is_available():
@@ -52,8 +121,13 @@ class Phi3Client:
         logger.info(f"Loading model from: {model_path}")
         
         try:
+            if settings.inference_backend == "onnx":
+                # Exported graph on ONNX Runtime's CPU execution provider
+                from app.ml.onnx_backend import load_onnx_model
+                self.device = "cpu"
+                self.model = load_onnx_model(model_path)
             # Configure quantization for memory efficiency
-            if settings.use_quantization and self.device == "cuda":
+            elif settings.use_quantization and self.device == "cuda":
                 quantization_config = BitsAndBytesConfig(
                     load_in_4bit=True,
                     bnb_4bit_compute_dtype=torch.float16,
@@ -61,24 +135,25 @@ class Phi3Client:
                     bnb_4bit_use_double_quant=True
                 )
                 
-                self.model = AutoModelForCausalLM.from_pretrained(
+                self.model = load_causal_lm(
                     model_path,
+                    torch.float16,
                     quantization_config=quantization_config,
-                    device_map="auto",
-                    trust_remote_code=True,
-                    torch_dtype=torch.float16
+                    device_map="auto"
                 )
+            elif self.device == "cpu" and settings.cpu_quantization != "none":
+                # Dynamic int8 / bf16 weights for CPU-only deployments
+                from app.ml.cpu_quantization import load_cpu_model
+                self.model = load_cpu_model(model_path, settings.cpu_quantization)
             else:
                 # Load without quantization (for CPU or if disabled)
-                self.model = AutoModelForCausalLM.from_pretrained(
+                # Weights land directly on their device; no extra .to() copy on CPU
+                self.model = load_causal_lm(
                     model_path,
-                    device_map="auto" if self.device == "cuda" else None,
-                    trust_remote_code=True,
-                    torch_dtype=torch.float16 if self.device == "cuda" else torch.float32
+                    torch.float16 if self.device == "cuda" else torch.float32,
+                    mmap_weights=settings.mmap_weights and self.device == "cpu",
+                    device_map="auto" if self.device == "cuda" else None
                 )
-                
-                if self.device == "cpu":
-                    self.model = self.model.to(self.device)
             
             # Load tokenizer
             self.tokenizer = AutoTokenizer.from_pretrained(
@@ -89,8 +164,34 @@ class Phi3Client:
             if self.tokenizer.pad_token is None:
                 self.tokenizer.pad_token = self.tokenizer.eos_token
             
+            # Left padding keeps prompts right-aligned for batched generation
+            self.tokenizer.padding_side = "left"
+            
+            self.prompt_builder = PromptBuilder(
+                self.tokenizer,
+                context_window=settings.context_window
+            )
+            
+            if settings.draft_model_name and settings.inference_backend != "onnx":
+                from app.ml.speculative import create_speculative_decoder
+                self.speculative = create_speculative_decoder(self.tokenizer, self.device)
+            
+            if settings.compile_enabled and settings.inference_backend != "onnx":
+                if self.speculative is not None:
+                    logger.warning("COMPILE_ENABLED ignored - not combined with speculative decoding")
+                else:
+                    from app.ml.compiled_decoding import create_compiled_decoder
+                    self.compiled = create_compiled_decoder(self.model, self.tokenizer, self.device)
+            
+            # The ONNX graph takes legacy past-key-value tuples only
+            if settings.prefix_cache_enabled and settings.inference_backend != "onnx" and self.compiled is None:
+                self.build_prefix_cache()
+            
             self._initialized = True
-            logger.info("Phi-3 model initialized successfully")
+            logger.info(
+                f"Phi-3 model initialized successfully in {time.perf_counter() - started_at:.1f}s "
+                f"(peak RSS {peak_rss_mb():.0f}MB)"
+            )
             
         except Exception as e:
             logger.error(f"Failed to initialize Phi-3 model: {e}")
@@ -101,7 +202,8 @@ class Phi3Client:
         prompt: str,
         max_tokens: Optional[int] = None,
         temperature: Optional[float] = None,
-        system_prompt: Optional[str] = None
+        system_prompt: Optional[str] = None,
+        context: Optional[List[str]] = None
     ) -> Tuple[str, dict]:
         """
         Generate a response from the model.
@@ -111,6 +213,7 @@ class Phi3Client:
             max_tokens: Maximum tokens to generate
             temperature: Sampling temperature
             system_prompt: Optional system prompt for context
+            context: Optional retrieved chunks, highest-ranked first
             
         Returns:
             Tuple of (response_text, token_usage)
@@ -121,45 +224,26 @@ class Phi3Client:
         max_tokens = max_tokens or settings.max_tokens
         temperature = temperature or settings.temperature
         
-        # Build the conversation format for Qwen
-        messages = []
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-        else:
-            messages.append({"role": "system", "content": "You are an intelligent AI Study Buddy, an educational assistant designed to help students learn effectively. You provide clear, accurate, and helpful explanations on various academic topics. Be encouraging, patient, and thorough in your responses. Use examples when helpful and break down complex concepts into understandable parts."})
-        messages.append({"role": "user", "content": prompt})
-        
-        # Use the tokenizer's chat template
-        full_prompt = self.tokenizer.apply_chat_template(
-            messages,
-            tokenize=False,
-            add_generation_prompt=True
-        )
-        
-        # Tokenize input
-        inputs = self.tokenizer(
-            full_prompt,
-            return_tensors="pt",
-            truncation=True,
-            max_length=4096 - max_tokens
-        ).to(self.device)
+        full_prompt = self._build_prompt(prompt, system_prompt, context, max_tokens)
+        inputs = self._tokenize(full_prompt, max_tokens)
         
         input_token_count = inputs["input_ids"].shape[1]
+        inputs, decoding_kwargs = self._prepare_decoding(inputs, max_tokens)
+        prompt_length = inputs["input_ids"].shape[1]
+        rounds_before = self.speculative.rounds if self.speculative else 0
+        started_at = time.perf_counter()
         
         # Generate response
         with torch.no_grad():
             outputs = self.model.generate(
                 **inputs,
-                max_new_tokens=max_tokens,
-                temperature=temperature,
-                do_sample=True,
-                top_p=0.95,
-                top_k=50,
-                pad_token_id=self.tokenizer.pad_token_id,
-                eos_token_id=self.tokenizer.eos_token_id,
-                repetition_penalty=1.1
+                **decoding_kwargs,
+                **self._sampling_kwargs(max_tokens, temperature)
             )
         
+        if self.speculative:
+            self.speculative.record(rounds_before, outputs.shape[1] - prompt_length, time.perf_counter() - started_at)
+        
         # Decode response
         full_output = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
         
@@ -176,7 +260,7 @@ class Phi3Client:
         # Clean up any remaining special tokens
         response = response.replace("<|im_end|>", "").replace("<|im_start|>", "").strip()
         
-        output_token_count = outputs.shape[1] - input_token_count
+        output_token_count = outputs.shape[1] - prompt_length
         
         token_usage = {
             "input": input_token_count,
@@ -185,21 +269,239 @@ class Phi3Client:
         
         return response, token_usage
     
+    def generate_batch(
+        self,
+        prompts: List[str],
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        system_prompts: Optional[List[Optional[str]]] = None,
+        contexts: Optional[List[Optional[List[str]]]] = None
+    ) -> List[Tuple[str, dict]]:
+        """
+        Generate responses for several prompts in one batched forward pass.
+        
+        Prompts are left-padded to a common length so every sequence's
+        generated tokens start at the same position.
+        
+        Args:
+            prompts: User messages
+            max_tokens: Maximum tokens to generate (shared by the batch)
+            temperature: Sampling temperature (shared by the batch)
+            system_prompts: Optional per-prompt system prompts
+            contexts: Optional per-prompt retrieved chunks
+            
+        Returns:
+            List of (response_text, token_usage) in the same order as prompts
+        """
+        if not self._initialized:
+            self.initialize()
+        
+        max_tokens = max_tokens or settings.max_tokens
+        temperature = temperature or settings.temperature
+        system_prompts = system_prompts or [None] * len(prompts)
+        contexts = contexts or [None] * len(prompts)
+        
+        full_prompts = [
+            self._build_prompt(prompt, system_prompt, context, max_tokens)
+            for prompt, system_prompt, context in zip(prompts, system_prompts, contexts)
+        ]
+        
+        inputs = self.tokenizer(
+            full_prompts,
+            return_tensors="pt",
+            padding=True,
+            truncation=True,
+            max_length=settings.context_window - max_tokens
+        ).to(self.device)
+        
+        padded_length = inputs["input_ids"].shape[1]
+        input_token_counts = inputs["attention_mask"].sum(dim=1).tolist()
+        
+        with torch.no_grad():
+            outputs = self.model.generate(
+                **inputs,
+                **self._sampling_kwargs(max_tokens, temperature)
+            )
+        
+        results = []
+        for i, input_token_count in enumerate(input_token_counts):
+            generated = outputs[i, padded_length:]
+            # Finished sequences are padded with pad/eos tokens up to the batch length
+            output_token_count = int((generated != self.tokenizer.pad_token_id).sum().item())
+            response = self.tokenizer.decode(generated, skip_special_tokens=True).strip()
+            results.append((response, {
+                "input": int(input_token_count),
+                "output": output_token_count
+            }))
+        
+        return results
+    
+    def _build_prompt(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        context: Optional[List[str]] = None,
+        max_tokens: Optional[int] = None
+    ) -> str:
+        """Render the chat template with as much context as the token budget allows"""
+        full_prompt, stats = self.prompt_builder.build(
+            question=prompt,
+            system_prompt=system_prompt or DEFAULT_SYSTEM_PROMPT,
+            context_chunks=context,
+            max_new_tokens=max_tokens or settings.max_tokens
+        )
+        
+        if stats["chunks_dropped"] or stats["question_truncated"]:
+            logger.info(
+                f"Prompt budget {stats['budget']} tokens: used {stats['chunks_used']} chunk(s), "
+                f"dropped {stats['chunks_dropped']}"
+            )
+        
+        return full_prompt
+    
+    def build_prefix_cache(self):
+        """
+        Precompute past-key-values for the static system-prompt prefix.
+        
+        The prefix is the chat template up to the end of DEFAULT_SYSTEM_PROMPT.
+        The last prefix token is left out so that text appended after it
+        (RAG context) cannot merge with it into a different token.
+        """
+        try:
+            rendered = self.prompt_builder.render(DEFAULT_SYSTEM_PROMPT, "placeholder")
+            end = rendered.find(DEFAULT_SYSTEM_PROMPT)
+            if end < 0:
+                logger.warning("System prompt not found in chat template - prefix cache disabled")
+                return
+            
+            prefix_text = rendered[:end + len(DEFAULT_SYSTEM_PROMPT)]
+            prefix_ids = self.tokenizer(prefix_text, return_tensors="pt")["input_ids"][:, :-1].to(self.device)
+            
+            with torch.no_grad():
+                outputs = self.model(input_ids=prefix_ids, use_cache=True)
+            
+            past_key_values = outputs.past_key_values
+            if hasattr(past_key_values, "to_legacy_cache"):
+                past_key_values = past_key_values.to_legacy_cache()
+            
+            self._prefix_ids = prefix_ids[0]
+            self._prefix_cache = past_key_values
+            logger.info(f"Cached KV for {prefix_ids.shape[1]}-token system prompt prefix")
+            
+        except Exception as e:
+            self._prefix_ids = None
+            self._prefix_cache = None
+            logger.warning(f"Could not build prefix cache: {e}")
+    
+    def _prefix_cache_kwargs(self, input_ids: torch.Tensor) -> dict:
+        """
+        generate() kwargs that start from the cached system-prompt prefix.
+        
+        Returns an empty dict when the prompt does not start with the
+        cached prefix, or for batched inputs.
+        """
+        if self._prefix_cache is None or input_ids.shape[0] != 1:
+            return {}
+        
+        prefix_length = self._prefix_ids.shape[0]
+        if input_ids.shape[1] <= prefix_length or not torch.equal(input_ids[0, :prefix_length], self._prefix_ids):
+            return {}
+        
+        # The model concatenates new keys/values onto new tensors rather than
+        # writing in place, so each request can share the cached tensors
+        if DynamicCache is not None:
+            return {"past_key_values": DynamicCache.from_legacy_cache(self._prefix_cache)}
+        return {"past_key_values": self._prefix_cache}
+    
+    def _prepare_decoding(self, inputs, max_tokens: int) -> Tuple[dict, dict]:
+        """
+        Pick the single-sequence decoding mode.
+        
+        Compiled decoding pads the prompt to its bucket and uses a static
+        cache; otherwise the draft model is used when speculative decoding
+        is on, else the cached system-prompt prefix.
+        
+        Returns:
+            Tuple of (inputs, generate_kwargs)
+        """
+        if self.compiled is not None and inputs["input_ids"].shape[0] == 1:
+            return self.compiled.pad_inputs(inputs, max_tokens), self.compiled.generate_kwargs()
+        
+        if self.speculative is not None:
+            assisted = self.speculative.generate_kwargs(inputs["input_ids"])
+            if assisted:
+                return inputs, assisted
+        
+        return inputs, self._prefix_cache_kwargs(inputs["input_ids"])
+    
+    def _tokenize(self, full_prompt: str, max_tokens: int):
+        """Tokenize a rendered prompt, leaving room for max_tokens of output"""
+        return self.tokenizer(
+            full_prompt,
+            return_tensors="pt",
+            truncation=True,
+            max_length=settings.context_window - max_tokens
+        ).to(self.device)
+    
+    def _sampling_kwargs(self, max_tokens: int, temperature: float) -> dict:
+        """Common sampling arguments for model.generate()"""
+        return {
+            "max_new_tokens": max_tokens,
+            "temperature": temperature,
+            "do_sample": True,
+            "top_p": 0.95,
+            "top_k": 50,
+            "pad_token_id": self.tokenizer.pad_token_id,
+            "eos_token_id": self.tokenizer.eos_token_id,
+            "repetition_penalty": 1.1
+        }
+    
+    async def agenerate(
+        self,
+        prompt: str,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        system_prompt: Optional[str] = None,
+        context: Optional[List[str]] = None
+    ) -> Tuple[str, dict]:
+        """
+        Async wrapper around generate() for use inside request handlers.
+        
+        Runs on the shared inference executor so the event loop stays free
+        while the model loads and generates.
+        
+        Raises:
+            InferenceQueueFull: If the inference queue is saturated
+        """
+        return await get_inference_executor().run(
+            self.generate,
+            prompt,
+            max_tokens,
+            temperature,
+            system_prompt,
+            context
+        )
+    
     def generate_stream(
         self,
         prompt: str,
         max_tokens: Optional[int] = None,
         temperature: Optional[float] = None,
-        system_prompt: Optional[str] = None
+        system_prompt: Optional[str] = None,
+        context: Optional[List[str]] = None
     ) -> Generator[str, None, None]:
         """
         Generate a streaming response from the model.
         
+        Generation runs on a background thread and text is yielded as
+        soon as the tokenizer can decode it.
+        
         Args:
             prompt: User's input message
             max_tokens: Maximum tokens to generate
             temperature: Sampling temperature
             system_prompt: Optional system prompt
+            context: Optional retrieved chunks, highest-ranked first
             
         Yields:
             Response text chunks
@@ -207,15 +509,136 @@ class Phi3Client:
         if not self._initialized:
             self.initialize()
         
-        # For streaming, we use the same generation but yield chunks
-        # Note: True streaming requires TextIteratorStreamer from transformers
-        response, _ = self.generate(prompt, max_tokens, temperature, system_prompt)
+        streamer = TextIteratorStreamer(
+            self.tokenizer,
+            skip_prompt=True,
+            skip_special_tokens=True
+        )
+        stop_event = threading.Event()
+        thread = threading.Thread(
+            target=self._stream_job,
+            args=(prompt, max_tokens, temperature, system_prompt, context, streamer, stop_event),
+            daemon=True
+        )
+        thread.start()
         
-        # Simulate streaming by yielding chunks
-        words = response.split()
-        chunk_size = 5
-        for i in range(0, len(words), chunk_size):
-            yield " ".join(words[i:i + chunk_size]) + " "
+        try:
+            for text in streamer:
+                if text:
+                    yield text
+        finally:
+            stop_event.set()
+            thread.join()
+    
+    async def agenerate_stream(
+        self,
+        prompt: str,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        system_prompt: Optional[str] = None,
+        context: Optional[List[str]] = None,
+        token_usage: Optional[dict] = None
+    ) -> AsyncGenerator[str, None]:
+        """
+        Async token stream for request handlers.
+        
+        Generation runs on the inference executor; decoded text is handed
+        back to the event loop as it is produced. Closing the generator
+        stops generation at the next token.
+        
+        Args:
+            prompt: User's input message
+            max_tokens: Maximum tokens to generate
+            temperature: Sampling temperature
+            system_prompt: Optional system prompt
+            context: Optional retrieved chunks, highest-ranked first
+            token_usage: Optional dict filled with token counts once done
+            
+        Yields:
+            Response text chunks
+        """
+        executor = get_inference_executor()
+        if not self._initialized:
+            await executor.run(self.initialize)
+        
+        queue: asyncio.Queue = asyncio.Queue()
+        streamer = _AsyncTextStreamer(self.tokenizer, asyncio.get_running_loop(), queue)
+        stop_event = threading.Event()
+        
+        job = asyncio.ensure_future(executor.run(
+            self._stream_job,
+            prompt,
+            max_tokens,
+            temperature,
+            system_prompt,
+            context,
+            streamer,
+            stop_event
+        ))
+        job.add_done_callback(lambda _: queue.put_nowait(None))
+        
+        try:
+            while True:
+                text = await queue.get()
+                if text is None:
+                    break
+                yield text
+            
+            # Surfaces generation errors and returns the token counts
+            usage = await job
+            if token_usage is not None:
+                token_usage.update(usage)
+        finally:
+            # Stop generation at the next token and stop queueing text nobody reads
+            stop_event.set()
+            streamer.stop()
+            if not job.done():
+                # Drops a job still waiting for a worker; a running one ends at the stop event
+                job.cancel()
+            job.add_done_callback(_consume_result)
+    
+    def _stream_job(
+        self,
+        prompt: str,
+        max_tokens: Optional[int],
+        temperature: Optional[float],
+        system_prompt: Optional[str],
+        context: Optional[List[str]],
+        streamer: TextStreamer,
+        stop_event: threading.Event
+    ) -> dict:
+        """Run generate() feeding tokens to a streamer; returns token usage"""
+        max_tokens = max_tokens or settings.max_tokens
+        temperature = temperature or settings.temperature
+        
+        inputs = self._tokenize(self._build_prompt(prompt, system_prompt, context, max_tokens), max_tokens)
+        input_token_count = inputs["input_ids"].shape[1]
+        inputs, decoding_kwargs = self._prepare_decoding(inputs, max_tokens)
+        prompt_length = inputs["input_ids"].shape[1]
+        rounds_before = self.speculative.rounds if self.speculative else 0
+        started_at = time.perf_counter()
+        
+        try:
+            with torch.no_grad():
+                outputs = self.model.generate(
+                    **inputs,
+                    **decoding_kwargs,
+                    streamer=streamer,
+                    stopping_criteria=StoppingCriteriaList([_StopOnEvent(stop_event)]),
+                    **self._sampling_kwargs(max_tokens, temperature)
+                )
+        except Exception:
+            # generate() only ends the stream on success
+            streamer.end()
+            raise
+        
+        if self.speculative:
+            self.speculative.record(rounds_before, outputs.shape[1] - prompt_length, time.perf_counter() - started_at)
+        
+        return {
+            "input": input_token_count,
+            "output": outputs.shape[1] - prompt_length
+        }
     
     def is_initialized(self) -> bool:
         """Check if model is initialized"""
@@ -225,10 +648,16 @@ class Phi3Client:
         """Get information about the loaded model"""
         return {
             "model_name": settings.model_name,
+            "backend": settings.inference_backend,
             "device": self.device,
             "initialized": self._initialized,
             "quantized": settings.use_quantization,
-            "max_tokens": settings.max_tokens
+            "cpu_quantization": settings.cpu_quantization if self.device == "cpu" else None,
+            "max_tokens": settings.max_tokens,
+            "prefix_cache_tokens": int(self._prefix_ids.shape[0]) if self._prefix_ids is not None else 0,
+            "speculative": self.speculative.get_stats() if self.speculative else {"enabled": False},
+            "compiled": self.compiled.get_stats() if self.compiled else {"enabled": False},
+            "executor": get_inference_executor().get_stats()
         }
 
 
@@ -0,0 +1,143 @@
+"""
+Prompt Builder
+Assembles chat prompts within the model's token window
+"""
+
+from typing import Dict, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_HEADER = "\n\nUse the following context from study materials to help answer the question:\n\n"
+CHUNK_SEPARATOR = "\n\n"
+TRUNCATION_MARKER = "..."
+
+
+class PromptBuilder:
+    """
+    Token-budgeted prompt assembly.
+
+    The budget is `context_window - max_new_tokens`. The system prompt
+    and the student's question always go in (the question is cut from
+    the front only if it alone overflows the window). Retrieved chunks
+    are added in rank order until the budget runs out; the chunk that
+    crosses the limit is trimmed if a useful amount still fits, and
+    every lower-ranked chunk is dropped.
+    """
+
+    def __init__(self, tokenizer, context_window: int = 4096, min_chunk_tokens: int = 32):
+        self.tokenizer = tokenizer
+        self.context_window = context_window
+        self.min_chunk_tokens = min_chunk_tokens
+
+    def count_tokens(self, text: str) -> int:
+        """Count tokens in a text fragment (no special tokens)"""
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def count_prompt_tokens(self, full_prompt: str) -> int:
+        """Count tokens in a rendered prompt exactly as it will be tokenized"""
+        return len(self.tokenizer(full_prompt)["input_ids"])
+
+    def render(self, system_prompt: str, question: str) -> str:
+        """Render system and user messages with the chat template"""
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": question}
+        ]
+
+        return self.tokenizer.apply_chat_template(
+            messages,
+            tokenize=False,
+            add_generation_prompt=True
+        )
+
+    def build(
+        self,
+        question: str,
+        system_prompt: str,
+        context_chunks: Optional[List[str]] = None,
+        max_new_tokens: int = 1000
+    ) -> Tuple[str, Dict]:
+        """
+        Build a prompt that fits in the window.
+
+        Args:
+            question: Student's question
+            system_prompt: Base system prompt (without context)
+            context_chunks: Retrieved chunks, highest-ranked first
+            max_new_tokens: Tokens reserved for the answer
+
+        Returns:
+            Tuple of (rendered_prompt, stats)
+        """
+        context_chunks = context_chunks or []
+        budget = self.context_window - max_new_tokens
+
+        question, question_truncated = self._fit_question(system_prompt, question, budget)
+        remaining = budget - self.count_prompt_tokens(self.render(system_prompt, question))
+
+        selected: List[str] = []
+        if context_chunks:
+            remaining -= self.count_tokens(CONTEXT_HEADER)
+            separator_tokens = self.count_tokens(CHUNK_SEPARATOR)
+
+            for chunk in context_chunks:
+                cost = self.count_tokens(chunk) + (separator_tokens if selected else 0)
+                if cost <= remaining:
+                    selected.append(chunk)
+                    remaining -= cost
+                    continue
+
+                room = remaining - (separator_tokens if selected else 0) - 1
+                if room >= self.min_chunk_tokens:
+                    selected.append(self._truncate(chunk, room))
+                break
+
+        # Pieces tokenized separately can differ slightly from the joined
+        # prompt, so check the real count and trim from the lowest rank
+        while True:
+            full_prompt = self.render(self._with_context(system_prompt, selected), question)
+            prompt_tokens = self.count_prompt_tokens(full_prompt)
+            if prompt_tokens <= budget or not selected:
+                break
+
+            last_tokens = self.count_tokens(selected[-1])
+            keep = last_tokens - (prompt_tokens - budget) - 2
+            if keep >= self.min_chunk_tokens:
+                selected[-1] = self._truncate(selected[-1], keep)
+            else:
+                selected.pop()
+
+        stats = {
+            "prompt_tokens": prompt_tokens,
+            "budget": budget,
+            "chunks_used": len(selected),
+            "chunks_dropped": len(context_chunks) - len(selected),
+            "question_truncated": question_truncated
+        }
+        return full_prompt, stats
+
+    def _fit_question(self, system_prompt: str, question: str, budget: int) -> Tuple[str, bool]:
+        """Trim the question from the front if it cannot fit on its own"""
+        overflow = self.count_prompt_tokens(self.render(system_prompt, question)) - budget
+        if overflow <= 0:
+            return question, False
+
+        ids = self.tokenizer.encode(question, add_special_tokens=False)
+        keep = max(0, len(ids) - overflow - 1)
+        logger.warning(f"Question exceeds prompt budget by {overflow} tokens - keeping last {keep}")
+        return TRUNCATION_MARKER + self.tokenizer.decode(ids[len(ids) - keep:]), True
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        """Cut a chunk to at most max_tokens (plus a marker)"""
+        ids = self.tokenizer.encode(text, add_special_tokens=False)
+        if len(ids) <= max_tokens:
+            return text
+        return self.tokenizer.decode(ids[:max_tokens]) + TRUNCATION_MARKER
+
+    @staticmethod
+    def _with_context(system_prompt: str, chunks: List[str]) -> str:
+        """Append the selected chunks to the system prompt"""
+        if not chunks:
+            return system_prompt
+        return system_prompt + CONTEXT_HEADER + CHUNK_SEPARATOR.join(chunks)
@@ -6,14 +6,30 @@ Combines vector search with LLM generation for context-aware responses
 import chromadb
 from chromadb.config import Settings as ChromaSettings
 from typing import List, Dict, Optional, Tuple
+import hashlib
 import logging
 import os
+import time
 
 from app.config import settings
 from app.ml.embeddings import get_embedding_service
 
 logger = logging.getLogger(__name__)
 
+COLLECTION_NAME = "study_materials"
+COLLECTION_DESCRIPTION = "AI Study Buddy knowledge base"
+
+
+def document_id(text: str, metadata: Optional[Dict] = None) -> str:
+    """
+    Deterministic ID for a chunk: hash of its source, section and text.
+    
+    Re-adding the same chunk maps to the same ID, so indexing is idempotent.
+    """
+    metadata = metadata or {}
+    content = f"{metadata.get('source', '')}\0{metadata.get('section', '')}\0{text}"
+    return "doc_" + hashlib.sha256(content.encode("utf-8")).hexdigest()[:32]
+
 
 class RAGService:
     """
@@ -25,6 +41,7 @@ class RAGService:
         self.client = None
         self.collection = None
         self._initialized = False
+        self._index_version = 0
     
     def initialize(self):
         """Initialize ChromaDB and create/load collection"""
@@ -48,8 +65,8 @@ class RAGService:
             
             # Get or create collection for study materials
             self.collection = self.client.get_or_create_collection(
-                name="study_materials",
-                metadata={"description": "AI Study Buddy knowledge base"}
+                name=COLLECTION_NAME,
+                metadata={"description": COLLECTION_DESCRIPTION}
             )
             
             self._initialized = True
@@ -68,13 +85,19 @@ class RAGService:
         """
         Add documents to the vector store.
         
+        Documents are written with upsert. Without explicit IDs they are
+        keyed by content (see document_id()), so adding the same chunks
+        again never grows the collection, and chunks already indexed are
+        skipped without embedding. Explicit IDs are always written, so
+        existing documents under those IDs are updated.
+        
         Args:
             documents: List of document texts
             metadatas: Optional metadata for each document
-            ids: Optional custom IDs (generated if not provided)
+            ids: Optional custom IDs (derived from content if not provided)
             
         Returns:
-            Number of documents added
+            Number of documents written
         """
         if not self._initialized:
             self.initialize()
@@ -82,25 +105,45 @@ class RAGService:
         if not documents:
             return 0
         
-        # Generate IDs if not provided
+        metadatas = metadatas or [{} for _ in documents]
+        
+        # Derive IDs from content if not provided; an existing content ID
+        # already holds exactly this chunk, so it can be skipped
+        existing = set()
         if ids is None:
-            existing_count = self.collection.count()
-            ids = [f"doc_{existing_count + i}" for i in range(len(documents))]
+            ids = [document_id(doc, meta) for doc, meta in zip(documents, metadatas)]
+            existing = self.existing_ids(ids)
+        
+        # Drop duplicates within the batch (the last one wins, as with upsert)
+        batch = {}
+        for doc_id, doc, meta in zip(ids, documents, metadatas):
+            if doc_id not in existing:
+                batch[doc_id] = (doc, meta)
+        
+        skipped = len(documents) - len(batch)
+        if not batch:
+            logger.info(f"All {len(documents)} documents already in vector store")
+            return 0
+        
+        new_ids = list(batch.keys())
+        new_documents = [batch[i][0] for i in new_ids]
+        new_metadatas = [batch[i][1] for i in new_ids]
         
         # Generate embeddings
         embedding_service = get_embedding_service()
-        embeddings = embedding_service.embed_documents(documents).tolist()
+        embeddings = embedding_service.embed_documents(new_documents).tolist()
         
-        # Add to collection
-        self.collection.add(
-            documents=documents,
+        # Upsert so concurrent or repeated indexing stays idempotent
+        self.collection.upsert(
+            documents=new_documents,
             embeddings=embeddings,
-            metadatas=metadatas or [{}] * len(documents),
-            ids=ids
+            metadatas=new_metadatas,
+            ids=new_ids
         )
         
-        logger.info(f"Added {len(documents)} documents to vector store")
-        return len(documents)
+        self._mark_modified()
+        logger.info(f"Upserted {len(new_ids)} documents to vector store ({skipped} unchanged or duplicate)")
+        return len(new_ids)
     
     def search(
         self,
@@ -165,16 +208,27 @@ class RAGService:
             Formatted context string
         """
         results = self.search(query, n_results=n_results)
+        return self.format_context(results, max_context_length)
+    
+    def format_context(self, results: List[Dict], max_context_length: int = 2000) -> str:
+        """
+        Format search results into a character-limited context string.
         
+        Args:
+            results: Results from search(), highest-ranked first
+            max_context_length: Maximum characters for context
+            
+        Returns:
+            Formatted context string
+        """
         if not results:
             return ""
         
         context_parts = []
         total_length = 0
         
-        for i, result in enumerate(results):
+        for result in results:
             doc = result["document"]
-            metadata = result["metadata"]
             
             # Check length limit
             if total_length + len(doc) > max_context_length:
@@ -185,20 +239,34 @@ class RAGService:
                 else:
                     break
             
-            # Format context with metadata
-            source = metadata.get("source", "Study Material")
-            section = metadata.get("section", "")
-            
-            context_part = f"[Source: {source}"
-            if section:
-                context_part += f" - {section}"
-            context_part += f"]\n{doc}"
-            
-            context_parts.append(context_part)
+            context_parts.append(self.format_result(result, doc))
             total_length += len(doc)
         
         return "\n\n".join(context_parts)
     
+    @staticmethod
+    def format_result(result: Dict, document: Optional[str] = None) -> str:
+        """
+        Format one search result with its source header.
+        
+        Args:
+            result: Result from search()
+            document: Optional replacement text (e.g. a truncated document)
+            
+        Returns:
+            Context block for the prompt
+        """
+        metadata = result.get("metadata") or {}
+        source = metadata.get("source", "Study Material")
+        section = metadata.get("section", "")
+        
+        context_part = f"[Source: {source}"
+        if section:
+            context_part += f" - {section}"
+        context_part += f"]\n{document if document is not None else result['document']}"
+        
+        return context_part
+    
     def delete_documents(self, ids: List[str]) -> int:
         """
         Delete documents from the vector store.
@@ -213,20 +281,64 @@ class RAGService:
             self.initialize()
         
         self.collection.delete(ids=ids)
+        self._mark_modified()
         logger.info(f"Deleted {len(ids)} documents from vector store")
         return len(ids)
     
+    def existing_ids(self, ids: List[str], batch_size: int = 5000) -> set:
+        """
+        Return which of the given IDs are stored in the collection.
+        
+        Args:
+            ids: Document IDs to look up
+            batch_size: IDs per ChromaDB lookup
+        """
+        if not self._initialized:
+            self.initialize()
+        
+        unique = list(set(ids))
+        found = set()
+        for start in range(0, len(unique), batch_size):
+            found.update(self.collection.get(ids=unique[start:start + batch_size], include=[])["ids"])
+        return found
+    
+    def delete_where(self, source: Optional[str] = None, where: Optional[Dict] = None) -> int:
+        """
+        Delete documents matching a metadata filter.
+        
+        Args:
+            source: Delete every chunk of this source (e.g. a PDF file name)
+            where: Optional raw ChromaDB metadata filter instead of source
+            
+        Returns:
+            Number of documents deleted
+        """
+        if not self._initialized:
+            self.initialize()
+        
+        if where is None:
+            if source is None:
+                raise ValueError("delete_where() needs a source or a where filter")
+            where = {"source": source}
+        
+        ids = self.collection.get(where=where, include=[])["ids"]
+        if not ids:
+            return 0
+        
+        return self.delete_documents(ids)
+    
     def clear_collection(self):
         """Clear all documents from the collection"""
         if not self._initialized:
             self.initialize()
         
         # Delete and recreate collection
-        self.client.delete_collection("study_materials")
+        self.client.delete_collection(COLLECTION_NAME)
         self.collection = self.client.create_collection(
-            name="study_materials",
-            metadata={"description": "AI Study Buddy knowledge base"}
+            name=COLLECTION_NAME,
+            metadata={"description": COLLECTION_DESCRIPTION}
         )
+        self._mark_modified()
         logger.info("Cleared vector store collection")
     
     def get_stats(self) -> Dict:
@@ -236,10 +348,47 @@ class RAGService:
         
         return {
             "document_count": self.collection.count(),
-            "collection_name": "study_materials",
+            "collection_name": COLLECTION_NAME,
             "persist_directory": settings.chroma_persist_dir
         }
     
+    def _mark_modified(self):
+        """
+        Record that the index changed.
+        
+        A fresh marker is written to the collection metadata so that
+        servers notice re-indexing done by another process
+        (scripts/index_rag.py), even when the document count is unchanged.
+        """
+        self._index_version += 1
+        marker = f"{time.time_ns()}-{os.getpid()}-{self._index_version}"
+        try:
+            self.collection.modify(metadata={
+                "description": COLLECTION_DESCRIPTION,
+                "index_version": marker
+            })
+        except Exception as e:
+            logger.warning(f"Could not write RAG index version marker: {e}")
+    
+    def get_index_version(self) -> str:
+        """
+        Get a version string that changes whenever the index changes.
+        
+        Reads the marker written by _mark_modified() from the stored
+        collection, so changes made by other processes are seen too.
+        Collections indexed before markers existed fall back to the
+        document count.
+        """
+        if not self._initialized:
+            self.initialize()
+        
+        collection = self.client.get_collection(COLLECTION_NAME)
+        marker = (collection.metadata or {}).get("index_version")
+        if marker:
+            return marker
+        
+        return f"{self._index_version}:{collection.count()}"
+    
     def is_initialized(self) -> bool:
         """Check if service is initialized"""
         return self._initialized
@@ -0,0 +1,505 @@
+"""
+Replica Pool
+Runs N Phi-3 replicas in worker processes pinned to disjoint CPU cores
+"""
+
+import asyncio
+import itertools
+import logging
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+import uuid
+from typing import AsyncGenerator, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.ml.inference_executor import InferenceQueueFull
+
+logger = logging.getLogger(__name__)
+
+ROUND_ROBIN = "round_robin"
+LEAST_LOADED = "least_loaded"
+
+# How often the response reader checks that replicas are still alive
+_HEALTH_CHECK_INTERVAL = 1.0
+
+# Replica messages that end a request
+_TERMINAL = {"result", "done", "error", "cancelled"}
+
+
+class ReplicaUnavailable(RuntimeError):
+    """Raised when no replica can take a request"""
+
+
+def partition_cores(cores: List[int], count: int) -> List[List[int]]:
+    """
+    Split the available cores into `count` disjoint, contiguous sets.
+
+    Remainder cores go one each to the first sets, so none sit idle.
+    """
+    count = max(1, min(count, len(cores)))
+    size, extra = divmod(len(cores), count)
+    partitions = []
+    start = 0
+    for i in range(count):
+        end = start + size + (1 if i < extra else 0)
+        partitions.append(cores[start:end])
+        start = end
+    return partitions
+
+
+def _replica_main(index: int, cores: List[int], threads: int, requests, cancels, responses):
+    """
+    Worker process entry point: pin to cores, load Phi-3, serve requests.
+
+    Messages in:  (request_id, kind, kwargs) or None to exit; abandoned
+                  request ids arrive on `cancels`
+    Messages out: (request_id, "ready" | "result" | "chunk" | "done" | "error" | "cancelled", payload)
+    """
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+    import torch
+    from transformers import TextStreamer
+
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+
+    from app.ml.phi3_client import Phi3Client
+
+    cancelled = set()
+
+    def is_cancelled(request_id: str) -> bool:
+        while True:
+            try:
+                cancelled.add(cancels.get_nowait())
+            except queue.Empty:
+                return request_id in cancelled
+
+    class _QueueStreamer(TextStreamer):
+        """Forwards (stream) or collects (generate) decoded text; stops on cancellation"""
+
+        def __init__(self, tokenizer, request_id: str, stop_event: threading.Event, forward: bool):
+            super().__init__(tokenizer, skip_prompt=True, skip_special_tokens=True)
+            self.request_id = request_id
+            self.stop_event = stop_event
+            self.forward = forward
+            self.parts: List[str] = []
+
+        def on_finalized_text(self, text: str, stream_end: bool = False):
+            if is_cancelled(self.request_id):
+                self.stop_event.set()
+            elif text and self.forward:
+                responses.put((self.request_id, "chunk", text))
+            elif text:
+                self.parts.append(text)
+
+    client = Phi3Client()
+    try:
+        client.initialize()
+        client.generate("Hello", max_tokens=8)
+    except Exception as e:
+        responses.put((None, "error", f"replica {index}: {e}"))
+        return
+
+    responses.put((None, "ready", index))
+
+    while True:
+        message = requests.get()
+        if message is None:
+            break
+
+        request_id, kind, kwargs = message
+        try:
+            # Skip requests whose caller went away while they were queued
+            if is_cancelled(request_id):
+                responses.put((request_id, "cancelled", None))
+                continue
+
+            # Both kinds decode through the streamer so either can be stopped mid-generation
+            stop_event = threading.Event()
+            streamer = _QueueStreamer(client.tokenizer, request_id, stop_event, forward=kind == "stream")
+            usage = client._stream_job(streamer=streamer, stop_event=stop_event, **kwargs)
+
+            if stop_event.is_set():
+                responses.put((request_id, "cancelled", None))
+            elif kind == "generate":
+                responses.put((request_id, "result", ("".join(streamer.parts).strip(), usage)))
+            else:
+                responses.put((request_id, "done", usage))
+        except Exception as e:
+            responses.put((request_id, "error", str(e)))
+        finally:
+            cancelled.discard(request_id)
+
+
+class _Replica:
+    """Parent-side handle for one worker process"""
+
+    def __init__(self, index: int, cores: List[int], threads: int, context, responses):
+        self.index = index
+        self.cores = cores
+        self.threads = threads
+        self.requests = context.Queue()
+        self.cancels = context.Queue()
+        self.process = context.Process(
+            target=_replica_main,
+            args=(index, cores, threads, self.requests, self.cancels, responses),
+            name=f"phi3-replica-{index}",
+            daemon=True
+        )
+        # Requests the replica has not reported finished (even if their caller left)
+        self.pending: Dict[str, float] = {}
+        self.alive = True
+        self.completed = 0
+        self.failed = 0
+        self.total_time = 0.0
+
+
+class ReplicaPool:
+    """
+    N independent Phi-3 replicas, one process each.
+
+    The process's cores are split into N disjoint sets; each replica is
+    pinned to its set and uses that many intra-op threads, so replicas do
+    not contend for cores. Requests go to the replica with the fewest
+    pending requests (least_loaded) or to the next one in turn
+    (round_robin). Fewer, wider replicas favour latency; more, narrower
+    ones favour throughput.
+
+    Each replica accepts at most `max_pending` requests (running plus
+    queued); beyond that InferenceQueueFull is raised, as with the
+    in-process InferenceExecutor.
+
+    Weights are memory-mapped where possible (MMAP_WEIGHTS), so replicas
+    share most model pages through the OS page cache.
+    """
+
+    def __init__(
+        self,
+        count: int,
+        threads_per_replica: int = 0,
+        policy: str = LEAST_LOADED,
+        max_pending: int = 4
+    ):
+        if policy not in (ROUND_ROBIN, LEAST_LOADED):
+            raise ValueError(f"Unknown replica dispatch policy '{policy}'")
+
+        self.count = count
+        self.threads_per_replica = threads_per_replica
+        self.policy = policy
+        self.max_pending = max(1, max_pending)
+        self.replicas: List[_Replica] = []
+        self._responses = None
+        self._reader: Optional[threading.Thread] = None
+        self._routes: Dict[str, Tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = {}
+        self._owners: Dict[str, _Replica] = {}
+        self._lock = threading.Lock()
+        self._init_lock = threading.Lock()
+        self._round_robin = None
+        self._initialized = False
+        self._closed = False
+
+    def initialize(self):
+        """Start the replica processes and block until every one has loaded"""
+        with self._init_lock:
+            if self._initialized:
+                return
+
+            context = mp.get_context("spawn")
+            self._responses = context.Queue()
+
+            available = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+            partitions = partition_cores(available, self.count)
+            if len(partitions) < self.count:
+                logger.warning(f"Only {len(available)} core(s) available - starting {len(partitions)} replica(s)")
+
+            for index, cores in enumerate(partitions):
+                threads = min(self.threads_per_replica, len(cores)) if self.threads_per_replica > 0 else len(cores)
+                replica = _Replica(index, cores, threads, context, self._responses)
+                replica.process.start()
+                self.replicas.append(replica)
+                logger.info(f"Started Phi-3 replica {index} on cores {cores} ({threads} threads)")
+
+            started_at = time.perf_counter()
+            ready = set()
+            while len(ready) < len(self.replicas):
+                try:
+                    request_id, kind, payload = self._responses.get(timeout=_HEALTH_CHECK_INTERVAL)
+                except queue.Empty:
+                    # A replica killed while loading (e.g. by the OOM killer) never reports
+                    dead = [r for r in self.replicas if r.index not in ready and not r.process.is_alive()]
+                    if dead:
+                        self.close()
+                        raise RuntimeError(
+                            f"Phi-3 replica {dead[0].index} exited while loading "
+                            f"(code {dead[0].process.exitcode})"
+                        )
+                    continue
+
+                if kind == "ready":
+                    ready.add(payload)
+                elif kind == "error":
+                    self.close()
+                    raise RuntimeError(f"Phi-3 replica failed to start: {payload}")
+
+            self._round_robin = itertools.cycle(self.replicas)
+            self._reader = threading.Thread(target=self._read_responses, name="replica-responses", daemon=True)
+            self._reader.start()
+            self._initialized = True
+            logger.info(f"{len(self.replicas)} Phi-3 replica(s) ready in {time.perf_counter() - started_at:.1f}s")
+
+    def is_initialized(self) -> bool:
+        return self._initialized
+
+    def _read_responses(self):
+        """Route replica messages to the waiting coroutines; detect dead replicas"""
+        last_check = time.monotonic()
+        while not self._closed:
+            # Check on a fixed interval, even while other replicas keep streaming
+            if time.monotonic() - last_check >= _HEALTH_CHECK_INTERVAL:
+                self._check_replicas()
+                last_check = time.monotonic()
+
+            try:
+                request_id, kind, payload = self._responses.get(timeout=_HEALTH_CHECK_INTERVAL)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+
+            with self._lock:
+                if kind in _TERMINAL:
+                    self._complete(request_id, kind)
+                route = self._routes.get(request_id)
+            if route is not None:
+                loop, messages = route
+                loop.call_soon_threadsafe(messages.put_nowait, (kind, payload))
+
+    def _complete(self, request_id: str, kind: str):
+        """Record a request its replica has finished with (lock held)"""
+        replica = self._owners.pop(request_id, None)
+        if replica is None:
+            return
+
+        submitted_at = replica.pending.pop(request_id, None)
+        if kind in ("result", "done"):
+            replica.completed += 1
+        else:
+            replica.failed += 1
+        if submitted_at is not None:
+            replica.total_time += time.perf_counter() - submitted_at
+
+    def _check_replicas(self):
+        """Fail requests pending on replicas whose process has exited"""
+        for replica in self.replicas:
+            if replica.alive and not replica.process.is_alive():
+                replica.alive = False
+                logger.error(f"Phi-3 replica {replica.index} exited (code {replica.process.exitcode})")
+                with self._lock:
+                    request_ids = list(replica.pending)
+                    routes = [self._routes.get(request_id) for request_id in request_ids]
+                    for request_id in request_ids:
+                        self._complete(request_id, "error")
+                for route in routes:
+                    if route is not None:
+                        loop, messages = route
+                        loop.call_soon_threadsafe(messages.put_nowait, ("error", f"replica {replica.index} exited"))
+
+    def _pick_replica(self) -> _Replica:
+        """Choose a live replica with room according to the dispatch policy (lock held)"""
+        live = [r for r in self.replicas if r.alive]
+        if not live:
+            raise ReplicaUnavailable("No Phi-3 replicas are running")
+
+        available = [r for r in live if len(r.pending) < self.max_pending]
+        if not available:
+            raise InferenceQueueFull(
+                f"All {len(live)} Phi-3 replica(s) have {self.max_pending} requests pending"
+            )
+
+        if self.policy == ROUND_ROBIN:
+            for _ in range(len(self.replicas)):
+                replica = next(self._round_robin)
+                if replica in available:
+                    return replica
+        return min(available, key=lambda r: len(r.pending))
+
+    def _submit(self, kind: str, kwargs: dict) -> Tuple[_Replica, str, asyncio.Queue]:
+        """Send a request to a replica and register its response route"""
+        request_id = uuid.uuid4().hex
+        messages: asyncio.Queue = asyncio.Queue()
+
+        with self._lock:
+            replica = self._pick_replica()
+            self._routes[request_id] = (asyncio.get_running_loop(), messages)
+            self._owners[request_id] = replica
+            replica.pending[request_id] = time.perf_counter()
+
+        replica.requests.put((request_id, kind, kwargs))
+        return replica, request_id, messages
+
+    def _finish(self, replica: _Replica, request_id: str, cancel: bool):
+        """
+        Drop a request's route; ask the replica to stop it if the caller left early.
+
+        The request stays pending (and counts towards max_pending) until
+        the replica reports it finished or cancelled.
+        """
+        with self._lock:
+            self._routes.pop(request_id, None)
+            running = request_id in replica.pending
+
+        if cancel and running and replica.alive:
+            replica.cancels.put(request_id)
+
+    async def agenerate(
+        self,
+        prompt: str,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        system_prompt: Optional[str] = None,
+        context: Optional[List[str]] = None
+    ) -> Tuple[str, dict]:
+        """Generate on the next replica; same contract as Phi3Client.agenerate()"""
+        if not self._initialized:
+            await asyncio.to_thread(self.initialize)
+
+        replica, request_id, messages = self._submit("generate", {
+            "prompt": prompt,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "system_prompt": system_prompt,
+            "context": context
+        })
+
+        finished = False
+        try:
+            kind, payload = await messages.get()
+            finished = True
+            if kind != "result":
+                raise RuntimeError(payload or f"Phi-3 replica request {kind}")
+            return tuple(payload)
+        finally:
+            # Ask the replica to drop the request if the caller was cancelled
+            self._finish(replica, request_id, cancel=not finished)
+
+    async def agenerate_stream(
+        self,
+        prompt: str,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        system_prompt: Optional[str] = None,
+        context: Optional[List[str]] = None,
+        token_usage: Optional[dict] = None
+    ) -> AsyncGenerator[str, None]:
+        """Stream from the next replica; same contract as Phi3Client.agenerate_stream()"""
+        if not self._initialized:
+            await asyncio.to_thread(self.initialize)
+
+        replica, request_id, messages = self._submit("stream", {
+            "prompt": prompt,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "system_prompt": system_prompt,
+            "context": context
+        })
+
+        finished = False
+        try:
+            while True:
+                kind, payload = await messages.get()
+                if kind == "chunk":
+                    yield payload
+                    continue
+
+                finished = True
+                if kind == "done":
+                    if token_usage is not None:
+                        token_usage.update(payload)
+                    break
+                raise RuntimeError(payload or f"Phi-3 replica request {kind}")
+        finally:
+            # Ask the replica to stop at its next token if the consumer left early
+            self._finish(replica, request_id, cancel=not finished)
+
+    def get_model_info(self) -> dict:
+        """Pool configuration and per-replica load"""
+        with self._lock:
+            replicas = [
+                {
+                    "index": r.index,
+                    "cores": r.cores,
+                    "threads": r.threads,
+                    "alive": r.alive,
+                    "pending": len(r.pending),
+                    "completed": r.completed,
+                    "failed": r.failed,
+                    "avg_latency_ms": round(
+                        r.total_time / (r.completed + r.failed) * 1000, 1
+                    ) if r.completed + r.failed else 0.0
+                }
+                for r in self.replicas
+            ]
+
+        return {
+            "model_name": settings.model_name,
+            "device": "cpu",
+            "initialized": self._initialized,
+            "backend": settings.inference_backend,
+            "max_tokens": settings.max_tokens,
+            "replica_pool": {
+                "replicas": len(self.replicas),
+                "policy": self.policy,
+                "max_pending": self.max_pending,
+                "workers": replicas
+            }
+        }
+
+    def close(self):
+        """Stop all replica processes"""
+        self._closed = True
+        for replica in self.replicas:
+            if replica.process.is_alive():
+                replica.requests.put(None)
+
+        for replica in self.replicas:
+            replica.process.join(timeout=5)
+            if replica.process.is_alive():
+                replica.process.terminate()
+
+        self.replicas = []
+        self._initialized = False
+
+
+# Singleton instance
+_replica_pool: Optional[ReplicaPool] = None
+
+
+def get_replica_pool() -> ReplicaPool:
+    """
+    Get the replica pool singleton.
+    Replicas start on first use (or during warm-up).
+    """
+    global _replica_pool
+
+    if _replica_pool is None:
+        _replica_pool = ReplicaPool(
+            count=settings.replica_count,
+            threads_per_replica=settings.replica_threads,
+            policy=settings.replica_dispatch,
+            max_pending=settings.replica_max_pending
+        )
+
+    return _replica_pool
+
+
+def shutdown_replica_pool():
+    """Stop the replica processes if they were started"""
+    global _replica_pool
+
+    if _replica_pool is not None:
+        _replica_pool.close()
+        _replica_pool = None
@@ -0,0 +1,194 @@
+"""
+Semantic Answer Cache
+Reuses previous answers for questions that embed close to an earlier one
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional
+import itertools
+import logging
+import threading
+import time
+
+import numpy as np
+
+from app.config import settings
+from app.ml.embeddings import get_embedding_service
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedAnswer:
+    """A cached chat answer"""
+    query: str
+    response: str
+    token_usage: Optional[dict]
+    model: Optional[str]
+    created_at: float
+
+
+class SemanticCache:
+    """
+    Capacity-bounded LRU cache of chat answers keyed by query embedding.
+
+    A lookup hits when the cosine distance between the new question and a
+    cached one is within `max_distance`. Entries expire after `ttl_seconds`
+    and the whole cache is dropped when the RAG index version changes,
+    since answers were generated from the old context.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        ttl_seconds: int = 3600,
+        max_distance: float = 0.08
+    ):
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+        self._entries: "OrderedDict[int, CachedAnswer]" = OrderedDict()
+        self._embeddings: Dict[int, np.ndarray] = {}
+        self._ids = itertools.count()
+        self._index_version: Optional[str] = None
+        self._lock = threading.Lock()
+
+        # Metrics
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    def embed(self, query: str) -> np.ndarray:
+        """Embed and L2-normalize a query"""
+        embedding = get_embedding_service().embed_query(query).astype(np.float32)
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm else embedding
+
+    def get(self, embedding: np.ndarray, index_version: Optional[str] = None) -> Optional[CachedAnswer]:
+        """
+        Find the closest cached answer within the distance threshold.
+
+        Args:
+            embedding: Normalized query embedding from embed()
+            index_version: Current RAG index version, used for invalidation
+
+        Returns:
+            Cached answer or None on a miss
+        """
+        with self._lock:
+            self._check_index_version(index_version)
+            self._expire()
+
+            if not self._entries:
+                self._misses += 1
+                return None
+
+            keys = list(self._embeddings.keys())
+            matrix = np.stack([self._embeddings[k] for k in keys])
+            similarities = matrix @ embedding
+            best = int(np.argmax(similarities))
+
+            if 1.0 - float(similarities[best]) > self.max_distance:
+                self._misses += 1
+                return None
+
+            key = keys[best]
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return self._entries[key]
+
+    def put(
+        self,
+        embedding: np.ndarray,
+        query: str,
+        response: str,
+        token_usage: Optional[dict] = None,
+        model: Optional[str] = None,
+        index_version: Optional[str] = None
+    ):
+        """Store an answer, evicting the least recently used entry if full"""
+        with self._lock:
+            self._check_index_version(index_version)
+
+            key = next(self._ids)
+            self._entries[key] = CachedAnswer(
+                query=query,
+                response=response,
+                token_usage=token_usage,
+                model=model,
+                created_at=time.time()
+            )
+            self._embeddings[key] = embedding
+
+            while len(self._entries) > self.max_entries:
+                old_key, _ = self._entries.popitem(last=False)
+                del self._embeddings[old_key]
+                self._evictions += 1
+
+    def clear(self):
+        """Drop all cached answers"""
+        with self._lock:
+            self._entries.clear()
+            self._embeddings.clear()
+
+    def _check_index_version(self, index_version: Optional[str]):
+        """Invalidate everything if the RAG index changed (lock held)"""
+        if index_version is None or index_version == self._index_version:
+            return
+
+        if self._index_version is not None and self._entries:
+            logger.info("RAG index changed - invalidating semantic cache")
+            self._invalidations += 1
+            self._entries.clear()
+            self._embeddings.clear()
+        self._index_version = index_version
+
+    def _expire(self):
+        """Remove entries older than the TTL (lock held)"""
+        if self.ttl_seconds <= 0:
+            return
+
+        cutoff = time.time() - self.ttl_seconds
+        for key in [k for k, v in self._entries.items() if v.created_at < cutoff]:
+            del self._entries[key]
+            del self._embeddings[key]
+            self._expirations += 1
+
+    def get_stats(self) -> Dict:
+        """Get cache size and hit/miss counters"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "enabled": True,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "max_distance": self.max_distance,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "invalidations": self._invalidations
+            }
+
+
+# Singleton instance
+_semantic_cache: Optional[SemanticCache] = None
+
+
+def get_semantic_cache() -> SemanticCache:
+    """Get the semantic answer cache singleton"""
+    global _semantic_cache
+
+    if _semantic_cache is None:
+        _semantic_cache = SemanticCache(
+            max_entries=settings.semantic_cache_max_entries,
+            ttl_seconds=settings.semantic_cache_ttl_seconds,
+            max_distance=settings.semantic_cache_max_distance
+        )
+
+    return _semantic_cache
@@ -0,0 +1,148 @@
+"""
+Speculative Decoding
+Draft-model assisted generation for Phi-3 with acceptance metrics
+"""
+
+import logging
+import threading
+from typing import Dict, Optional
+
+import torch
+
+from app.config import settings
+from app.ml.model_loading import load_causal_lm
+
+logger = logging.getLogger(__name__)
+
+
+class SpeculativeDecoder:
+    """
+    Wraps a small draft model for transformers' assisted generation.
+
+    Each round the draft proposes up to `lookahead` tokens and Phi-3
+    scores them all in a single forward pass, keeping the longest
+    accepted run plus one token of its own. Output follows Phi-3's
+    distribution; only the number of expensive forward passes changes.
+
+    Assisted generation in transformers works on one sequence at a time,
+    so batched calls keep using plain decoding.
+    """
+
+    def __init__(self, draft_model_name: str, lookahead: int = 5):
+        self.draft_model_name = draft_model_name
+        self.lookahead = max(1, lookahead)
+        self.model = None
+        self._lock = threading.Lock()
+
+        # Metrics
+        self._calls = 0
+        self._rounds = 0
+        self._proposed = 0
+        self._accepted = 0
+        self._output_tokens = 0
+        self._total_time = 0.0
+
+    def load(self, tokenizer, device: str):
+        """
+        Load the draft model and check it shares Phi-3's token ids.
+
+        Raises:
+            ValueError: If the draft vocabulary does not line up
+        """
+        from transformers import AutoTokenizer
+
+        draft_tokenizer = AutoTokenizer.from_pretrained(self.draft_model_name, trust_remote_code=True)
+        target_vocab = tokenizer.get_vocab()
+        mismatched = [
+            token for token, idx in draft_tokenizer.get_vocab().items()
+            if target_vocab.get(token) != idx
+        ]
+        if mismatched:
+            raise ValueError(
+                f"Draft model {self.draft_model_name} uses different token ids "
+                f"({len(mismatched)} mismatched, e.g. {mismatched[0]!r})"
+            )
+
+        self.model = load_causal_lm(
+            self.draft_model_name,
+            torch.float16 if device == "cuda" else torch.float32,
+            mmap_weights=settings.mmap_weights and device == "cpu",
+            device_map="auto" if device == "cuda" else None
+        )
+
+        # Fixed lookahead; the heuristic schedule would drift it per request
+        self.model.generation_config.num_assistant_tokens = self.lookahead
+        self.model.generation_config.num_assistant_tokens_schedule = "constant"
+
+        # Count proposals: each draft generate() call is one speculation round
+        draft_generate = self.model.generate
+
+        def counted_generate(*args, **kwargs):
+            outputs = draft_generate(*args, **kwargs)
+            input_ids = kwargs.get("input_ids", args[0] if args else None)
+            sequences = outputs.sequences if hasattr(outputs, "sequences") else outputs
+            with self._lock:
+                self._rounds += 1
+                if input_ids is not None:
+                    self._proposed += sequences.shape[1] - input_ids.shape[1]
+            return outputs
+
+        self.model.generate = counted_generate
+        logger.info(f"Speculative decoding enabled with draft {self.draft_model_name} (lookahead {self.lookahead})")
+
+    def generate_kwargs(self, input_ids: torch.Tensor) -> dict:
+        """generate() kwargs enabling assisted decoding for a single sequence"""
+        if self.model is None or input_ids.shape[0] != 1:
+            return {}
+        return {"assistant_model": self.model}
+
+    def record(self, rounds_before: int, output_tokens: int, seconds: float):
+        """
+        Record one finished generation.
+
+        Every verification round emits the accepted draft tokens plus one
+        token from Phi-3, so accepted = output tokens - rounds. With more
+        than one inference worker, concurrent rounds make this approximate.
+        """
+        with self._lock:
+            rounds = self._rounds - rounds_before
+            self._calls += 1
+            self._accepted += max(0, output_tokens - rounds)
+            self._output_tokens += output_tokens
+            self._total_time += seconds
+
+    @property
+    def rounds(self) -> int:
+        return self._rounds
+
+    def get_stats(self) -> Dict:
+        """Get acceptance rate and throughput of assisted generations"""
+        with self._lock:
+            return {
+                "enabled": self.model is not None,
+                "draft_model": self.draft_model_name,
+                "lookahead": self.lookahead,
+                "generations": self._calls,
+                "rounds": self._rounds,
+                "proposed_tokens": self._proposed,
+                "accepted_tokens": self._accepted,
+                "acceptance_rate": round(self._accepted / self._proposed, 3) if self._proposed else 0.0,
+                "tokens_per_round": round(self._output_tokens / self._rounds, 2) if self._rounds else 0.0,
+                "tokens_per_second": round(
+                    self._output_tokens / self._total_time, 2
+                ) if self._total_time else 0.0
+            }
+
+
+def create_speculative_decoder(tokenizer, device: str) -> Optional[SpeculativeDecoder]:
+    """Load the configured draft model, or return None when disabled or unusable"""
+    if not settings.draft_model_name:
+        return None
+
+    decoder = SpeculativeDecoder(settings.draft_model_name, settings.speculative_lookahead)
+    try:
+        decoder.load(tokenizer, device)
+    except Exception as e:
+        logger.warning(f"Speculative decoding disabled: {e}")
+        return None
+    return decoder
@@ -7,19 +7,36 @@ from fastapi import APIRouter, HTTPException, status, Depends
 from fastapi.responses import StreamingResponse
 from datetime import datetime
 from bson import ObjectId
-from typing import Optional
+from contextlib import aclosing
+from typing import Dict, List, Optional, Tuple
+from starlette.background import BackgroundTask
+import asyncio
 import logging
 import json
 
 from app.models.chat import ChatMessage, ChatResponse, TokenUsage
 from app.models.user import TokenData
 from app.services.auth_service import get_current_user
+from app.services.history_writer import get_history_writer
+from app.services.circuit_breaker import get_circuit_breaker, get_circuit_states
+from app.services.admission import AdmissionRejected, AdmissionTicket, get_admission_controller
 from app.database import get_chat_history_collection, get_user_stats_collection
-from app.config import settings
+from app.config import settings, DEFAULT_SYSTEM_PROMPT
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+
+PHI3_MODEL_LABEL = "phi-3-mini-4k-instruct"
+GEMINI_MODEL_LABEL = "gemini-1.5-flash"
+
+# Chunks to retrieve; Phi-3's prompt builder drops whatever does not fit
+RAG_TOP_K = 5
+
+# Circuit breaker names
+PHI3_BACKEND = "phi3"
+GEMINI_BACKEND = "gemini"
+
 # Track ML availability
 _ml_available = None
 _gemini_available = None
@@ -42,17 +59,37 @@ def check_ml_available():
             _ml_available = False
             logger.warning("PyTorch not installed - Phi-3 and RAG disabled, using Gemini only")
     return _ml_available
-    return _ml_available
+
+
+def check_phi3_available():
+    """Phi-3 runs on the inference server (no local torch needed) or in-process"""
+    return bool(settings.inference_server_url) or check_ml_available()
 
 
 def get_phi3():
-    """Lazy load Phi-3 client"""
+    """
+    Lazy load Phi-3 client.
+    
+    - INFERENCE_SERVER_URL set: pooled client for the shared inference server
+    - REPLICA_COUNT > 1: the in-process replica pool
+    """
+    if settings.inference_server_url:
+        from app.ml.inference_client import get_inference_client
+        return get_inference_client()
     if not check_ml_available():
         raise ImportError("PyTorch required for Phi-3")
+    if settings.replica_count > 1:
+        from app.ml.replica_pool import get_replica_pool
+        return get_replica_pool()
     from app.ml.phi3_client import get_phi3_client
     return get_phi3_client()
 
 
+def batching_active() -> bool:
+    """Batching runs on the in-process client only (the inference server batches on its side)"""
+    return settings.batching_enabled and settings.replica_count <= 1 and not settings.inference_server_url
+
+
 def get_rag():
     """Lazy load RAG service"""
     if not check_ml_available():
@@ -61,12 +98,252 @@ def get_rag():
     return get_rag_service()
 
 
+def get_cache():
+    """Lazy load the semantic answer cache (requires the embedding model)"""
+    if not settings.semantic_cache_enabled or not check_ml_available():
+        return None
+    from app.ml.semantic_cache import get_semantic_cache
+    return get_semantic_cache()
+
+
+def get_index_version() -> Optional[str]:
+    """Current RAG index version, used to invalidate cached answers"""
+    rag = get_rag()
+    if rag is None:
+        return None
+    try:
+        return rag.get_index_version()
+    except Exception as e:
+        logger.warning(f"Could not read RAG index version: {e}")
+        return None
+
+
+async def generate_local(prompt: str, context: List[str]):
+    """Generate with Phi-3, through the batch scheduler when batching is enabled"""
+    if batching_active():
+        from app.ml.batch_scheduler import get_batch_scheduler
+        return await get_batch_scheduler().submit(
+            prompt=prompt,
+            system_prompt=DEFAULT_SYSTEM_PROMPT,
+            max_tokens=settings.max_tokens,
+            temperature=settings.temperature,
+            context=context
+        )
+    
+    phi3 = get_phi3()
+    return await phi3.agenerate(
+        prompt=prompt,
+        system_prompt=DEFAULT_SYSTEM_PROMPT,
+        max_tokens=settings.max_tokens,
+        temperature=settings.temperature,
+        context=context
+    )
+
+
 def get_gemini():
     """Lazy load Gemini fallback client"""
     from app.ml.gemini_fallback import get_gemini_client
     return get_gemini_client()
 
 
+def retrieve_context(query: str) -> List[Dict]:
+    """Retrieve ranked study-material chunks (empty if RAG is unavailable)"""
+    rag = get_rag()
+    if rag is None:
+        return []
+    
+    try:
+        rag.initialize()
+        results = rag.search(query, n_results=RAG_TOP_K)
+        if results:
+            logger.info(f"Retrieved {len(results)} chunks from RAG")
+        return results
+    except Exception as e:
+        logger.warning(f"RAG retrieval failed: {e}")
+        return []
+
+
+def context_chunks(results: List[Dict]) -> List[str]:
+    """Format retrieved chunks for Phi-3's token-budgeted prompt builder"""
+    if not results:
+        return []
+    return [get_rag().format_result(result) for result in results]
+
+
+def build_system_prompt(results: List[Dict]) -> str:
+    """Build the system prompt with character-limited context (used for Gemini)"""
+    system_prompt = DEFAULT_SYSTEM_PROMPT
+    
+    context = get_rag().format_context(results) if results else ""
+    if context:
+        system_prompt += f"\n\nUse the following context from study materials to help answer the question:\n\n{context}"
+    
+    return system_prompt
+
+
+def is_overloaded(error: Exception) -> bool:
+    """True if Phi-3 rejected the request for load rather than failing"""
+    from app.ml.inference_executor import InferenceQueueFull
+    return isinstance(error, InferenceQueueFull)
+
+
+async def generate_with_gemini(prompt: str, system_prompt: str):
+    """Generate with the Gemini fallback, raising if it is not configured or tripped"""
+    breaker = get_circuit_breaker(GEMINI_BACKEND)
+    if not breaker.allow_request():
+        raise RuntimeError("Gemini circuit open - backend cooling down")
+    
+    try:
+        gemini = get_gemini()
+        if not gemini.is_available():
+            raise RuntimeError("No Gemini API keys configured")
+        
+        result = await gemini.agenerate(
+            prompt=prompt,
+            system_prompt=system_prompt,
+            max_tokens=settings.max_tokens,
+            temperature=settings.temperature
+        )
+        breaker.record_success()
+        return result
+    except Exception as e:
+        breaker.record_failure(e)
+        raise
+    finally:
+        breaker.release()
+
+
+async def stream_with_gemini(prompt: str, system_prompt: str, token_usage: dict):
+    """Stream from the Gemini fallback, raising if it is not configured or tripped"""
+    breaker = get_circuit_breaker(GEMINI_BACKEND)
+    if not breaker.allow_request():
+        raise RuntimeError("Gemini circuit open - backend cooling down")
+    
+    try:
+        gemini = get_gemini()
+        if not gemini.is_available():
+            raise RuntimeError("No Gemini API keys configured")
+        
+        async with aclosing(gemini.astream(
+            prompt=prompt,
+            system_prompt=system_prompt,
+            max_tokens=settings.max_tokens,
+            temperature=settings.temperature,
+            token_usage=token_usage
+        )) as stream:
+            async for chunk in stream:
+                yield chunk
+        breaker.record_success()
+    except Exception as e:
+        breaker.record_failure(e)
+        raise
+    finally:
+        # Frees a half-open probe slot if the client disconnected mid-stream
+        breaker.release()
+
+
+async def save_chat_history(
+    current_user: Optional[TokenData],
+    message: ChatMessage,
+    response_text: str,
+    token_usage: Optional[dict]
+):
+    """Save the exchange and bump user stats; never fails the request"""
+    if not (current_user and message.userId):
+        return
+    
+    try:
+        user_id = ObjectId(message.userId)
+        
+        # Save chat entry
+        chat_doc = {
+            "userId": user_id,
+            "userMessage": message.message,
+            "assistantResponse": response_text,
+            "createdAt": datetime.utcnow(),
+            "tokens": token_usage
+        }
+        
+        # Buffer the write when write-behind is enabled
+        writer = get_history_writer()
+        if writer is not None and writer.is_running():
+            writer.add(user_id, chat_doc)
+            return
+        
+        await get_chat_history_collection().insert_one(chat_doc)
+        
+        # Update user stats
+        await get_user_stats_collection().update_one(
+            {"userId": user_id},
+            {
+                "$inc": {"questionsAsked": 1},
+                "$set": {
+                    "lastActiveDate": datetime.utcnow(),
+                    "updatedAt": datetime.utcnow()
+                }
+            },
+            upsert=True
+        )
+        
+        logger.info(f"Chat saved for user {message.userId}")
+        
+    except Exception as e:
+        logger.error(f"Failed to save chat history: {e}")
+        # Don't fail the request if history save fails
+
+
+async def generate_answer(message: ChatMessage) -> Tuple[str, dict, str]:
+    """
+    Retrieve context and generate an answer, falling back from Phi-3 to Gemini.
+    
+    Returns:
+        Tuple of (response_text, token_usage, model_used)
+    """
+    results = await asyncio.to_thread(retrieve_context, message.message)
+    
+    # Try Phi-3 first (if torch is available)
+    response_text = None
+    token_usage = None
+    model_used = None
+    
+    phi3_breaker = get_circuit_breaker(PHI3_BACKEND)
+    if check_phi3_available() and phi3_breaker.allow_request():
+        try:
+            response_text, token_usage = await generate_local(
+                prompt=message.message,
+                context=context_chunks(results)
+            )
+            phi3_breaker.record_success()
+            model_used = PHI3_MODEL_LABEL
+            logger.info("Response generated using Phi-3")
+            
+        except Exception as e:
+            if not is_overloaded(e):
+                phi3_breaker.record_failure(e)
+            logger.warning(f"Phi-3 generation failed: {e}, trying Gemini fallback")
+        finally:
+            phi3_breaker.release()
+    
+    # Use Gemini if Phi-3 not available or failed
+    if response_text is None:
+        try:
+            response_text, token_usage = await generate_with_gemini(
+                message.message,
+                build_system_prompt(results)
+            )
+            model_used = GEMINI_MODEL_LABEL
+            logger.info("Response generated using Gemini")
+                
+        except Exception as gemini_error:
+            logger.error(f"Gemini generation failed: {gemini_error}")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="AI service temporarily unavailable. Please configure Gemini API keys in .env"
+            )
+    
+    return response_text, token_usage, model_used
+
+
 @router.post("", response_model=ChatResponse)
 async def chat(
     message: ChatMessage,
@@ -82,102 +359,47 @@ async def chat(
     logger.info(f"Chat request from user: {current_user.id if current_user else 'anonymous'}")
     
     try:
-        # Get context from RAG if available (requires torch)
-        context = ""
-        rag = get_rag()
-        if rag is not None:
+        # Serve near-identical questions from the semantic cache
+        cache = get_cache()
+        query_embedding = None
+        index_version = None
+        if cache is not None:
             try:
-                if rag.is_initialized() or True:  # Try to initialize
-                    rag.initialize()
-                    context = rag.get_context_for_query(message.message, n_results=3)
-                    if context:
-                        logger.info(f"Retrieved {len(context)} chars of context from RAG")
+                # Chroma reads and the embedding forward pass are blocking
+                index_version = await asyncio.to_thread(get_index_version)
+                query_embedding = await asyncio.to_thread(cache.embed, message.message)
+                cached = cache.get(query_embedding, index_version)
+                if cached is not None:
+                    logger.info("Response served from semantic cache")
+                    await save_chat_history(current_user, message, cached.response, cached.token_usage)
+                    return ChatResponse(
+                        response=cached.response,
+                        tokens=TokenUsage(**cached.token_usage) if cached.token_usage else None,
+                        model=cached.model
+                    )
             except Exception as e:
-                logger.warning(f"RAG retrieval failed: {e}")
+                logger.warning(f"Semantic cache lookup failed: {e}")
         
-        # Build system prompt with context
-        system_prompt = """You are an intelligent AI Study Buddy, an educational assistant designed to help students learn effectively. You provide clear, accurate, and helpful explanations on various academic topics. Be encouraging, patient, and thorough in your responses. Use examples when helpful and break down complex concepts into understandable parts."""
-        
-        if context:
-            system_prompt += f"\n\nUse the following context from study materials to help answer the question:\n\n{context}"
+        # Reserve a generation slot (429/503 when saturated)
+        ticket = await admit()
+        try:
+            response_text, token_usage, model_used = await generate_answer(message)
+        finally:
+            if ticket is not None:
+                ticket.release()
         
-        # Try Phi-3 first (if torch is available)
-        response_text = None
-        token_usage = None
-        model_used = None
-        
-        if check_ml_available():
-            try:
-                phi3 = get_phi3()
-                response_text, token_usage = phi3.generate(
-                    prompt=message.message,
-                    system_prompt=system_prompt,
-                    max_tokens=settings.max_tokens,
-                    temperature=settings.temperature
-                )
-                model_used = "phi-3-mini-4k-instruct"
-                logger.info("Response generated using Phi-3")
-                
-            except Exception as e:
-                logger.warning(f"Phi-3 generation failed: {e}, trying Gemini fallback")
-        
-        # Use Gemini if Phi-3 not available or failed
-        if response_text is None:
-            try:
-                gemini = get_gemini()
-                if gemini.is_available():
-                    response_text, token_usage = gemini.generate(
-                        prompt=message.message,
-                        system_prompt=system_prompt,
-                        max_tokens=settings.max_tokens,
-                        temperature=settings.temperature
-                    )
-                    model_used = "gemini-1.5-flash"
-                    logger.info("Response generated using Gemini")
-                else:
-                    raise RuntimeError("No Gemini API keys configured")
-                    
-            except Exception as gemini_error:
-                logger.error(f"Gemini generation failed: {gemini_error}")
-                raise HTTPException(
-                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                    detail="AI service temporarily unavailable. Please configure Gemini API keys in .env"
-                )
+        if cache is not None and query_embedding is not None:
+            cache.put(
+                query_embedding,
+                message.message,
+                response_text,
+                token_usage=token_usage,
+                model=model_used,
+                index_version=index_version
+            )
         
         # Save to chat history if user is authenticated
-        if current_user and message.userId:
-            try:
-                chat_history = get_chat_history_collection()
-                user_stats = get_user_stats_collection()
-                
-                # Save chat entry
-                chat_doc = {
-                    "userId": ObjectId(message.userId),
-                    "userMessage": message.message,
-                    "assistantResponse": response_text,
-                    "createdAt": datetime.utcnow(),
-                    "tokens": token_usage
-                }
-                await chat_history.insert_one(chat_doc)
-                
-                # Update user stats
-                await user_stats.update_one(
-                    {"userId": ObjectId(message.userId)},
-                    {
-                        "$inc": {"questionsAsked": 1},
-                        "$set": {
-                            "lastActiveDate": datetime.utcnow(),
-                            "updatedAt": datetime.utcnow()
-                        }
-                    },
-                    upsert=True
-                )
-                
-                logger.info(f"Chat saved for user {message.userId}")
-                
-            except Exception as e:
-                logger.error(f"Failed to save chat history: {e}")
-                # Don't fail the request if history save fails
+        await save_chat_history(current_user, message, response_text, token_usage)
         
         return ChatResponse(
             response=response_text,
@@ -195,6 +417,28 @@ async def chat(
         )
 
 
+async def admit() -> Optional[AdmissionTicket]:
+    """Reserve a generation slot, translating rejection into 429/503 with Retry-After"""
+    controller = get_admission_controller()
+    if controller is None:
+        return None
+    
+    try:
+        return await controller.acquire()
+    except AdmissionRejected as e:
+        logger.warning(f"Chat request rejected by admission control: {e.detail}")
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.detail,
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+
+def sse_event(payload: dict) -> str:
+    """Format a payload as a server-sent event"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+
 @router.post("/stream")
 async def chat_stream(
     message: ChatMessage,
@@ -203,35 +447,95 @@ async def chat_stream(
     """
     Stream a response from the AI Study Buddy.
     
-    - Returns server-sent events with response chunks
-    - Useful for real-time typing effect in UI
+    - Returns server-sent events as tokens are generated
+    - Uses the same RAG context, Gemini fallback and history saving as /api/chat
+    - Streams from Gemini when Phi-3 is unavailable (e.g. SKIP_LOCAL_MODEL=true)
     """
+    # Admission happens before the response starts so we can still send 429/503
+    ticket = await admit()
     
     async def generate():
         try:
-            phi3 = get_phi3()
+            results = await asyncio.to_thread(retrieve_context, message.message)
             
-            system_prompt = """You are an intelligent AI Study Buddy, an educational assistant designed to help students learn effectively."""
+            chunks = []
+            token_usage = {}
+            model_used = None
             
-            for chunk in phi3.generate_stream(
-                prompt=message.message,
-                system_prompt=system_prompt
-            ):
-                yield f"data: {json.dumps({'content': chunk, 'done': False})}\n\n"
+            phi3_breaker = get_circuit_breaker(PHI3_BACKEND)
+            if check_phi3_available() and phi3_breaker.allow_request():
+                try:
+                    phi3 = get_phi3()
+                    async with aclosing(phi3.agenerate_stream(
+                        prompt=message.message,
+                        system_prompt=DEFAULT_SYSTEM_PROMPT,
+                        max_tokens=settings.max_tokens,
+                        temperature=settings.temperature,
+                        context=context_chunks(results),
+                        token_usage=token_usage
+                    )) as stream:
+                        async for chunk in stream:
+                            chunks.append(chunk)
+                            yield sse_event({"content": chunk, "done": False})
+                    phi3_breaker.record_success()
+                    model_used = PHI3_MODEL_LABEL
+                    
+                except Exception as e:
+                    if not is_overloaded(e):
+                        phi3_breaker.record_failure(e)
+                    # Once text has been sent we cannot switch models mid-answer
+                    if chunks:
+                        raise
+                    logger.warning(f"Phi-3 streaming failed: {e}, trying Gemini fallback")
+                finally:
+                    # Frees a half-open probe slot if the client disconnected mid-stream
+                    phi3_breaker.release()
+            
+            if model_used is None:
+                async with aclosing(stream_with_gemini(
+                    message.message,
+                    build_system_prompt(results),
+                    token_usage
+                )) as stream:
+                    async for chunk in stream:
+                        chunks.append(chunk)
+                        yield sse_event({"content": chunk, "done": False})
+                model_used = GEMINI_MODEL_LABEL
             
-            yield f"data: {json.dumps({'content': '', 'done': True})}\n\n"
+            await save_chat_history(current_user, message, "".join(chunks), token_usage)
+            
+            yield sse_event({
+                "content": "",
+                "done": True,
+                "model": model_used,
+                "tokens": token_usage or None
+            })
             
         except Exception as e:
             logger.error(f"Streaming error: {e}")
-            yield f"data: {json.dumps({'error': str(e), 'done': True})}\n\n"
+            yield sse_event({"error": str(e), "done": True})
+        finally:
+            release_ticket()
+    
+    def release_ticket():
+        if ticket is not None:
+            ticket.release()
+    
+    async def release_after_response():
+        # async so Starlette runs it on the event loop: the admission
+        # controller's waiters are asyncio futures and not thread-safe
+        release_ticket()
     
+    # The background task covers streams that are never iterated
+    # (client gone before the first chunk); release() is idempotent
     return StreamingResponse(
         generate(),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive"
-        }
+        },
+        background=BackgroundTask(release_after_response)
     )
 
 
@@ -239,11 +543,32 @@ async def chat_stream(
 async def get_model_info():
     """
     Get information about the currently loaded AI model.
+    
+    - Includes circuit breaker state for the Phi-3 and Gemini backends
     """
+    # Make sure both breakers are listed even before their first call
+    get_circuit_breaker(PHI3_BACKEND)
+    get_circuit_breaker(GEMINI_BACKEND)
+    
     try:
         phi3 = get_phi3()
         info = phi3.get_model_info()
         
+        if settings.inference_server_url:
+            try:
+                info["server_info"] = await phi3.get_server_info()
+            except Exception as e:
+                info["server_info"] = {"status": "unreachable", "error": str(e)}
+        
+        if batching_active():
+            from app.ml.batch_scheduler import get_batch_scheduler
+            info["batching"] = get_batch_scheduler().get_stats()
+        else:
+            info["batching"] = {"enabled": False}
+        
+        cache = get_cache()
+        info["cache"] = cache.get_stats() if cache is not None else {"enabled": False}
+        
         # Add RAG info
         try:
             rag = get_rag()
@@ -252,11 +577,25 @@ async def get_model_info():
         except:
             info["rag"] = {"status": "not initialized"}
         
+        if check_ml_available():
+            from app.ml.embeddings import get_embedding_service
+            info["query_embeddings"] = get_embedding_service().get_cache_stats()
+        
+        info["backends"] = get_circuit_states()
+        
+        try:
+            info["gemini"] = get_gemini().get_stats()
+        except ImportError:
+            info["gemini"] = {"available": False}
+        
+        controller = get_admission_controller()
+        info["admission"] = controller.get_stats() if controller is not None else {"enabled": False}
         return info
         
     except Exception as e:
         return {
             "model_name": settings.model_name,
             "status": "not loaded",
-            "error": str(e)
+            "error": str(e),
+            "backends": get_circuit_states()
         }
@@ -8,6 +8,7 @@ from datetime import datetime
 import logging
 
 from app.database import get_database, create_indexes
+from app.services.history_writer import get_history_writer
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -150,10 +151,13 @@ async def database_health():
             count = await db[coll].count_documents({})
             stats[coll] = count
         
+        writer = get_history_writer()
+        
         return {
             "status": "healthy",
             "database": db.name,
-            "collections": stats
+            "collections": stats,
+            "historyWriter": writer.get_stats() if writer is not None else {"enabled": False}
         }
         
     except Exception as e:
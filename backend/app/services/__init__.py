@@ -14,6 +14,22 @@ from app.services.auth_service import (
     get_user_from_db,
     get_user_by_email
 )
+from app.services.history_writer import (
+    ChatHistoryWriter,
+    get_history_writer,
+    start_history_writer,
+    stop_history_writer
+)
+from app.services.admission import (
+    AdmissionController,
+    AdmissionRejected,
+    get_admission_controller
+)
+from app.services.circuit_breaker import (
+    CircuitBreaker,
+    get_circuit_breaker,
+    get_circuit_states
+)
 
 __all__ = [
     "verify_password",
@@ -24,5 +40,15 @@ __all__ = [
     "require_auth",
     "require_admin",
     "get_user_from_db",
-    "get_user_by_email"
+    "get_user_by_email",
+    "ChatHistoryWriter",
+    "get_history_writer",
+    "start_history_writer",
+    "stop_history_writer",
+    "AdmissionController",
+    "AdmissionRejected",
+    "get_admission_controller",
+    "CircuitBreaker",
+    "get_circuit_breaker",
+    "get_circuit_states"
 ]
@@ -0,0 +1,177 @@
+"""
+Admission Control
+Bounds in-flight chat generations and sheds load with Retry-After when saturated
+"""
+
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """A granted slot; release() is idempotent"""
+
+    def __init__(self, controller: "AdmissionController"):
+        self._controller = controller
+        self._admitted_at = time.perf_counter()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release(time.perf_counter() - self._admitted_at)
+
+
+class AdmissionController:
+    """
+    At most `max_in_flight` requests run at once and at most `max_queue`
+    wait for a slot, each for up to `max_queue_time` seconds.
+
+    - queue full: rejected immediately with 429
+    - waited too long: rejected with 503
+
+    Both carry a Retry-After estimated from recent service times.
+    Slots are handed directly to the next waiter in FIFO order.
+    """
+
+    def __init__(self, max_in_flight: int = 4, max_queue: int = 32, max_queue_time: float = 30.0):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max(0, max_queue)
+        self.max_queue_time = max_queue_time
+        self._in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+        # Metrics
+        self._admitted = 0
+        self._rejected_full = 0
+        self._rejected_timeout = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._avg_service_time = 1.0
+
+    async def acquire(self) -> AdmissionTicket:
+        """
+        Wait for a slot.
+
+        Raises:
+            AdmissionRejected: If the queue is full or the wait times out
+        """
+        if self._in_flight < self.max_in_flight and not self._waiters:
+            self._in_flight += 1
+            return self._admit(0.0)
+
+        if len(self._waiters) >= self.max_queue:
+            self._rejected_full += 1
+            raise AdmissionRejected(
+                429,
+                "Too many requests in queue. Please retry shortly.",
+                self._retry_after()
+            )
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        enqueued_at = time.perf_counter()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.max_queue_time)
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            self._rejected_timeout += 1
+            raise AdmissionRejected(
+                503,
+                "AI service is busy. Please retry shortly.",
+                self._retry_after()
+            )
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+
+        return self._admit(time.perf_counter() - enqueued_at)
+
+    def _admit(self, waited: float) -> AdmissionTicket:
+        self._admitted += 1
+        self._total_wait += waited
+        self._max_wait = max(self._max_wait, waited)
+        return AdmissionTicket(self)
+
+    def _abandon(self, waiter: asyncio.Future):
+        """Give up on a wait; pass the slot on if it was granted meanwhile"""
+        if waiter.done() and not waiter.cancelled():
+            self._release(None)
+            return
+        waiter.cancel()
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def _release(self, service_time: Optional[float]):
+        """Hand the slot to the next waiter, or free it"""
+        if service_time is not None:
+            # Exponential moving average for Retry-After estimates
+            self._avg_service_time = 0.8 * self._avg_service_time + 0.2 * service_time
+
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+        self._in_flight -= 1
+
+    def _retry_after(self) -> int:
+        """Seconds until a slot is likely to be free for a new request"""
+        rounds = (len(self._waiters) + 1) / self.max_in_flight
+        return max(1, math.ceil(rounds * self._avg_service_time))
+
+    def get_stats(self) -> Dict:
+        """Get in-flight count, queue depth and wait-time metrics"""
+        return {
+            "enabled": True,
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "max_queue_time_seconds": self.max_queue_time,
+            "in_flight": self._in_flight,
+            "queue_depth": len(self._waiters),
+            "admitted": self._admitted,
+            "rejected_queue_full": self._rejected_full,
+            "rejected_timeout": self._rejected_timeout,
+            "avg_wait_ms": round(self._total_wait / self._admitted * 1000, 2) if self._admitted else 0.0,
+            "max_wait_ms": round(self._max_wait * 1000, 2),
+            "avg_service_ms": round(self._avg_service_time * 1000, 2)
+        }
+
+
+# Singleton instance
+_admission_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> Optional[AdmissionController]:
+    """Get the chat admission controller, or None when it is disabled"""
+    global _admission_controller
+
+    if _admission_controller is None and settings.admission_enabled:
+        _admission_controller = AdmissionController(
+            max_in_flight=settings.admission_max_in_flight,
+            max_queue=settings.admission_max_queue,
+            max_queue_time=settings.admission_max_queue_time_seconds
+        )
+
+    return _admission_controller
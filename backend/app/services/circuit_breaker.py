@@ -0,0 +1,148 @@
+"""
+Circuit Breaker
+Skips a failing backend for a cool-down period instead of retrying it on every request
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Classic three-state circuit breaker.
+
+    - closed: requests flow; `failure_threshold` consecutive failures open it
+    - open: requests are rejected until `reset_timeout` seconds have passed
+    - half_open: up to `half_open_max_calls` probe requests are let through;
+      a success closes the circuit, a failure opens it again
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 3,
+        reset_timeout: float = 30.0,
+        half_open_max_calls: int = 1
+    ):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = max(1, half_open_max_calls)
+        self._state = CLOSED
+        self._consecutive_failures = 0
+        self._opened_at: Optional[float] = None
+        self._probes_in_flight = 0
+        self._lock = threading.Lock()
+
+        # Metrics
+        self._successes = 0
+        self._failures = 0
+        self._rejected = 0
+        self._last_error: Optional[str] = None
+
+    def allow_request(self) -> bool:
+        """
+        Check whether a request may be sent to the backend.
+
+        Every allowed request must be followed by record_success(),
+        record_failure() or release().
+        """
+        with self._lock:
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    self._rejected += 1
+                    return False
+                logger.info(f"Circuit '{self.name}' half-open - probing backend")
+                self._state = HALF_OPEN
+                self._probes_in_flight = 0
+
+            if self._state == HALF_OPEN:
+                if self._probes_in_flight >= self.half_open_max_calls:
+                    self._rejected += 1
+                    return False
+                self._probes_in_flight += 1
+
+            return True
+
+    def record_success(self):
+        """Record a successful call"""
+        with self._lock:
+            self._successes += 1
+            self._consecutive_failures = 0
+            if self._state == HALF_OPEN:
+                logger.info(f"Circuit '{self.name}' closed - backend recovered")
+                self._state = CLOSED
+                self._probes_in_flight = 0
+
+    def record_failure(self, error: Optional[BaseException] = None):
+        """Record a failed call, opening the circuit if needed"""
+        with self._lock:
+            self._failures += 1
+            self._consecutive_failures += 1
+            if error is not None:
+                self._last_error = str(error)
+
+            if self._state == HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    logger.warning(
+                        f"Circuit '{self.name}' opened after {self._consecutive_failures} "
+                        f"failure(s) - skipping for {self.reset_timeout}s"
+                    )
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._probes_in_flight = 0
+
+    def release(self):
+        """Finish an allowed call without a verdict (e.g. rejected for load)"""
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes_in_flight > 0:
+                self._probes_in_flight -= 1
+
+    def get_state(self) -> Dict:
+        """Get the breaker state and counters"""
+        with self._lock:
+            retry_in = None
+            if self._state == OPEN:
+                retry_in = round(max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at)), 1)
+
+            return {
+                "state": self._state,
+                "consecutive_failures": self._consecutive_failures,
+                "failure_threshold": self.failure_threshold,
+                "retry_in_seconds": retry_in,
+                "successes": self._successes,
+                "failures": self._failures,
+                "rejected": self._rejected,
+                "last_error": self._last_error
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """Get (or create) the circuit breaker for a named backend"""
+    if name not in _breakers:
+        _breakers[name] = CircuitBreaker(
+            name,
+            failure_threshold=settings.circuit_failure_threshold,
+            reset_timeout=settings.circuit_reset_timeout_seconds,
+            half_open_max_calls=settings.circuit_half_open_max_calls
+        )
+
+    return _breakers[name]
+
+
+def get_circuit_states() -> Dict[str, Dict]:
+    """Get the state of every registered circuit breaker"""
+    return {name: breaker.get_state() for name, breaker in _breakers.items()}
@@ -0,0 +1,244 @@
+"""
+Chat History Write-Behind Buffer
+Batches chatHistory inserts and userStats counter updates off the request path
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.config import settings
+from app.database import get_chat_history_collection, get_user_stats_collection
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+class ChatHistoryWriter:
+    """
+    Write-behind buffer for chat history.
+
+    Chat documents are appended to an in-memory buffer and per-user
+    `questionsAsked` increments are coalesced. A background task flushes
+    them with one `insert_many` and one `bulk_write` every
+    `flush_interval` seconds, or as soon as `batch_size` documents are
+    waiting. Failed flushes are re-queued up to `max_pending` documents.
+
+    Callers should only buffer while is_running(); before start() and
+    after stop() they write directly.
+    """
+
+    def __init__(self, flush_interval: float = 1.0, batch_size: int = 100, max_pending: int = 10000):
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, batch_size)
+        self.max_pending = max(self.batch_size, max_pending)
+        self._docs: List[dict] = []
+        self._stats: Dict[ObjectId, dict] = {}
+        self._flush_requested = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+        # Metrics
+        self._flushes = 0
+        self._failed_flushes = 0
+        self._docs_written = 0
+        self._stats_written = 0
+        self._dropped = 0
+        self._last_flush_ms = 0.0
+
+    def start(self):
+        """Start the background flush task"""
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._task = asyncio.create_task(self._flush_loop())
+            logger.info(
+                f"Chat history writer started (interval {self.flush_interval}s, "
+                f"batch size {self.batch_size})"
+            )
+
+    async def stop(self):
+        """Stop the flush task and write out everything still buffered"""
+        if self._task is not None:
+            # Let the loop finish its current flush instead of cancelling it mid-write
+            self._stopping = True
+            self._flush_requested.set()
+            await self._task
+            self._task = None
+
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Final chat history flush failed: {e}")
+        logger.info("Chat history writer stopped")
+
+    def is_running(self) -> bool:
+        """Whether the flush task is running (buffered writes will be flushed)"""
+        return self._task is not None and not self._task.done() and not self._stopping
+
+    def add(self, user_id: ObjectId, chat_doc: dict):
+        """
+        Buffer a chat document and its userStats update.
+
+        Args:
+            user_id: User the chat belongs to
+            chat_doc: Document for the chatHistory collection
+        """
+        now = chat_doc.get("createdAt") or datetime.utcnow()
+        self._docs.append(chat_doc)
+
+        pending = self._stats.setdefault(user_id, {"questionsAsked": 0, "lastActiveDate": now})
+        pending["questionsAsked"] += 1
+        pending["lastActiveDate"] = max(pending["lastActiveDate"], now)
+
+        if len(self._docs) >= self.batch_size:
+            self._flush_requested.set()
+
+    async def _flush_loop(self):
+        """Flush periodically, or early when the buffer fills up, until stopped"""
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Chat history flush failed: {e}")
+
+    async def flush(self):
+        """Write all buffered documents and coalesced counters to MongoDB"""
+        async with self._flush_lock:
+            if not self._docs and not self._stats:
+                return
+
+            docs, self._docs = self._docs, []
+            stats, self._stats = self._stats, {}
+            started_at = time.perf_counter()
+
+            try:
+                if docs:
+                    try:
+                        await get_chat_history_collection().insert_many(docs, ordered=False)
+                        self._docs_written += len(docs)
+                        docs = []
+                    except BulkWriteError as e:
+                        # Keep only documents that failed for reasons other than
+                        # already being written by an earlier partial flush
+                        failed = {
+                            err["index"] for err in e.details.get("writeErrors", [])
+                            if err.get("code") != DUPLICATE_KEY_ERROR
+                        }
+                        self._docs_written += len(docs) - len(failed)
+                        docs = [doc for i, doc in enumerate(docs) if i in failed]
+                        if docs:
+                            raise
+
+                if stats:
+                    now = datetime.utcnow()
+                    items = list(stats.items())
+                    try:
+                        await get_user_stats_collection().bulk_write([
+                            UpdateOne(
+                                {"userId": user_id},
+                                {
+                                    "$inc": {"questionsAsked": pending["questionsAsked"]},
+                                    "$set": {"updatedAt": now},
+                                    "$max": {"lastActiveDate": pending["lastActiveDate"]}
+                                },
+                                upsert=True
+                            )
+                            for user_id, pending in items
+                        ], ordered=False)
+                        self._stats_written += len(stats)
+                        stats = {}
+                    except BulkWriteError as e:
+                        # Unordered: every op not listed in writeErrors was applied,
+                        # so re-queueing it would count those questions twice
+                        failed = {err["index"] for err in e.details.get("writeErrors", [])}
+                        self._stats_written += len(items) - len(failed)
+                        stats = {user_id: pending for i, (user_id, pending) in enumerate(items) if i in failed}
+                        if stats:
+                            raise
+
+                self._flushes += 1
+            except BaseException:
+                # Includes cancellation mid-write: never lose the batch
+                self._failed_flushes += 1
+                self._requeue(docs, stats)
+                raise
+            finally:
+                self._last_flush_ms = round((time.perf_counter() - started_at) * 1000, 2)
+
+    def _requeue(self, docs: List[dict], stats: Dict[ObjectId, dict]):
+        """Put unwritten work back at the front of the buffer"""
+        for user_id, pending in stats.items():
+            current = self._stats.setdefault(user_id, {"questionsAsked": 0, "lastActiveDate": pending["lastActiveDate"]})
+            current["questionsAsked"] += pending["questionsAsked"]
+            current["lastActiveDate"] = max(current["lastActiveDate"], pending["lastActiveDate"])
+
+        # insert_many sets _id on each doc, so a retry cannot duplicate entries
+        self._docs = docs + self._docs
+        overflow = len(self._docs) - self.max_pending
+        if overflow > 0:
+            self._docs = self._docs[overflow:]
+            self._dropped += overflow
+            logger.error(f"Chat history buffer full - dropped {overflow} oldest entries")
+
+    def get_stats(self) -> Dict:
+        """Get buffer depth and flush metrics"""
+        return {
+            "enabled": True,
+            "buffered_docs": len(self._docs),
+            "buffered_users": len(self._stats),
+            "flushes": self._flushes,
+            "failed_flushes": self._failed_flushes,
+            "docs_written": self._docs_written,
+            "stats_written": self._stats_written,
+            "dropped": self._dropped,
+            "last_flush_ms": self._last_flush_ms
+        }
+
+
+# Singleton instance
+_history_writer: Optional[ChatHistoryWriter] = None
+
+
+def get_history_writer() -> Optional[ChatHistoryWriter]:
+    """Get the write-behind history writer, or None when it is disabled"""
+    global _history_writer
+
+    if _history_writer is None and settings.history_write_behind:
+        _history_writer = ChatHistoryWriter(
+            flush_interval=settings.history_flush_interval_ms / 1000,
+            batch_size=settings.history_flush_batch_size
+        )
+
+    return _history_writer
+
+
+async def start_history_writer():
+    """Start the writer's background flush task (called on startup)"""
+    writer = get_history_writer()
+    if writer is not None:
+        writer.start()
+
+
+async def stop_history_writer():
+    """
+    Flush and stop the writer (called on shutdown, before Mongo closes).
+
+    The stopped instance is kept so late requests see is_running() == False
+    and write directly instead of buffering into a writer nobody flushes.
+    """
+    if _history_writer is not None:
+        await _history_writer.stop()
@@ -0,0 +1,231 @@
+"""
+ML Warm-up
+Loads the ML singletons in the background at startup and tracks readiness
+"""
+
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, List, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+SKIPPED = "skipped"
+LAZY = "lazy"
+
+# How often the inference server is probed while it is still loading
+_SERVER_PROBE_INTERVAL = 1.0
+
+
+class ComponentState:
+    """Load state of one warm-up component"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.status = PENDING
+        self.duration_ms: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> Dict:
+        return {
+            "status": self.status,
+            "duration_ms": self.duration_ms,
+            "error": self.error
+        }
+
+
+def _warm_embeddings():
+    """Load the embedding model and run one encode to prime kernels"""
+    from app.ml.embeddings import get_embedding_service
+    service = get_embedding_service()
+    service.initialize()
+    service.embed_query("warm up")
+
+
+def _warm_rag():
+    """Open the Chroma collection and run one query if it has documents"""
+    from app.ml.rag_service import get_rag_service
+    rag = get_rag_service()
+    rag.initialize()
+    if rag.collection.count() > 0:
+        rag.search("warm up", n_results=1)
+
+
+async def _warm_inference_server():
+    """Wait until the inference server answers /health with its model loaded"""
+    from app.ml.inference_client import get_inference_client
+    client = get_inference_client()
+    deadline = time.monotonic() + settings.inference_server_timeout_seconds
+
+    while True:
+        try:
+            health = await client.check_health()
+            if health.get("initialized"):
+                return
+            error = "model not loaded"
+        except Exception as e:
+            error = str(e) or type(e).__name__
+
+        if time.monotonic() >= deadline:
+            raise RuntimeError(f"Inference server at {settings.inference_server_url} not ready: {error}")
+        await asyncio.sleep(_SERVER_PROBE_INTERVAL)
+
+
+def _warm_phi3():
+    """Load Phi-3, compile its prompt buckets if enabled and run a short dummy generation"""
+    if settings.replica_count > 1:
+        # Each replica runs its own dummy generation before reporting ready
+        from app.ml.replica_pool import get_replica_pool
+        get_replica_pool().initialize()
+        return
+    
+    from app.ml.phi3_client import get_phi3_client
+    client = get_phi3_client()
+    client.initialize()
+    if client.compiled is not None:
+        client.compiled.warmup(settings.max_tokens)
+    client.generate("Hello", max_tokens=8)
+
+
+class WarmupManager:
+    """
+    Runs component warm-ups one after another on worker threads and
+    records per-component status and load time for the /ready endpoint.
+
+    The service counts as ready once every component has finished,
+    whether it loaded or failed; failed components are reported so the
+    status can be shown as degraded while Gemini still serves requests.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.components: Dict[str, ComponentState] = {}
+        self._steps: List[tuple] = []
+        self._task: Optional[asyncio.Task] = None
+        self._started_at: Optional[float] = None
+        self._finished_at: Optional[float] = None
+
+    def start(self, ml_available: bool, phi3_available: Optional[bool] = None):
+        """
+        Schedule warm-up in the background.
+
+        Args:
+            ml_available: Whether the local ML stack is installed and enabled
+            phi3_available: Whether Phi-3 can serve requests (defaults to
+                ml_available; also true with an inference server and no torch)
+        """
+        self.enabled = settings.warmup_enabled
+        if phi3_available is None:
+            phi3_available = ml_available
+
+        # The inference server loads the model itself; only check that it is up
+        if settings.inference_server_url:
+            phi3_step = ("phi3", _warm_inference_server, False, phi3_available)
+        else:
+            phi3_step = ("phi3", _warm_phi3, True, phi3_available)
+
+        # (name, warm-up function, run on the inference executor, available)
+        steps: List[tuple] = [
+            ("embeddings", _warm_embeddings, False, ml_available),
+            ("rag", _warm_rag, False, ml_available),
+            phi3_step
+        ]
+        for name, _, _, available in steps:
+            state = ComponentState(name)
+            if not available:
+                state.status = SKIPPED
+            elif not self.enabled:
+                state.status = LAZY
+            self.components[name] = state
+
+        if not self.enabled:
+            return
+
+        self._steps = [step for step in steps if step[3]]
+        if not self._steps:
+            logger.info("Warm-up skipped - local ML stack disabled")
+            return
+
+        self._started_at = time.perf_counter()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        """Warm each component in order"""
+        logger.info("Starting ML warm-up in background...")
+
+        for name, fn, use_inference_executor, _ in self._steps:
+            await self._warm(name, fn, use_inference_executor)
+
+        self._finished_at = time.perf_counter()
+        logger.info(f"ML warm-up finished in {self._finished_at - self._started_at:.1f}s")
+
+    async def _warm(self, name: str, fn: Callable, use_inference_executor: bool):
+        """Run one warm-up step off the event loop and record the outcome"""
+        state = self.components[name]
+        state.status = LOADING
+        started_at = time.perf_counter()
+
+        try:
+            if asyncio.iscoroutinefunction(fn):
+                await fn()
+            elif use_inference_executor:
+                # Keeps the dummy generation from overlapping real requests
+                from app.ml.inference_executor import get_inference_executor
+                await get_inference_executor().run(fn)
+            else:
+                await asyncio.to_thread(fn)
+            state.status = READY
+        except Exception as e:
+            state.status = FAILED
+            state.error = str(e)
+            logger.error(f"Warm-up of {name} failed: {e}")
+        finally:
+            state.duration_ms = round((time.perf_counter() - started_at) * 1000, 1)
+
+        if state.status == READY:
+            logger.info(f"Warm-up of {name} done in {state.duration_ms:.0f}ms")
+
+    async def stop(self):
+        """Cancel warm-up if it is still running"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def is_ready(self) -> bool:
+        """True once no component is still pending or loading"""
+        return all(s.status not in (PENDING, LOADING) for s in self.components.values())
+
+    def get_state(self) -> Dict:
+        """Get overall readiness and per-component state"""
+        ready = self.is_ready()
+        degraded = any(s.status == FAILED for s in self.components.values())
+
+        return {
+            "ready": ready,
+            "status": "degraded" if ready and degraded else ("ready" if ready else "warming_up"),
+            "warmup_enabled": self.enabled,
+            "components": {name: s.to_dict() for name, s in self.components.items()}
+        }
+
+
+# Singleton instance
+_warmup_manager: Optional[WarmupManager] = None
+
+
+def get_warmup_manager() -> WarmupManager:
+    """Get the warm-up manager singleton"""
+    global _warmup_manager
+
+    if _warmup_manager is None:
+        _warmup_manager = WarmupManager()
+
+    return _warmup_manager
@@ -0,0 +1,129 @@
+"""
+Compiled Decoding Benchmark
+Compare eager and torch.compile (static KV cache) decode throughput on CPU
+"""
+
+import sys
+import os
+import argparse
+import json
+import logging
+import subprocess
+import time
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+PROMPTS = [
+    "What is a neural network?",
+    "Explain backpropagation in simple terms.",
+    "What is the difference between supervised and unsupervised learning?",
+    "How does gradient descent work?",
+    "What is overfitting and how can it be prevented?"
+]
+
+
+def measure(compiled: bool, max_tokens: int, rounds: int) -> dict:
+    """Load the model in one mode and time decoding (runs in a child process)"""
+    os.environ["COMPILE_ENABLED"] = "true" if compiled else "false"
+    os.environ["USE_GPU"] = "false"
+    os.environ["PREFIX_CACHE_ENABLED"] = "false"
+    
+    from app.ml.phi3_client import Phi3Client
+    
+    client = Phi3Client()
+    client.initialize()
+    
+    started_at = time.perf_counter()
+    if client.compiled is not None:
+        client.compiled.warmup(max_tokens)
+    client.generate(PROMPTS[0], max_tokens=8)
+    warmup_seconds = time.perf_counter() - started_at
+    
+    output_tokens = 0
+    started_at = time.perf_counter()
+    for _ in range(rounds):
+        for prompt in PROMPTS:
+            _, usage = client.generate(prompt, max_tokens=max_tokens, temperature=0.7)
+            output_tokens += usage["output"]
+    generate_seconds = time.perf_counter() - started_at
+    
+    return {
+        "mode": "compiled" if client.compiled is not None else "eager",
+        "warmup_seconds": round(warmup_seconds, 1),
+        "requests": rounds * len(PROMPTS),
+        "tokens_per_second": round(output_tokens / generate_seconds, 2),
+        "avg_latency_seconds": round(generate_seconds / (rounds * len(PROMPTS)), 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare eager and compiled Phi-3 decode throughput on CPU"
+    )
+    
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        default=64,
+        help="Tokens to generate per prompt"
+    )
+    
+    parser.add_argument(
+        "--rounds",
+        type=int,
+        default=2,
+        help="Times to run each benchmark prompt"
+    )
+    
+    parser.add_argument(
+        "--child",
+        type=str,
+        default=None,
+        help=argparse.SUPPRESS
+    )
+    
+    args = parser.parse_args()
+    
+    if args.child:
+        print(json.dumps(measure(args.child == "compiled", args.max_tokens, args.rounds)))
+        return
+    
+    # Separate processes so compiled graphs and threads do not leak between modes
+    results = []
+    for mode in ("eager", "compiled"):
+        logger.info(f"Benchmarking {mode} decoding...")
+        output = subprocess.run(
+            [
+                sys.executable, os.path.abspath(__file__),
+                "--child", mode,
+                "--max-tokens", str(args.max_tokens),
+                "--rounds", str(args.rounds)
+            ],
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+    
+    logger.info("=" * 72)
+    logger.info(f"{'mode':>9} {'warm-up (s)':>12} {'tokens/s':>10} {'latency (s)':>12}")
+    logger.info("=" * 72)
+    for r in results:
+        logger.info(
+            f"{r['mode']:>9} {r['warmup_seconds']:>12} {r['tokens_per_second']:>10} "
+            f"{r['avg_latency_seconds']:>12}"
+        )
+    
+    if results[1]["mode"] != "compiled":
+        logger.warning("Compiled mode was not available - see the child logs for the reason")
+
+
+if __name__ == "__main__":
+    main()
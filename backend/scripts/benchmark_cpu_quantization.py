@@ -0,0 +1,135 @@
+"""
+CPU Quantization Benchmark
+Compare load time, memory and tokens/sec of fp32, bf16 and int8 CPU inference
+"""
+
+import sys
+import os
+import argparse
+import json
+import logging
+import subprocess
+import time
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+PROMPTS = [
+    "Explain backpropagation in simple terms.",
+    "What is the difference between a list and a tuple in Python?",
+    "What is overfitting?"
+]
+
+
+def rss_mb() -> float:
+    """Current resident set size in MB (Linux)"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size in MB (Linux)"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def measure(mode: str, max_tokens: int) -> dict:
+    """Load the model in one mode and time generation (runs in a child process)"""
+    os.environ["CPU_QUANTIZATION"] = mode
+    os.environ["USE_GPU"] = "false"
+    os.environ["PREFIX_CACHE_ENABLED"] = "false"
+    
+    from app.ml.phi3_client import Phi3Client
+    
+    client = Phi3Client()
+    started_at = time.perf_counter()
+    client.initialize()
+    load_seconds = time.perf_counter() - started_at
+    
+    # Warm-up run is not timed
+    client.generate(PROMPTS[0], max_tokens=8)
+    
+    output_tokens = 0
+    started_at = time.perf_counter()
+    for prompt in PROMPTS:
+        _, usage = client.generate(prompt, max_tokens=max_tokens, temperature=0.7)
+        output_tokens += usage["output"]
+    generate_seconds = time.perf_counter() - started_at
+    
+    return {
+        "mode": mode,
+        "load_seconds": round(load_seconds, 1),
+        "rss_mb": round(rss_mb()),
+        "peak_rss_mb": round(peak_rss_mb()),
+        "tokens_per_second": round(output_tokens / generate_seconds, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare fp32, bf16 and int8 CPU inference for Phi-3"
+    )
+    
+    parser.add_argument(
+        "--modes",
+        type=str,
+        default="none,bf16,int8",
+        help="Comma-separated CPU_QUANTIZATION modes to compare"
+    )
+    
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        default=64,
+        help="Tokens to generate per prompt"
+    )
+    
+    parser.add_argument(
+        "--child",
+        type=str,
+        default=None,
+        help=argparse.SUPPRESS
+    )
+    
+    args = parser.parse_args()
+    
+    if args.child:
+        print(json.dumps(measure(args.child, args.max_tokens)))
+        return
+    
+    # Each mode runs in a fresh process so memory numbers are not mixed
+    results = []
+    for mode in args.modes.split(","):
+        logger.info(f"Benchmarking CPU_QUANTIZATION={mode}...")
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", mode, "--max-tokens", str(args.max_tokens)],
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+    
+    logger.info("=" * 72)
+    logger.info(f"{'mode':>6} {'load (s)':>10} {'RSS (MB)':>10} {'peak (MB)':>10} {'tokens/s':>10}")
+    logger.info("=" * 72)
+    for r in results:
+        logger.info(
+            f"{r['mode']:>6} {r['load_seconds']:>10} {r['rss_mb']:>10} "
+            f"{r['peak_rss_mb']:>10} {r['tokens_per_second']:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
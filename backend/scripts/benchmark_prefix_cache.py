@@ -0,0 +1,108 @@
+"""
+Prefix Cache Benchmark
+Compare time-to-first-token with and without the cached system-prompt KV
+"""
+
+import sys
+import os
+import argparse
+import logging
+import statistics
+import time
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.ml.phi3_client import Phi3Client, DEFAULT_SYSTEM_PROMPT
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+QUESTIONS = [
+    "What is a neural network?",
+    "Explain backpropagation in simple terms.",
+    "What is the difference between supervised and unsupervised learning?",
+    "How does gradient descent work?",
+    "What is overfitting and how can it be prevented?"
+]
+
+CONTEXT = (
+    "\n\nUse the following context from study materials to help answer the question:\n\n"
+    "[Source: lecturenotes_ml.pdf - Chapter 3]\n"
+    "A neural network is composed of layers of units. Each unit computes a weighted "
+    "sum of its inputs followed by a non-linear activation function. Training adjusts "
+    "the weights to minimise a loss function using gradient-based optimisation."
+)
+
+
+def time_to_first_token(client: Phi3Client, question: str) -> float:
+    """Seconds until the first generated token (prefill + one decode step)"""
+    start = time.perf_counter()
+    client.generate(question, max_tokens=1, system_prompt=DEFAULT_SYSTEM_PROMPT + CONTEXT)
+    return time.perf_counter() - start
+
+
+def run(client: Phi3Client, rounds: int) -> list:
+    """Time every question `rounds` times"""
+    timings = []
+    for _ in range(rounds):
+        for question in QUESTIONS:
+            timings.append(time_to_first_token(client, question))
+    return timings
+
+
+def report(label: str, timings: list):
+    logger.info(
+        f"{label:>10}: mean {statistics.mean(timings) * 1000:.1f}ms, "
+        f"median {statistics.median(timings) * 1000:.1f}ms, "
+        f"min {min(timings) * 1000:.1f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark time-to-first-token with and without the prefix KV cache"
+    )
+    
+    parser.add_argument(
+        "--rounds",
+        type=int,
+        default=3,
+        help="Times to run each benchmark question"
+    )
+    
+    args = parser.parse_args()
+    
+    client = Phi3Client()
+    client.initialize()
+    
+    if client._prefix_cache is None:
+        client.build_prefix_cache()
+    prefix_ids, prefix_cache = client._prefix_ids, client._prefix_cache
+    
+    if prefix_cache is None:
+        logger.error("Prefix cache could not be built for this model/template")
+        sys.exit(1)
+    
+    # Warm up kernels so the first measured run is not penalised
+    time_to_first_token(client, QUESTIONS[0])
+    
+    client._prefix_ids, client._prefix_cache = None, None
+    baseline = run(client, args.rounds)
+    
+    client._prefix_ids, client._prefix_cache = prefix_ids, prefix_cache
+    cached = run(client, args.rounds)
+    
+    logger.info("=" * 60)
+    logger.info(f"Time to first token ({len(baseline)} requests each, prefix {prefix_ids.shape[0]} tokens)")
+    logger.info("=" * 60)
+    report("no cache", baseline)
+    report("prefix", cached)
+    logger.info(f"Speedup (median): {statistics.median(baseline) / statistics.median(cached):.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Gemini Stub Server
+Local stand-in for the Gemini generateContent and streamGenerateContent
+endpoints, for exercising the async client without network access or API quota
+"""
+
+import sys
+import os
+import argparse
+import asyncio
+import json
+import logging
+import random
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+
+def stub_answer(model: str, body: dict) -> tuple:
+    """Echo the user's message back; returns (prompt, answer)"""
+    prompt = body["contents"][0]["parts"][0]["text"]
+    text = f"[{model} stub] {prompt.rsplit('User:', 1)[-1].split('Assistant:')[0].strip()}"
+    return prompt, text
+
+
+def create_app(latency: float, error_rate: float, error_status: int) -> FastAPI:
+    """Build a stub app answering with an echo of the prompt"""
+    app = FastAPI(title="Gemini Stub")
+    
+    def stub_error() -> JSONResponse:
+        return JSONResponse(
+            status_code=error_status,
+            content={"error": {"code": error_status, "message": "Stubbed failure", "status": "UNAVAILABLE"}}
+        )
+    
+    @app.post("/v1beta/models/{model}:streamGenerateContent")
+    async def stream_generate_content(model: str, request: Request):
+        body = await request.json()
+        await asyncio.sleep(latency)
+        
+        if random.random() < error_rate:
+            return stub_error()
+        
+        prompt, text = stub_answer(model, body)
+        words = text.split(" ")
+        
+        async def events():
+            for i, word in enumerate(words):
+                chunk = {"candidates": [{"content": {"role": "model", "parts": [{"text": word + " "}]}}]}
+                if i == len(words) - 1:
+                    chunk["candidates"][0]["finishReason"] = "STOP"
+                    chunk["usageMetadata"] = {
+                        "promptTokenCount": len(prompt.split()),
+                        "candidatesTokenCount": len(words)
+                    }
+                yield f"data: {json.dumps(chunk)}\r\n\r\n"
+                await asyncio.sleep(0.02)
+        
+        return StreamingResponse(events(), media_type="text/event-stream")
+    
+    @app.post("/v1beta/models/{model}:generateContent")
+    async def generate_content(model: str, request: Request):
+        body = await request.json()
+        await asyncio.sleep(latency)
+        
+        if random.random() < error_rate:
+            return stub_error()
+        
+        prompt, text = stub_answer(model, body)
+        
+        return {
+            "candidates": [{
+                "content": {"role": "model", "parts": [{"text": text}]},
+                "finishReason": "STOP"
+            }],
+            "usageMetadata": {
+                "promptTokenCount": len(prompt.split()),
+                "candidatesTokenCount": len(text.split()),
+                "totalTokenCount": len(prompt.split()) + len(text.split())
+            }
+        }
+    
+    return app
+
+
+def main():
+    import uvicorn
+    
+    parser = argparse.ArgumentParser(
+        description="Run a local stand-in for the Gemini generateContent API"
+    )
+    
+    parser.add_argument("--port", type=int, default=8090, help="Port to listen on")
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds to wait before answering")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503, help="HTTP status for failed requests")
+    
+    args = parser.parse_args()
+    
+    logger.info(f"Gemini stub on http://127.0.0.1:{args.port} - set GEMINI_API_BASE_URL to use it")
+    uvicorn.run(
+        create_app(args.latency, args.error_rate, args.error_status),
+        host="127.0.0.1",
+        port=args.port
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,7 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app.ml.pdf_processor import PDFProcessor
 from app.ml.rag_service import get_rag_service
+from app.ml.embeddings import get_embedding_service
 from app.config import settings
 
 logging.basicConfig(
@@ -30,7 +31,7 @@ def main():
     parser.add_argument(
         "--clear",
         action="store_true",
-        help="Clear existing vector store before indexing"
+        help="Clear existing vector store and re-add every chunk"
     )
     
     parser.add_argument(
@@ -63,7 +64,7 @@ def main():
     
     # Load chunks to RAG
     processor = PDFProcessor()
-    count = processor.load_chunks_to_rag()
+    count = processor.load_chunks_to_rag(full=args.clear)
     
     # Print stats
     stats = rag.get_stats()
@@ -71,9 +72,17 @@ def main():
     logger.info("\n" + "=" * 60)
     logger.info("Indexing Complete!")
     logger.info("=" * 60)
-    logger.info(f"Documents indexed: {count}")
+    logger.info(f"Documents added: {count}")
     logger.info(f"Total documents in store: {stats['document_count']}")
     logger.info(f"Persist directory: {stats['persist_directory']}")
+    
+    store = get_embedding_service().get_store()
+    if store is not None:
+        store_stats = store.get_stats()
+        logger.info(
+            f"Embedding store: {store_stats['reused']} reused, {store_stats['added']} added, "
+            f"{store_stats['vectors']} stored"
+        )
 
 
 if __name__ == "__main__":
@@ -46,6 +46,19 @@ def main():
         help="Also load chunks into RAG vector store"
     )
     
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Processes used to extract PDFs in parallel"
+    )
+    
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Reprocess every PDF instead of only new or modified ones"
+    )
+    
     args = parser.parse_args()
     
     logger.info("=" * 60)
@@ -53,12 +66,12 @@ def main():
     logger.info("=" * 60)
     
     # Initialize processor
-    processor = PDFProcessor(pdf_dir=args.pdf_dir)
+    processor = PDFProcessor(pdf_dir=args.pdf_dir, workers=args.workers)
     processor.output_dir = args.output_dir
     
     # Process all PDFs
     logger.info(f"Processing PDFs from: {args.pdf_dir}")
-    result = processor.process_all_pdfs()
+    result = processor.process_all_pdfs(full=args.full)
     
     # Print summary
     logger.info("\n" + "=" * 60)
@@ -66,6 +79,10 @@ def main():
     logger.info("=" * 60)
     logger.info(f"Status: {result['status']}")
     logger.info(f"Files processed: {result.get('files_processed', 0)}")
+    logger.info(f"Files unchanged: {result.get('files_unchanged', 0)}")
+    logger.info(f"Files removed: {result.get('files_removed', 0)}")
+    logger.info(f"Pages processed: {result.get('pages_processed', 0)} "
+                f"({result.get('pages_per_second', 0)} pages/sec)")
     logger.info(f"Total chunks: {result.get('total_chunks', 0)}")
     logger.info(f"Total Q&A pairs: {result.get('total_qa_pairs', 0)}")
     logger.info(f"Output directory: {result.get('output_dir', '')}")
@@ -74,11 +91,11 @@ def main():
         logger.info("\nPer-file results:")
         for r in result['results']:
             status_icon = "✓" if r['status'] == 'success' else "✗"
-            logger.info(f"  {status_icon} {r['file']}: {r.get('chunks', 0)} chunks, {r.get('qa_pairs', 0)} Q&A pairs")
+            logger.info(f"  {status_icon} {r['file']}: {r.get('pages', 0)} pages, {r.get('chunks', 0)} chunks, {r.get('qa_pairs', 0)} Q&A pairs")
     
     # Optionally load to RAG
-    if args.load_to_rag and result.get('total_chunks', 0) > 0:
-        logger.info("\nLoading chunks to RAG vector store...")
+    if args.load_to_rag and result['status'] == 'completed':
+        logger.info("\nSyncing chunks to RAG vector store...")
         count = processor.load_chunks_to_rag()
         logger.info(f"Loaded {count} documents to RAG")
     